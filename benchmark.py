@@ -0,0 +1,331 @@
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import random
+import argparse
+import platform
+import tempfile
+import contextlib
+from datetime import datetime
+from fake_replicate_server import FakeReplicateServer
+
+# GLOBAL VARIABLES for easy tweaks
+
+# Where benchmark runs are saved, one JSON file per run
+BENCHMARK_RESULTS_DIR = "benchmark_results"
+
+# Concurrency levels tried for the query_lora_model.main loop, and the number of prompts per run
+BENCHMARK_CONCURRENCY_LEVELS = [1, 4, 8]
+BENCHMARK_PROMPTS = 10
+
+# Images per save_images call, and how many calls to time on their own
+BENCHMARK_NUM_OUTPUTS = 4
+BENCHMARK_SAVE_ROUNDS = 10
+
+# Number of create_model + start_training round trips to time
+BENCHMARK_TRAINING_ROUNDS = 10
+
+# Dataset sizes (number of source images) for the prepare_images / zip_images pipeline, and the source image size
+BENCHMARK_DATASET_SIZES = [10, 50, 200]
+BENCHMARK_SOURCE_IMAGE_SIZE = (1600, 1200)
+
+# A metric is flagged as a regression when it gets worse by more than this fraction
+REGRESSION_THRESHOLD = 0.10
+
+BENCHMARK_MODEL_VERSION = "fake/flux-lora:0123456789abcdef"
+
+# Tokens are only checked when a command runs (validate_config and the client initializers). Placeholders
+# let those checks pass, since every request here goes to the local stand-in.
+os.environ.setdefault("REPLICATE_API_TOKEN", "benchmark")
+os.environ.setdefault("HUGGING_FACE_TOKEN", "benchmark")
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(fraction * (len(values) - 1))))
+    return values[index]
+
+def latency_metrics(prefix, durations):
+    return {
+        f"{prefix}_count": len(durations),
+        f"{prefix}_p50_seconds": percentile(durations, 0.50),
+        f"{prefix}_p99_seconds": percentile(durations, 0.99),
+    }
+
+# Run fn quietly inside a scratch working directory with metrics going to a fresh JSONL file.
+# Returns (wall seconds, {stage: [span durations]}) so per-stage latency percentiles come from the existing spans.
+def measure(fn, *args, **kwargs):
+    import metrics_utils
+    import rate_limit_utils
+    import resilience_utils
+
+    original_cwd = os.getcwd()
+    work_dir = tempfile.mkdtemp(prefix="benchmark-")
+    events_file = os.path.join(work_dir, "events.jsonl")
+    metrics_utils.METRICS_JSONL_FILE = events_file
+    metrics_utils.METRICS_PROMETHEUS_FILE = os.path.join(work_dir, "metrics.prom")
+
+    # Every scenario starts with an idle scheduler, closed circuits and empty stage timings
+    rate_limit_utils.reset_scheduler()
+    resilience_utils.reset_circuit_breakers()
+    metrics_utils.reset_metrics()
+
+    try:
+        os.chdir(work_dir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            fn(*args, **kwargs)
+            elapsed = time.perf_counter() - started
+    finally:
+        metrics_utils.flush_events()
+        os.chdir(original_cwd)
+
+    spans = {}
+    if os.path.exists(events_file):
+        with open(events_file, 'r') as f:
+            for line in f:
+                event = json.loads(line)
+                if event["type"] == "span":
+                    spans.setdefault(event["stage"], []).append(event["duration"])
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return elapsed, spans
+
+# End-to-end query_lora_model.main: concurrent predictions, then downloading every output.
+# The thread-per-prompt mode runs at each concurrency level, then the async mode with every prompt in flight at once.
+def benchmark_generate(server, concurrency_levels, num_prompts):
+    import query_lora_model
+
+    query_lora_model.MODEL_VERSION = BENCHMARK_MODEL_VERSION
+    query_lora_model.CUSTOM_PROMPTS = [f"benchmark scene {index}" for index in range(num_prompts)]
+    query_lora_model.RESULT_CACHE_ENABLED = False
+
+    scenarios = [(f"generate_c{concurrency}", "threads", concurrency) for concurrency in concurrency_levels]
+    scenarios.append(("generate_async", "async", num_prompts))
+
+    results = {}
+    for name, mode, concurrency in scenarios:
+        print(f"  generate: {num_prompts} prompts, {mode} mode, up to {concurrency} at once")
+        query_lora_model.GENERATION_MODE = mode
+        query_lora_model.MAX_CONCURRENT_PROMPTS = concurrency
+        query_lora_model.MAX_IN_FLIGHT_PREDICTIONS = concurrency
+        elapsed, spans = measure(query_lora_model.main)
+        metrics = {
+            "wall_seconds": elapsed,
+            "prompts_per_second": num_prompts / elapsed,
+            "images_per_second": len(spans.get("download", [])) / elapsed,
+        }
+        metrics.update(latency_metrics("prompt", spans.get("run_model" if mode == "threads" else "prediction", [])))
+        metrics.update(latency_metrics("save_images", spans.get("save_images", [])))
+        metrics.update(latency_metrics("download", spans.get("download", [])))
+        results[name] = metrics
+    return results
+
+# save_images on its own: parallel streaming downloads of one prediction's outputs
+def benchmark_save_images(server, rounds, num_outputs):
+    import query_lora_model
+
+    print(f"  save_images: {rounds} rounds x {num_outputs} images")
+    urls = [f"{server.base_url}/files/benchmark/{index}.png" for index in range(num_outputs)]
+
+    def save_rounds():
+        for _ in range(rounds):
+            query_lora_model.save_images(urls, BENCHMARK_MODEL_VERSION, "benchmark", "png")
+
+    elapsed, spans = measure(save_rounds)
+    total_bytes = rounds * num_outputs * len(server.image)
+    metrics = {
+        "wall_seconds": elapsed,
+        "images_per_second": rounds * num_outputs / elapsed,
+        "megabytes_per_second": total_bytes / 1024 ** 2 / elapsed,
+    }
+    metrics.update(latency_metrics("save_images", spans.get("save_images", [])))
+    metrics.update(latency_metrics("download", spans.get("download", [])))
+    return {"save_images": metrics}
+
+# Replicate calls made by train_flux_lora: models.create and trainings.create
+def benchmark_training_api(server, rounds):
+    import replicate
+    import train_flux_lora
+
+    print(f"  training api: {rounds} rounds")
+    client = replicate.Client(api_token="benchmark", base_url=server.base_url)
+
+    def create_and_train():
+        for index in range(rounds):
+            model = train_flux_lora.create_model(client, "fake", f"benchmark-{index}", "private", "gpu-t4", "benchmark")
+            train_flux_lora.start_training(client, model, f"{server.base_url}/files/dataset.zip", 10, 16, "adamw8bit", 1,
+                                           "512", False, "TOK", 0.0004, "benchmark", "fake/repo",
+                                           "fake/trainer:0123456789abcdef", 0.1, 3)
+
+    elapsed, spans = measure(create_and_train)
+    metrics = {"wall_seconds": elapsed}
+    metrics.update(latency_metrics("create_model", spans.get("create_model", [])))
+    metrics.update(latency_metrics("start_training", spans.get("start_training", [])))
+    return {"training_api": metrics}
+
+def make_source_images(directory, count, size, seed=0):
+    from PIL import Image
+
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    for index in range(count):
+        noise = Image.effect_noise(size, 48)
+        color = Image.new("RGB", size, tuple(rng.randrange(256) for _ in range(3)))
+        image = Image.blend(color, noise.convert("RGB"), 0.5)
+        image.save(os.path.join(directory, f"source_{index:04d}.jpg"), quality=90)
+
+# prepare_images + zip_images (staged) and build_dataset_archive (streamed), cold and then warm (nothing changed)
+def benchmark_dataset(dataset_sizes, image_size):
+    import train_flux_lora
+    from dataset_archive_utils import build_dataset_archive
+    from image_normalization_utils import parse_max_resolution
+
+    max_side = parse_max_resolution(train_flux_lora.RESOLUTION)
+    results = {}
+    for count in dataset_sizes:
+        print(f"  dataset: {count} images")
+        data_dir = tempfile.mkdtemp(prefix="benchmark-dataset-")
+        try:
+            input_dir = os.path.join(data_dir, "initial_images")
+            make_source_images(input_dir, count, image_size)
+
+            def staged():
+                train_flux_lora.prepare_images(input_dir, os.path.join(data_dir, "prepared_images"), "TOK")
+                train_flux_lora.zip_images(os.path.join(data_dir, "prepared_images"), os.path.join(data_dir, "staged.zip"))
+
+            def streamed():
+                build_dataset_archive(input_dir, os.path.join(data_dir, "streamed.zip"), "TOK", True, max_side)
+
+            for name, fn in (("staged", staged), ("streamed", streamed)):
+                for run in ("cold", "warm"):
+                    elapsed, spans = measure(fn)
+                    metrics = {"wall_seconds": elapsed, "images_per_second": count / elapsed}
+                    for stage in ("prepare_images", "zip_images", "build_dataset_archive"):
+                        if stage in spans:
+                            metrics[f"{stage}_seconds"] = sum(spans[stage])
+                    results[f"dataset_{name}_{count}_{run}"] = metrics
+        finally:
+            shutil.rmtree(data_dir, ignore_errors=True)
+    return results
+
+def run_benchmarks(args):
+    suites = set(args.only or ["generate", "save", "training", "dataset"])
+    config = {key: value for key, value in vars(args).items() if key not in ("func", "output", "baseline")}
+
+    results = {}
+    with FakeReplicateServer(prediction_latency=args.latency, training_latency=args.latency, error_rate=args.error_rate,
+                             image_bytes=args.image_bytes, seed=0) as server:
+        os.environ["REPLICATE_BASE_URL"] = server.base_url
+        print(f"Fake Replicate API running at {server.base_url}")
+        if "generate" in suites:
+            results.update(benchmark_generate(server, args.concurrency, args.prompts))
+        if "save" in suites:
+            results.update(benchmark_save_images(server, args.save_rounds, args.num_outputs))
+        if "training" in suites:
+            results.update(benchmark_training_api(server, args.training_rounds))
+        server_stats = server.stats()
+    if "dataset" in suites:
+        results.update(benchmark_dataset(args.dataset_sizes, BENCHMARK_SOURCE_IMAGE_SIZE))
+
+    run = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": config,
+        "server": server_stats,
+        "results": results,
+    }
+    output = args.output or os.path.join(BENCHMARK_RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(run, f, indent=2, sort_keys=True)
+
+    print_results(results)
+    print(f"Results saved to '{output}'.")
+    if args.baseline:
+        return compare_runs(args.baseline, output, args.threshold)
+    return 0
+
+def print_results(results):
+    for scenario, metrics in sorted(results.items()):
+        print(scenario)
+        for name, value in sorted(metrics.items()):
+            print(f"  {name}: {value:.4f}" if isinstance(value, float) else f"  {name}: {value}")
+
+# Whether a larger value of this metric is better; throughput metrics end in "_per_second", timings in "_seconds"
+def _higher_is_better(name):
+    return name.endswith("_per_second")
+
+# Compare two saved runs metric by metric. Returns 1 if any metric regressed by more than threshold, else 0.
+def compare_runs(baseline_file, current_file, threshold=REGRESSION_THRESHOLD):
+    with open(baseline_file, 'r') as f:
+        baseline = json.load(f)["results"]
+    with open(current_file, 'r') as f:
+        current = json.load(f)["results"]
+
+    regressions = []
+    print(f"Comparing '{current_file}' against baseline '{baseline_file}' (threshold {threshold:.0%}):")
+    for scenario in sorted(set(baseline) & set(current)):
+        for name in sorted(set(baseline[scenario]) & set(current[scenario])):
+            if not (name.endswith("_seconds") or name.endswith("_per_second")):
+                continue
+            old, new = baseline[scenario][name], current[scenario][name]
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if _higher_is_better(name) else change
+            flag = ""
+            if worse > threshold:
+                flag = "  REGRESSION"
+                regressions.append(f"{scenario}.{name}")
+            elif worse < -threshold:
+                flag = "  improved"
+            print(f"  {scenario}.{name}: {old:.4f} -> {new:.4f} ({change:+.1%}){flag}")
+
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    print("No regressions.")
+    return 0
+
+def _int_list(value):
+    return [int(item) for item in value.split(",") if item]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Offline benchmarks against a local stand-in for the Replicate API.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks and save the results")
+    run_parser.add_argument("--only", nargs="+", choices=["generate", "save", "training", "dataset"],
+                            help="Run only these suites")
+    run_parser.add_argument("--latency", type=float, default=0.5, help="Seconds each fake prediction or training takes")
+    run_parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of fake API requests answered with 429")
+    run_parser.add_argument("--image-bytes", type=int, default=1024 * 1024, help="Size of each fake output image")
+    run_parser.add_argument("--concurrency", type=_int_list, default=BENCHMARK_CONCURRENCY_LEVELS,
+                            help="Comma separated concurrency levels for the generate suite")
+    run_parser.add_argument("--prompts", type=int, default=BENCHMARK_PROMPTS)
+    run_parser.add_argument("--num-outputs", type=int, default=BENCHMARK_NUM_OUTPUTS, help="Images per save_images call")
+    run_parser.add_argument("--save-rounds", type=int, default=BENCHMARK_SAVE_ROUNDS)
+    run_parser.add_argument("--training-rounds", type=int, default=BENCHMARK_TRAINING_ROUNDS)
+    run_parser.add_argument("--dataset-sizes", type=_int_list, default=BENCHMARK_DATASET_SIZES,
+                            help="Comma separated dataset sizes for the dataset suite")
+    run_parser.add_argument("--output", help="Result file (default: benchmark_results/<timestamp>.json)")
+    run_parser.add_argument("--baseline", help="Compare against this earlier result file when done")
+    run_parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    run_parser.set_defaults(func=run_benchmarks)
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two saved runs and flag regressions")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    compare_parser.set_defaults(func=lambda args: compare_runs(args.baseline, args.current, args.threshold))
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
@@ -0,0 +1,149 @@
+import sys
+import argparse
+from config_utils import ConfigError, is_replicate_error
+from resilience_utils import ResilienceError
+
+# Single entry point for the pipeline steps, meant for running each step as its own short job:
+#   python cli.py validate | prepare | zip | train | generate | grid | monitor
+# Each command imports only the modules it needs, so e.g. "prepare" never loads replicate or huggingface_hub,
+# and settings such as API tokens are checked when the command runs.
+
+def cmd_validate(args):
+    import train_flux_lora
+    import dataset_validation_utils
+    if args.min_side is not None:
+        dataset_validation_utils.MIN_IMAGE_SIDE = args.min_side
+    if args.max_distance is not None:
+        dataset_validation_utils.NEAR_DUPLICATE_MAX_DISTANCE = args.max_distance
+    train_flux_lora.VALIDATE_DATASET = True
+    train_flux_lora.validated_sources(args.input_dir or train_flux_lora.INPUT_DIR)
+
+def cmd_prepare(args):
+    import train_flux_lora
+    if args.no_validate:
+        train_flux_lora.VALIDATE_DATASET = False
+    input_dir = args.input_dir or train_flux_lora.INPUT_DIR
+    train_flux_lora.prepare_images(input_dir, args.output_dir or train_flux_lora.OUTPUT_DIR,
+                                   args.trigger_word or train_flux_lora.TRIGGER_WORD, train_flux_lora.validated_sources(input_dir))
+
+def cmd_zip(args):
+    import train_flux_lora
+    zip_file_name = args.zip_file or train_flux_lora.ZIP_FILE_NAME
+    compression = args.compression or train_flux_lora.ZIP_COMPRESSION
+    if args.input_dir:
+        if args.no_validate:
+            train_flux_lora.VALIDATE_DATASET = False
+        train_flux_lora.build_dataset_archive(args.input_dir, zip_file_name, args.trigger_word or train_flux_lora.TRIGGER_WORD,
+                                              train_flux_lora.NORMALIZE_IMAGES,
+                                              train_flux_lora.parse_max_resolution(train_flux_lora.RESOLUTION),
+                                              train_flux_lora.NORMALIZE_JPEG_QUALITY, compression,
+                                              train_flux_lora.NORMALIZE_MAX_WORKERS,
+                                              train_flux_lora.validated_sources(args.input_dir))
+    else:
+        train_flux_lora.zip_images(args.output_dir or train_flux_lora.OUTPUT_DIR, zip_file_name, compression)
+
+def cmd_train(args):
+    import train_flux_lora
+    if args.steps is not None:
+        train_flux_lora.STEPS = args.steps
+    if args.no_monitor:
+        train_flux_lora.MONITOR_TRAINING = False
+    train_flux_lora.main()
+
+def cmd_generate(args):
+    import query_lora_model
+    if args.mode is not None:
+        query_lora_model.GENERATION_MODE = args.mode
+    if args.concurrency is not None:
+        query_lora_model.MAX_CONCURRENT_PROMPTS = args.concurrency
+    if args.in_flight is not None:
+        query_lora_model.MAX_IN_FLIGHT_PREDICTIONS = args.in_flight
+    if args.webhook_url is not None:
+        query_lora_model.PREDICTION_WEBHOOK_URL = args.webhook_url
+    query_lora_model.main(args.prompts, args.manifest or query_lora_model.OUTPUT_MANIFEST_FILE)
+
+def cmd_grid(args):
+    import generation_grid
+    if args.mode is not None:
+        generation_grid.GENERATION_MODE = args.mode
+    if args.in_flight is not None:
+        generation_grid.MAX_IN_FLIGHT_PREDICTIONS = args.in_flight
+    generation_grid.main(args.spec)
+
+def cmd_monitor(args):
+    import asyncio
+    from config_utils import create_replicate_client
+    from training_monitor_utils import monitor_trainings
+
+    client = create_replicate_client()
+    results = asyncio.run(monitor_trainings(client, args.training_ids))
+    return 0 if all(getattr(training, "status", None) == "succeeded" for training in results.values()) else 1
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Prepare datasets, train FLUX LoRA models on Replicate and generate images.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    validate_parser = subparsers.add_parser("validate", help="Check the source images and write the validation report "
+                                                             "and the filtered manifest")
+    validate_parser.add_argument("--input-dir", help="Source images (default: INPUT_DIR)")
+    validate_parser.add_argument("--min-side", type=int, help="Smallest accepted shorter side in pixels (default: MIN_IMAGE_SIDE)")
+    validate_parser.add_argument("--max-distance", type=int, help="Largest perceptual hash distance treated as a near "
+                                                                  "duplicate (default: NEAR_DUPLICATE_MAX_DISTANCE)")
+    validate_parser.set_defaults(func=cmd_validate)
+
+    prepare_parser = subparsers.add_parser("prepare", help="Normalize the source images into the prepared images directory")
+    prepare_parser.add_argument("--input-dir", help="Source images (default: INPUT_DIR)")
+    prepare_parser.add_argument("--output-dir", help="Prepared images (default: OUTPUT_DIR)")
+    prepare_parser.add_argument("--trigger-word", help="Prefix of the prepared file names (default: TRIGGER_WORD)")
+    prepare_parser.add_argument("--no-validate", action="store_true", help="Prepare every source image without validating it")
+    prepare_parser.set_defaults(func=cmd_prepare)
+
+    zip_parser = subparsers.add_parser("zip", help="Zip the prepared images into the training archive")
+    zip_parser.add_argument("--output-dir", help="Prepared images to zip (default: OUTPUT_DIR)")
+    zip_parser.add_argument("--input-dir", help="Build the archive straight from these source images instead")
+    zip_parser.add_argument("--trigger-word", help="Prefix of the archived file names with --input-dir (default: TRIGGER_WORD)")
+    zip_parser.add_argument("--no-validate", action="store_true", help="Archive every source image with --input-dir without validating it")
+    zip_parser.add_argument("--zip-file", help="Archive to write (default: ZIP_FILE_NAME)")
+    zip_parser.add_argument("--compression", choices=["auto", "stored", "deflated", "bzip2", "lzma"],
+                            help="Compression method (default: ZIP_COMPRESSION)")
+    zip_parser.set_defaults(func=cmd_zip)
+
+    train_parser = subparsers.add_parser("train", help="Run the full training pipeline (train_flux_lora.py)")
+    train_parser.add_argument("--steps", type=int, help="Training steps (default: STEPS)")
+    train_parser.add_argument("--no-monitor", action="store_true", help="Return once the training has started")
+    train_parser.set_defaults(func=cmd_train)
+
+    generate_parser = subparsers.add_parser("generate", help="Generate images with the trained model (query_lora_model.py)")
+    generate_parser.add_argument("--mode", choices=["async", "threads"], help="How predictions are waited on (default: GENERATION_MODE)")
+    generate_parser.add_argument("--concurrency", type=int, help="Prompts running at once in threads mode (default: MAX_CONCURRENT_PROMPTS)")
+    generate_parser.add_argument("--in-flight", type=int, help="Predictions in flight at once in async mode (default: MAX_IN_FLIGHT_PREDICTIONS)")
+    generate_parser.add_argument("--webhook-url", help="Public URL forwarding to the local webhook receiver; async mode then "
+                                                       "waits for webhooks instead of polling (default: PREDICTION_WEBHOOK_URL)")
+    generate_parser.add_argument("--prompts", help="Stream jobs from a prompt file or JSONL file, or '-' for stdin "
+                                                   "(default: CUSTOM_PROMPTS)")
+    generate_parser.add_argument("--manifest", help="JSONL file the job results are appended to (default: OUTPUT_MANIFEST_FILE)")
+    generate_parser.set_defaults(func=cmd_generate)
+
+    grid_parser = subparsers.add_parser("grid", help="Compare generation settings over prompts and shared seeds (generation_grid.py)")
+    grid_parser.add_argument("--spec", help="JSON file with \"prompts\", \"parameters\" and \"seeds\" (default: the GRID_* settings)")
+    grid_parser.add_argument("--mode", choices=["async", "threads"], help="How predictions are waited on (default: GENERATION_MODE)")
+    grid_parser.add_argument("--in-flight", type=int, help="Predictions in flight at once in async mode (default: MAX_IN_FLIGHT_PREDICTIONS)")
+    grid_parser.set_defaults(func=cmd_grid)
+
+    monitor_parser = subparsers.add_parser("monitor", help="Follow trainings until they finish")
+    monitor_parser.add_argument("training_ids", nargs="+")
+    monitor_parser.set_defaults(func=cmd_monitor)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args) or 0
+    except Exception as e:
+        if not isinstance(e, (ResilienceError, ConfigError)) and not is_replicate_error(e):
+            raise
+        print(f"Error: {e}")
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,37 @@
+import os
+
+# Raised when a setting a command needs is missing or invalid
+class ConfigError(Exception):
+    pass
+
+_env_loaded = False
+
+# Load the .env file into the environment on first use. Variables already set in the environment take precedence.
+def load_env():
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
+
+def get_env(name, default=None):
+    load_env()
+    return os.getenv(name, default)
+
+def require_env(name):
+    value = get_env(name)
+    if not value:
+        raise ConfigError(f"{name} is not set in the environment or the .env file")
+    return value
+
+# Replicate client authenticated with REPLICATE_API_TOKEN. replicate is imported here so commands that never
+# talk to Replicate do not pay for it.
+def create_replicate_client():
+    import replicate
+    return replicate.Client(api_token=require_env("REPLICATE_API_TOKEN"))
+
+# True if error came from the replicate package. If replicate was never imported, it cannot be one of its errors.
+def is_replicate_error(error):
+    import sys
+    replicate = sys.modules.get("replicate")
+    return replicate is not None and isinstance(error, replicate.exceptions.ReplicateException)
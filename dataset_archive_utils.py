@@ -0,0 +1,150 @@
+import os
+import shutil
+import tempfile
+from zipfile import ZipFile, ZipInfo, BadZipFile, ZIP_STORED, ZIP_DEFLATED, ZIP_BZIP2, ZIP_LZMA
+from dataset_manifest_utils import HASH_CHUNK_SIZE, load_manifest, save_manifest, scan_sources, manifest_digest
+from image_normalization_utils import iter_normalized_images
+from metrics_utils import timed, increment
+
+# GLOBAL VARIABLES for easy tweaks
+
+# Compression for archive entries: "auto", "stored", "deflated", "bzip2" or "lzma".
+# "auto" stores already-compressed images (JPEG, PNG, WebP) as-is and deflates everything else.
+ARCHIVE_COMPRESSION = "auto"
+
+# Timestamp stored for every zip entry so identical inputs always produce an identical archive
+ZIP_ENTRY_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+COMPRESSION_METHODS = {
+    "stored": ZIP_STORED,
+    "deflated": ZIP_DEFLATED,
+    "bzip2": ZIP_BZIP2,
+    "lzma": ZIP_LZMA,
+}
+
+# Extensions whose content is already compressed, so deflating them only costs CPU
+PRECOMPRESSED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+# Pick the zip compression method for one entry
+def compression_for(arcname, compression=ARCHIVE_COMPRESSION):
+    if compression == "auto":
+        return ZIP_STORED if arcname.lower().endswith(PRECOMPRESSED_EXTENSIONS) else ZIP_DEFLATED
+    if compression not in COMPRESSION_METHODS:
+        raise ValueError(f"Unknown archive compression '{compression}'. "
+                         f"Options: auto, {', '.join(COMPRESSION_METHODS)}")
+    return COMPRESSION_METHODS[compression]
+
+# Zip entry with fixed timestamp and attributes so the archive bytes only depend on the content
+def _make_zip_info(arcname, compression):
+    zip_info = ZipInfo(arcname, date_time=ZIP_ENTRY_DATE_TIME)
+    zip_info.create_system = 3
+    zip_info.external_attr = 0o644 << 16
+    zip_info.compress_type = compression_for(arcname, compression)
+    return zip_info
+
+# Write (arcname, source_path, data) members into a zip on any writable file object, including unseekable
+# upload streams. Members with data=None are streamed from source_path in chunks, otherwise data is written as-is.
+def write_archive(fileobj, members, compression=ARCHIVE_COMPRESSION, comment=b""):
+    count = 0
+    with ZipFile(fileobj, 'w') as zipf:
+        for arcname, source_path, data in members:
+            zip_info = _make_zip_info(arcname, compression)
+            if data is None:
+                zip_info.file_size = os.path.getsize(source_path)
+                with open(source_path, 'rb') as src, zipf.open(zip_info, 'w') as dest:
+                    shutil.copyfileobj(src, dest, HASH_CHUNK_SIZE)
+            else:
+                zipf.writestr(zip_info, data)
+            count += 1
+            print(f"Added {arcname} to archive")
+        zipf.comment = comment
+    return count
+
+# Write an archive to zip_file_name through a temp file that is renamed into place
+def write_archive_file(zip_file_name, members, compression=ARCHIVE_COMPRESSION, comment=b""):
+    zip_dir = os.path.dirname(os.path.abspath(zip_file_name))
+    fd, temp_path = tempfile.mkstemp(dir=zip_dir, prefix=".", suffix=".part")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            count = write_archive(f, members, compression, comment)
+        os.replace(temp_path, zip_file_name)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return count
+
+# True when zip_file_name exists and was built from the manifest with this digest
+def archive_is_current(zip_file_name, digest):
+    if not os.path.exists(zip_file_name):
+        return False
+    try:
+        with ZipFile(zip_file_name) as existing_zip:
+            return existing_zip.comment == digest.encode('ascii')
+    except BadZipFile:
+        print(f"'{zip_file_name}' is corrupt and will be rebuilt.")
+        return False
+
+# Manifest kept next to an archive that is built without a staging directory
+def archive_manifest_path(zip_file_name):
+    return f"{zip_file_name}.manifest.json"
+
+# Build the training archive straight from input_dir, renaming images on the fly and without a staging copy.
+# Normalized images are encoded in a process pool and written from memory; raw images are streamed from disk.
+# The archive is only rewritten when the sources, settings or compression change.
+# sources limits the archive to those file names, e.g. the images accepted by validate_dataset.
+@timed("build_dataset_archive")
+def build_dataset_archive(input_dir, zip_file_name, token, normalize=True, max_side=1024, jpeg_quality=95,
+                          compression=ARCHIVE_COMPRESSION, max_workers=None, sources=None):
+    manifest_path = archive_manifest_path(zip_file_name)
+    previous_manifest = load_manifest(manifest_path)
+
+    settings = {"normalize": normalize, "compression": compression}
+    if normalize:
+        settings.update(max_side=max_side, jpeg_quality=jpeg_quality)
+
+    # Skip sources that already failed to decode with these settings and have not changed since
+    previously_failed = set()
+    if previous_manifest and previous_manifest.get("settings") == settings:
+        previously_failed = {(entry["source"], entry["sha256"]) for entry in previous_manifest.get("failed", [])}
+
+    scanned = scan_sources(input_dir, previous_manifest, sources)
+    images = [entry for entry in scanned if (entry["source"], entry["sha256"]) not in previously_failed]
+    failed = [entry for entry in scanned if (entry["source"], entry["sha256"]) in previously_failed]
+    for i, entry in enumerate(images):
+        entry["output"] = f"{i}_A_photo_of_{token}.jpg"
+
+    digest = manifest_digest({"settings": settings, "images": images})
+    if archive_is_current(zip_file_name, digest):
+        print(f"'{zip_file_name}' is up to date, skipping rebuild.")
+        return zip_file_name
+
+    newly_failed = []
+
+    def members():
+        source_paths = [os.path.join(input_dir, entry["source"]) for entry in images]
+        if normalize:
+            results = iter_normalized_images(source_paths, max_side, jpeg_quality, max_workers)
+            for entry, (source_path, data, error) in zip(images, results):
+                if error is None:
+                    yield entry["output"], source_path, data
+                else:
+                    newly_failed.append(entry)
+        else:
+            for entry, source_path in zip(images, source_paths):
+                yield entry["output"], source_path, None
+
+    # The comment records the digest of what was planned; images that newly fail change it on the next run,
+    # which then rebuilds once without them.
+    count = write_archive_file(zip_file_name, members(), compression, digest.encode('ascii'))
+
+    increment("images_archived_total", count)
+    failed_sources = {entry["source"] for entry in newly_failed}
+    save_manifest(manifest_path, {
+        "token": token,
+        "settings": settings,
+        "images": [entry for entry in images if entry["source"] not in failed_sources],
+        "failed": failed + newly_failed,
+    })
+    print(f"Archived {count} images from '{input_dir}' into '{zip_file_name}' ({len(failed) + len(newly_failed)} skipped as unreadable).")
+    return zip_file_name
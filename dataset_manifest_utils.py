@@ -0,0 +1,78 @@
+import os
+import json
+import hashlib
+import tempfile
+
+# GLOBAL VARIABLES for easy tweaks
+
+# Name of the manifest written next to the prepared images
+MANIFEST_FILE_NAME = ".manifest.json"
+
+# File extensions treated as training images
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Read size used when hashing files (bytes)
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Compute the SHA-256 of a file without loading it into memory
+def hash_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+# List the image files in a directory in a stable order
+def list_image_files(directory):
+    return sorted(f for f in os.listdir(directory) if f.lower().endswith(IMAGE_EXTENSIONS))
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Manifest '{path}' is unreadable and will be rebuilt: {e}")
+        return None
+
+# Write the manifest to a temp file and rename it so a crash never leaves it half written
+def save_manifest(path, manifest):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".part")
+    with os.fdopen(fd, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+
+# Describe each source image by size, mtime and content hash.
+# Files whose size and mtime match the previous manifest reuse the recorded hash instead of being read again.
+# With sources (e.g. the images accepted by dataset validation), only those file names are included.
+def scan_sources(input_dir, previous_manifest=None, sources=None):
+    previous_sources = {}
+    if previous_manifest:
+        previous_sources = {entry["source"]: entry for entry in previous_manifest.get("images", [])}
+
+    file_names = list_image_files(input_dir)
+    if sources is not None:
+        sources = set(sources)
+        file_names = [file_name for file_name in file_names if file_name in sources]
+
+    entries = []
+    for file_name in file_names:
+        path = os.path.join(input_dir, file_name)
+        stat = os.stat(path)
+        previous = previous_sources.get(file_name)
+        if previous and previous["size"] == stat.st_size and previous["mtime_ns"] == stat.st_mtime_ns:
+            sha256 = previous["sha256"]
+        else:
+            sha256 = hash_file(path)
+        entries.append({"source": file_name, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256})
+    return entries
+
+# Digest of what ends up in the archive: the preparation settings, output names and their source content hashes
+def manifest_digest(manifest):
+    sha256 = hashlib.sha256()
+    sha256.update(json.dumps(manifest.get("settings"), sort_keys=True).encode('utf-8'))
+    for entry in sorted(manifest["images"], key=lambda e: e["output"]):
+        sha256.update(f"{entry['output']}\0{entry['sha256']}\n".encode('utf-8'))
+    return sha256.hexdigest()
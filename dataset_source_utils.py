@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import base64
+import tempfile
+from urllib.parse import urljoin
+from download_utils import get_session
+from dataset_manifest_utils import hash_file
+from resilience_utils import compute_backoff, is_retryable
+from config_utils import ConfigError
+from metrics_utils import span, increment
+
+# GLOBAL VARIABLES for easy tweaks
+
+# File remembering resolved Drive links and finished or partial uploads between runs
+DATASET_SOURCE_CACHE_FILE = ".dataset_source_cache.json"
+
+# Resolved Drive download links embed short-lived confirmation tokens, so they are only reused for this long
+DRIVE_LINK_CACHE_TTL = 3600  # seconds
+
+# Size of each chunk sent to the upload endpoint (bytes)
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Number of times an interrupted chunk is resumed before the upload is abandoned
+UPLOAD_MAX_RETRIES = 5
+
+# Timeout for each request to the upload endpoint in seconds
+UPLOAD_TIMEOUT = 60
+
+# A finished upload is reused without asking the server for this long. After that it is checked first,
+# because tus servers expire uploads, and uploaded again if the server no longer has it.
+UPLOAD_CACHE_TTL = 24 * 3600  # seconds
+
+TUS_VERSION = "1.0.0"
+
+def _load_cache(path):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Dataset source cache '{path}' is unreadable, starting fresh: {e}")
+        return {}
+
+def _save_cache(path, cache):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".part")
+    with os.fdopen(fd, 'w') as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+
+# Dataset hosted on Google Drive. The resolved direct download link is cached for DRIVE_LINK_CACHE_TTL.
+class GoogleDriveSource:
+    def __init__(self, link, cache_file=DATASET_SOURCE_CACHE_FILE, cache_ttl=DRIVE_LINK_CACHE_TTL):
+        self.link = link
+        self.cache_file = cache_file
+        self.cache_ttl = cache_ttl
+
+    # The local zip is not used: Drive serves whatever was uploaded to the shared link
+    def resolve(self, zip_file_name=None):
+        cache = _load_cache(self.cache_file)
+        key = f"gdrive:{self.link}"
+        entry = cache.get(key)
+        if entry and time.time() - entry["resolved_at"] < self.cache_ttl:
+            print("Using cached Google Drive download link.")
+            return entry["url"]
+
+        from gdrive_large_file_utils import generate_direct_download_link
+        url = generate_direct_download_link(self.link)
+        if not url.startswith(("http://", "https://")):
+            raise ConfigError(f"Could not resolve Google Drive link '{self.link}': {url}")
+
+        cache[key] = {"url": url, "resolved_at": time.time()}
+        _save_cache(self.cache_file, cache)
+        return url
+
+# Upload the local zip to a tus (resumable upload protocol) endpoint in chunks.
+# The resulting URL is cached by the zip's content hash, so an unchanged dataset is not uploaded twice while the
+# server keeps it, and a partial upload is resumed from the server's offset on the next run.
+# The trainer downloads the dataset without credentials. When the endpoint needs a token, download_url must be
+# a public URL prefix the finished upload can be fetched from; the upload's ID is appended to it.
+class FileUploadSource:
+    def __init__(self, upload_url, token=None, download_url=None, cache_file=DATASET_SOURCE_CACHE_FILE,
+                 chunk_size=UPLOAD_CHUNK_SIZE, max_retries=UPLOAD_MAX_RETRIES, cache_ttl=UPLOAD_CACHE_TTL):
+        if token and not download_url:
+            raise ValueError("Uploads made with a token cannot be downloaded by the trainer from the upload URL; "
+                             "set a public download URL for them")
+        self.upload_url = upload_url
+        self.token = token
+        self.download_url = download_url
+        self.cache_file = cache_file
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.cache_ttl = cache_ttl
+        self.session = get_session()
+
+    # URL the trainer downloads a finished upload from
+    def _public_url(self, location):
+        if not self.download_url:
+            return location
+        return self.download_url.rstrip("/") + "/" + location.rstrip("/").rsplit("/", 1)[-1]
+
+    def _headers(self, **extra):
+        headers = {"Tus-Resumable": TUS_VERSION}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        headers.update(extra)
+        return headers
+
+    def _create_upload(self, zip_file_name, size):
+        file_name = os.path.basename(zip_file_name)
+        metadata = f"filename {base64.b64encode(file_name.encode('utf-8')).decode('ascii')}"
+        response = self.session.post(self.upload_url, timeout=UPLOAD_TIMEOUT,
+                                     headers=self._headers(**{"Upload-Length": str(size), "Upload-Metadata": metadata}))
+        response.raise_for_status()
+        return urljoin(self.upload_url, response.headers["Location"])
+
+    # Offset the server already holds for an upload, or None if the upload no longer exists
+    def _get_offset(self, location):
+        response = self.session.head(location, timeout=UPLOAD_TIMEOUT, headers=self._headers())
+        if response.status_code in (403, 404, 410):
+            return None
+        response.raise_for_status()
+        return int(response.headers["Upload-Offset"])
+
+    def _send_chunks(self, location, zip_file_name, offset, size):
+        with open(zip_file_name, 'rb') as f:
+            while offset < size:
+                f.seek(offset)
+                chunk = f.read(self.chunk_size)
+                response = self.session.patch(location, data=chunk, timeout=UPLOAD_TIMEOUT, headers=self._headers(**{
+                    "Upload-Offset": str(offset),
+                    "Content-Type": "application/offset+octet-stream",
+                }))
+                response.raise_for_status()
+                increment("bytes_transferred_total", int(response.headers["Upload-Offset"]) - offset, direction="upload")
+                offset = int(response.headers["Upload-Offset"])
+                print(f"Uploaded {offset / 1024 ** 2:.1f} of {size / 1024 ** 2:.1f} MB")
+        return offset
+
+    def resolve(self, zip_file_name):
+        sha256 = hash_file(zip_file_name)
+        size = os.path.getsize(zip_file_name)
+        cache = _load_cache(self.cache_file)
+        key = f"upload:{self.upload_url}:{sha256}"
+        entry = cache.get(key)
+
+        if entry and entry.get("complete"):
+            fresh = time.time() - entry.get("verified_at", 0) < self.cache_ttl
+            if not fresh and self._get_offset(entry["url"]) == size:
+                entry["verified_at"] = time.time()
+                _save_cache(self.cache_file, cache)
+                fresh = True
+            if fresh:
+                print(f"'{zip_file_name}' was already uploaded, reusing {self._public_url(entry['url'])}")
+                return self._public_url(entry["url"])
+            print(f"The earlier upload of '{zip_file_name}' is gone from the server, uploading it again.")
+            entry = None
+
+        location = entry["url"] if entry else None
+        with span("dataset_upload"):
+            self._upload(zip_file_name, size, cache, key, location)
+        return self._public_url(cache[key]["url"])
+
+    def _upload(self, zip_file_name, size, cache, key, location):
+        for attempt in range(self.max_retries):
+            try:
+                offset = self._get_offset(location) if location else None
+                if offset is None:
+                    location = None
+                    location = self._create_upload(zip_file_name, size)
+                    offset = 0
+                    cache[key] = {"url": location, "complete": False}
+                    _save_cache(self.cache_file, cache)
+                elif offset:
+                    print(f"Resuming upload of '{zip_file_name}' at {offset / 1024 ** 2:.1f} MB")
+
+                self._send_chunks(location, zip_file_name, offset, size)
+                break
+            except Exception as e:
+                status_code = getattr(getattr(e, "response", None), "status_code", None)
+                if status_code in (401, 403):
+                    raise ConfigError(f"The upload endpoint {self.upload_url} rejected the request ({status_code}); "
+                                      f"check DATASET_UPLOAD_TOKEN") from e
+                # Rate limits, server errors and dropped connections are resumed. So are an offset conflict (409) or a
+                # vanished upload (404, 410) while sending chunks, which the next HEAD sorts out by resuming or
+                # starting over. Other client errors, such as a bad request or a wrong upload URL, are raised.
+                resumable = location is not None and status_code in (404, 409, 410)
+                if attempt == self.max_retries - 1 or not (resumable or is_retryable(e)):
+                    raise
+                print(f"Upload of '{zip_file_name}' interrupted: {e}. Resuming...")
+                time.sleep(compute_backoff(attempt))
+
+        cache[key] = {"url": location, "complete": True, "verified_at": time.time()}
+        _save_cache(self.cache_file, cache)
+        print(f"Uploaded '{zip_file_name}' to {location}")
+
+# Registered dataset sources, selected by name
+DATASET_SOURCES = {
+    "gdrive": GoogleDriveSource,
+    "upload": FileUploadSource,
+}
+
+def get_dataset_source(name, **options):
+    if name not in DATASET_SOURCES:
+        raise ValueError(f"Unknown dataset source '{name}'. Options: {', '.join(DATASET_SOURCES)}")
+    return DATASET_SOURCES[name](**options)
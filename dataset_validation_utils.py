@@ -0,0 +1,200 @@
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from dataset_manifest_utils import load_manifest, save_manifest, scan_sources, list_image_files
+from metrics_utils import timed, increment
+
+# GLOBAL VARIABLES for easy tweaks
+
+# Images whose shorter side (after EXIF rotation) is below this many pixels are rejected.
+# 512 is the smallest bucket in the trainer's default resolution "512, 768, 1024".
+MIN_IMAGE_SIDE = 512
+
+# Side of the perceptual hash grid: 8 gives a 64-bit hash
+PHASH_SIZE = 8
+
+# Images whose perceptual hashes differ in at most this many of the 64 bits are treated as near-duplicates
+NEAR_DUPLICATE_MAX_DISTANCE = 6
+
+# Cells of the pairwise distance matrix computed at once (8 bytes each), so memory stays bounded for large sets
+HAMMING_BLOCK_CELLS = 16 * 1024 ** 2
+
+# Images handed to each worker process at a time
+VALIDATION_CHUNK_SIZE = 8
+
+_dct_matrices = {}
+
+# Orthonormal DCT-II matrix, so the 2-D DCT of a square block is D @ block @ D.T
+def _dct_matrix(size):
+    import numpy as np
+
+    if size not in _dct_matrices:
+        n = np.arange(size)
+        matrix = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * size)) * np.sqrt(2 / size)
+        matrix[0] /= np.sqrt(2)
+        _dct_matrices[size] = matrix
+    return _dct_matrices[size]
+
+# 64-bit perceptual hash (pHash): the low frequencies of the DCT of a 32x32 greyscale thumbnail, one bit per
+# coefficient above their median. Resizing, recompression and small edits flip only a few bits.
+def perceptual_hash(image, hash_size=PHASH_SIZE):
+    import numpy as np
+    from PIL import Image
+
+    size = hash_size * 4
+    pixels = np.asarray(image.convert("L").resize((size, size), Image.LANCZOS), dtype=np.float64)
+    dct = _dct_matrix(size)
+    low_frequencies = (dct @ pixels @ dct.T)[:hash_size, :hash_size].flatten()
+    bits = low_frequencies > np.median(low_frequencies)
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+# Fully decode one image and describe it. Runs inside worker processes, so it must stay a top-level function.
+# Returns {"width", "height", "phash"} or {"error"}; errors are returned rather than raised so one bad file
+# does not abort the batch.
+def inspect_image(path, hash_size=PHASH_SIZE):
+    from PIL import Image, ImageOps
+
+    try:
+        with Image.open(path) as image:
+            image.load()
+            image = ImageOps.exif_transpose(image)
+            width, height = image.size
+            return {"width": width, "height": height, "phash": f"{perceptual_hash(image, hash_size):016x}"}
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+
+# Number of set bits per element of a uint64 array
+def _popcount(values):
+    import numpy as np
+
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    table = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+    return table[values.view(np.uint8)].reshape(values.shape + (8,)).sum(axis=-1)
+
+# All pairs (i, j), i < j, of 64-bit hashes within max_distance bits of each other.
+# Distances are computed a block of rows at a time with broadcasting, so large sets stay fast and memory stays bounded.
+def find_near_duplicate_pairs(hashes, max_distance=NEAR_DUPLICATE_MAX_DISTANCE, block_cells=HAMMING_BLOCK_CELLS):
+    import numpy as np
+
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    block_size = max(1, block_cells // max(1, len(hashes)))
+    pairs = []
+    for start in range(0, len(hashes), block_size):
+        block = hashes[start:start + block_size]
+        distances = _popcount(block[:, None] ^ hashes[None, :])
+        rows, columns = np.nonzero(distances <= max_distance)
+        rows += start
+        upper = columns > rows
+        pairs.extend(zip(rows[upper].tolist(), columns[upper].tolist(), distances[rows[upper] - start, columns[upper]].tolist()))
+    return pairs
+
+# Check every image in input_dir before it is paid for in training steps and upload bandwidth:
+# decode it in a process pool, reject unreadable images and images smaller than min_side, and among near-duplicates
+# keep only the largest shot. Results are cached in the report by content hash, so a rerun only inspects new files.
+# Writes the report (every image with its verdict) and the filtered manifest (accepted file names) for the zip stage,
+# and returns the accepted file names.
+@timed("validate_dataset")
+def validate_dataset(input_dir, report_path, manifest_path, min_side=MIN_IMAGE_SIDE,
+                     max_distance=NEAR_DUPLICATE_MAX_DISTANCE, max_workers=None):
+    previous_report = load_manifest(report_path)
+    previous_results = {}
+    if previous_report and previous_report.get("settings", {}).get("phash_size") == PHASH_SIZE:
+        previous_results = {entry["sha256"]: entry for entry in previous_report.get("images", []) if "sha256" in entry}
+
+    images = scan_sources(input_dir, previous_report)
+    to_inspect = [entry for entry in images if entry["sha256"] not in previous_results]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        paths = [os.path.join(input_dir, entry["source"]) for entry in to_inspect]
+        inspected = dict(zip((entry["sha256"] for entry in to_inspect),
+                             executor.map(inspect_image, paths, chunksize=VALIDATION_CHUNK_SIZE)))
+    print(f"Inspected {len(to_inspect)} images ({len(images) - len(to_inspect)} unchanged since the last validation).")
+
+    candidates = []
+    for entry in images:
+        result = inspected.get(entry["sha256"]) or previous_results[entry["sha256"]]
+        for key in ("width", "height", "phash", "error"):
+            if result.get(key) is not None:
+                entry[key] = result[key]
+        if "error" in entry:
+            entry["status"], entry["reason"] = "rejected", f"unreadable ({entry['error']})"
+        elif min(entry["width"], entry["height"]) < min_side:
+            entry["status"], entry["reason"] = "rejected", f"too small ({entry['width']}x{entry['height']}, minimum side {min_side})"
+        else:
+            entry["status"] = "accepted"
+            candidates.append(entry)
+
+    # Visit the largest images first, so each group of near-duplicates keeps its best shot
+    candidates.sort(key=lambda entry: (-entry["width"] * entry["height"], entry["source"]))
+    neighbours = {}
+    for i, j, distance in find_near_duplicate_pairs([int(entry["phash"], 16) for entry in candidates], max_distance):
+        neighbours.setdefault(i, []).append((j, distance))
+        neighbours.setdefault(j, []).append((i, distance))
+    for index, entry in enumerate(candidates):
+        if entry["status"] != "accepted":
+            continue
+        for other, distance in neighbours.get(index, []):
+            duplicate = candidates[other]
+            if other > index and duplicate["status"] == "accepted":
+                duplicate["status"] = "rejected"
+                duplicate["reason"] = f"near duplicate of {entry['source']} (distance {distance})"
+                duplicate["duplicate_of"] = entry["source"]
+
+    accepted = [entry["source"] for entry in images if entry["status"] == "accepted"]
+    rejected = [entry for entry in images if entry["status"] == "rejected"]
+    for entry in rejected:
+        print(f"Rejected {entry['source']}: {entry['reason']}")
+
+    summary = {"images": len(images), "accepted": len(accepted), "rejected": len(rejected)}
+    save_manifest(report_path, {
+        "input_dir": input_dir,
+        "settings": {"min_side": min_side, "max_distance": max_distance, "phash_size": PHASH_SIZE},
+        "summary": summary,
+        "images": images,
+    })
+    save_manifest(manifest_path, {
+        "input_dir": input_dir,
+        "settings": {"min_side": min_side, "max_distance": max_distance, "phash_size": PHASH_SIZE},
+        "scanned": [{"source": entry["source"], "size": entry["size"], "mtime_ns": entry["mtime_ns"]} for entry in images],
+        "sources": accepted,
+    })
+    increment("images_rejected_total", len(rejected))
+    print(f"Validated {len(images)} images in '{input_dir}': {len(accepted)} accepted, {len(rejected)} rejected. "
+          f"Report saved to '{report_path}'.")
+    return accepted
+
+# Accepted file names from a filtered manifest written by validate_dataset, or None if it is missing or out of date:
+# written for another directory or other settings, or any image was added, removed or changed since (size or mtime).
+# Only file metadata is read, so an up-to-date validation is reused without hashing or decoding anything.
+def load_validated_sources(manifest_path, input_dir, min_side=MIN_IMAGE_SIDE, max_distance=NEAR_DUPLICATE_MAX_DISTANCE):
+    manifest = load_manifest(manifest_path)
+    if manifest is None or "scanned" not in manifest:
+        return None
+    settings = {"min_side": min_side, "max_distance": max_distance, "phash_size": PHASH_SIZE}
+    if os.path.abspath(manifest.get("input_dir", "")) != os.path.abspath(input_dir) or manifest.get("settings") != settings:
+        return None
+
+    scanned = {entry["source"]: entry for entry in manifest["scanned"]}
+    file_names = list_image_files(input_dir)
+    if set(file_names) != set(scanned):
+        return None
+    for file_name in file_names:
+        stat = os.stat(os.path.join(input_dir, file_name))
+        if (stat.st_size, stat.st_mtime_ns) != (scanned[file_name]["size"], scanned[file_name]["mtime_ns"]):
+            return None
+    return manifest["sources"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate training images and filter out unreadable, small and near-duplicate ones.")
+    parser.add_argument("input_dir")
+    parser.add_argument("--report", default="dataset_validation.json", help="Report with the verdict for every image.")
+    parser.add_argument("--manifest", default="dataset_validated.json", help="Filtered manifest of accepted images.")
+    parser.add_argument("--min-side", type=int, default=MIN_IMAGE_SIDE)
+    parser.add_argument("--max-distance", type=int, default=NEAR_DUPLICATE_MAX_DISTANCE)
+    parser.add_argument("--workers", type=int, help="Worker processes (default: every CPU core)")
+    args = parser.parse_args()
+
+    validate_dataset(args.input_dir, args.report, args.manifest, args.min_side, args.max_distance, args.workers)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import os
+import tempfile
+import threading
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from resilience_utils import retry_call
+from metrics_utils import span, increment
+
+# GLOBAL VARIABLES for easy tweaks
+
+# Number of pooled connections kept open per host, also the default number of parallel downloads
+DOWNLOAD_POOL_SIZE = 8
+
+# Size of each chunk streamed from the response body to disk (bytes)
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# (connect, read) timeouts for a single download request in seconds
+DOWNLOAD_TIMEOUT = (10, 60)
+
+# Number of attempts per file before giving up, and the base of the jittered exponential backoff between them
+DOWNLOAD_MAX_RETRIES = 3
+DOWNLOAD_RETRY_DELAY = 1  # seconds
+
+_session = None
+_session_lock = threading.Lock()
+
+# Return the shared pooled session, creating it (and importing requests) on first use
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=DOWNLOAD_POOL_SIZE, pool_maxsize=DOWNLOAD_POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+# Stream the response body into a temp file next to file_name, then rename it into place
+def _stream_to_file(response, file_name, chunk_size):
+    directory = os.path.dirname(os.path.abspath(file_name))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".part")
+    bytes_written = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    f.write(chunk)
+                    bytes_written += len(chunk)
+        os.replace(temp_path, file_name)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return bytes_written
+
+# Copy a local file (e.g. a result cache entry) into place through a temp file
+def _copy_local_file(source_path, file_name):
+    directory = os.path.dirname(os.path.abspath(file_name))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".part")
+    os.close(fd)
+    try:
+        shutil.copyfile(source_path, temp_path)
+        os.replace(temp_path, file_name)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return os.path.getsize(file_name)
+
+# Download a single URL to file_name, retrying transient failures. Returns the number of bytes written.
+# Local file paths are copied instead, so cached outputs flow through the same code path.
+def download_file(url, file_name, session=None, chunk_size=DOWNLOAD_CHUNK_SIZE, max_retries=DOWNLOAD_MAX_RETRIES,
+                  retry_delay=DOWNLOAD_RETRY_DELAY):
+    url = str(url)
+    if not url.startswith(("http://", "https://")) and os.path.isfile(url):
+        return _copy_local_file(url, file_name)
+
+    session = session or get_session()
+
+    def attempt_download():
+        with session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+            return _stream_to_file(response, file_name, chunk_size)
+
+    # A GET can always be repeated safely, so every transient failure is retried
+    with span("download"):
+        bytes_written = retry_call(attempt_download, idempotent=True, breaker="downloads", max_attempts=max_retries,
+                                   base_delay=retry_delay, operation=f"Download of {url}")
+    increment("bytes_transferred_total", bytes_written, direction="download")
+    return bytes_written
+
+# Download several (url, file_name) pairs in parallel over the shared session.
+# Returns (url, file_name, error) tuples in input order; error is None on success.
+def download_files(downloads, max_workers=DOWNLOAD_POOL_SIZE):
+    downloads = list(downloads)
+    if not downloads:
+        return []
+
+    def download(item):
+        url, file_name = item
+        try:
+            download_file(url, file_name)
+            return url, file_name, None
+        except Exception as e:
+            return url, file_name, e
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(downloads))) as executor:
+        return list(executor.map(download, downloads))
@@ -0,0 +1,449 @@
+import os
+import re
+import json
+import time
+import hmac
+import uuid
+import base64
+import random
+import hashlib
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from urllib.request import Request, urlopen
+
+# GLOBAL VARIABLES for easy tweaks
+
+# Address the stand-in listens on. Port 0 picks a free port.
+FAKE_SERVER_HOST = "127.0.0.1"
+FAKE_SERVER_PORT = 0
+
+# Seconds a prediction or training "runs" before it succeeds, and the random spread applied to it (fraction, 0.2 = +/-20%)
+FAKE_PREDICTION_LATENCY = 0.5
+FAKE_TRAINING_LATENCY = 2
+FAKE_LATENCY_JITTER = 0.2
+
+# Fraction of requests answered with FAKE_ERROR_STATUS instead of a result. 429 responses carry "Retry-After: 0".
+FAKE_ERROR_RATE = 0.0
+FAKE_ERROR_STATUS = 429
+
+# Size of every hosted output image (bytes)
+FAKE_IMAGE_BYTES = 1024 * 1024
+
+FILE_CHUNK_SIZE = 64 * 1024
+
+# Predictions per page of the prediction list, as on Replicate
+LIST_PAGE_SIZE = 100
+
+# Seconds a tus upload is kept before it expires and HEAD answers 404, as tus servers do. None keeps uploads forever.
+FAKE_UPLOAD_EXPIRY = None
+
+def _now():
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+# Local stand-in for the parts of the Replicate HTTP API this project uses, plus hosting for the output images.
+# Point replicate.Client(base_url=server.base_url) or REPLICATE_BASE_URL at it to run the scripts without spending credits.
+# Predictions created with a "webhook" get the finished prediction posted there, signed like Replicate's webhooks.
+#   POST /v1/predictions                                  client.run / predictions.create (honours "Prefer: wait")
+#   GET  /v1/predictions                                  predictions.list (newest first, paginated)
+#   GET  /v1/predictions/<id>                             predictions.get
+#   POST /v1/predictions/<id>/cancel                      predictions.cancel
+#   GET  /v1/webhooks/default/secret                      webhooks.default.secret
+#   GET  /v1/models/<owner>/<name>/versions/<id>          version lookup done by client.run
+#   POST /v1/models                                       models.create
+#   POST /v1/models/<owner>/<name>/versions/<id>/trainings  trainings.create
+#   GET  /v1/trainings/<id>                               trainings.get
+#   GET  /files/...                                       generated images
+#   POST /uploads, HEAD|PATCH|GET /uploads/<id>           tus resumable uploads of datasets (FileUploadSource)
+class FakeReplicateServer:
+    def __init__(self, host=FAKE_SERVER_HOST, port=FAKE_SERVER_PORT, prediction_latency=FAKE_PREDICTION_LATENCY,
+                 training_latency=FAKE_TRAINING_LATENCY, latency_jitter=FAKE_LATENCY_JITTER, error_rate=FAKE_ERROR_RATE,
+                 error_status=FAKE_ERROR_STATUS, image_bytes=FAKE_IMAGE_BYTES, seed=None, upload_token=None,
+                 upload_expiry=FAKE_UPLOAD_EXPIRY):
+        self.prediction_latency = prediction_latency
+        self.training_latency = training_latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.image = os.urandom(image_bytes)
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.request_counts = {}
+        self.injected_errors = 0
+        self.webhooks_sent = 0
+        self.webhook_secret = "whsec_" + base64.b64encode(os.urandom(24)).decode("ascii")
+        self.upload_token = upload_token  # Bearer token the upload endpoint requires, if any
+        self.upload_expiry = upload_expiry
+        self.uploads = {}
+
+        self.httpd = ThreadingHTTPServer((host, port), _FakeReplicateHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake = self
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _latency(self, base):
+        return max(0.0, base * (1 + self.random.uniform(-self.latency_jitter, self.latency_jitter)))
+
+    def _count(self, route):
+        with self.lock:
+            self.request_counts[route] = self.request_counts.get(route, 0) + 1
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.injected_errors += 1
+                return True
+        return False
+
+    def _create_job(self, kind, body, **fields):
+        job_id = uuid.uuid4().hex[:20]
+        latency = self._latency(self.prediction_latency if kind == "prediction" else self.training_latency)
+        job = dict(fields, id=job_id, kind=kind, input=body.get("input") or {}, created=time.monotonic(),
+                   latency=latency, created_at=_now(), canceled=False)
+        with self.lock:
+            self.jobs[job_id] = job
+        if body.get("webhook"):
+            timer = threading.Timer(latency, self._send_webhook, (job, body["webhook"]))
+            timer.daemon = True
+            timer.start()
+        return job
+
+    # Post the finished job to its webhook with Replicate's signature headers. Delivery failures are ignored.
+    def _send_webhook(self, job, url):
+        payload = json.dumps(self._describe(job))
+        webhook_id = f"msg_{uuid.uuid4().hex}"
+        timestamp = str(int(time.time()))
+        key = base64.b64decode(self.webhook_secret.split("_", 1)[1])
+        digest = hmac.new(key, f"{webhook_id}.{timestamp}.{payload}".encode("utf-8"), hashlib.sha256).digest()
+        headers = {"Content-Type": "application/json", "webhook-id": webhook_id, "webhook-timestamp": timestamp,
+                   "webhook-signature": "v1," + base64.b64encode(digest).decode("ascii")}
+        try:
+            with urlopen(Request(url, data=payload.encode("utf-8"), headers=headers, method="POST"), timeout=10):
+                pass
+            with self.lock:
+                self.webhooks_sent += 1
+        except OSError:
+            pass
+
+    def _output(self, job):
+        if job["kind"] == "training":
+            destination = job.get("destination") or "fake/model"
+            return {"version": f"{destination}:{job['id']}", "weights": f"{self.base_url}/files/{job['id']}/weights.tar"}
+        output_format = job["input"].get("output_format", "png")
+        num_outputs = int(job["input"].get("num_outputs", 1))
+        return [f"{self.base_url}/files/{job['id']}/{index}.{output_format}" for index in range(num_outputs)]
+
+    # JSON for a job as the API would return it at this moment
+    def _describe(self, job):
+        elapsed = time.monotonic() - job["created"]
+        done = elapsed >= job["latency"] and not job["canceled"]
+        # client.run treats any status but "starting" as final after a blocking create
+        running_status = "starting" if job["kind"] == "prediction" else "processing"
+        if job["canceled"]:
+            running_status = "canceled"
+        data = {
+            "id": job["id"],
+            "model": job.get("model", "fake/model"),
+            "version": job.get("version", ""),
+            "status": "succeeded" if done else running_status,
+            "input": job["input"],
+            "output": self._output(job) if done else None,
+            "logs": "",
+            "error": None,
+            "metrics": {"predict_time": job["latency"]} if done else {},
+            "created_at": job["created_at"],
+            "started_at": job["created_at"],
+            "completed_at": _now() if done else None,
+            "urls": {"get": f"{self.base_url}/v1/{job['kind']}s/{job['id']}",
+                     "cancel": f"{self.base_url}/v1/{job['kind']}s/{job['id']}/cancel"},
+        }
+        if job["kind"] == "training":
+            data["destination"] = job.get("destination")
+            steps = int(job["input"].get("steps", 100))
+            step = steps if done else int(steps * elapsed / job["latency"])
+            data["logs"] = "".join(f"step {n}/{steps}\n" for n in range(0, step + 1, max(1, steps // 10)))
+        return data
+
+    # The upload with this ID, or None if it does not exist or has expired
+    def _get_upload(self, upload_id):
+        upload = self.uploads.get(upload_id)
+        if upload is not None and self.upload_expiry is not None and time.monotonic() - upload["created"] > self.upload_expiry:
+            return None
+        return upload
+
+    def stats(self):
+        with self.lock:
+            return {"requests": dict(self.request_counts), "injected_errors": self.injected_errors,
+                    "jobs": len(self.jobs), "webhooks_sent": self.webhooks_sent, "uploads": len(self.uploads)}
+
+class _FakeReplicateHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so pooled clients reuse connections as they would in production
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, data, headers=None):
+        payload = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_empty(self, status, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    # Authorization check for the upload endpoint; answers 401 and returns False when the token is wrong
+    def _upload_authorized(self):
+        token = self.server.fake.upload_token
+        if token is None or self.headers.get("Authorization") == f"Bearer {token}":
+            return True
+        self._send_empty(401)
+        return False
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    # Injected failure for a share of requests, as configured on the server
+    def _maybe_fail(self, route):
+        fake = self.server.fake
+        if not fake._count(route):
+            return False
+        headers = {"Retry-After": "0"} if fake.error_status == 429 else None
+        self._send_json(fake.error_status, {"title": "Injected failure", "detail": "Injected failure",
+                                            "status": fake.error_status}, headers)
+        return True
+
+    # "Prefer: wait" or "Prefer: wait=N" holds the response until the job is done or N seconds pass
+    def _hold_for_prefer_wait(self, job):
+        match = re.match(r"\s*wait(?:=(\d+))?", self.headers.get("Prefer", ""))
+        if not match:
+            return
+        limit = float(match.group(1) or 60)
+        remaining = job["latency"] - (time.monotonic() - job["created"])
+        if remaining > 0:
+            time.sleep(min(remaining, limit))
+
+    def do_HEAD(self):
+        fake = self.server.fake
+        match = re.fullmatch(r"/uploads/([^/]+)", urlparse(self.path).path)
+        if match is None:
+            self._send_empty(404)
+            return
+        # A HEAD response has no body, so an injected failure is sent without one
+        if fake._count("uploads.head"):
+            self._send_empty(fake.error_status, {"Retry-After": "0"} if fake.error_status == 429 else None)
+            return
+        if not self._upload_authorized():
+            return
+        with fake.lock:
+            upload = fake._get_upload(match.group(1))
+        if upload is None:
+            self._send_empty(404, {"Tus-Resumable": "1.0.0"})
+            return
+        self._send_empty(200, {"Tus-Resumable": "1.0.0", "Upload-Offset": str(len(upload["data"])),
+                               "Upload-Length": str(upload["length"]), "Cache-Control": "no-store"})
+
+    def do_PATCH(self):
+        fake = self.server.fake
+        length = int(self.headers.get("Content-Length") or 0)
+        chunk = self.rfile.read(length)
+        match = re.fullmatch(r"/uploads/([^/]+)", urlparse(self.path).path)
+        if match is None:
+            self._send_empty(404)
+            return
+        if self._maybe_fail("uploads.patch") or not self._upload_authorized():
+            return
+        with fake.lock:
+            upload = fake._get_upload(match.group(1))
+            if upload is None:
+                self._send_empty(404)
+                return
+            if int(self.headers.get("Upload-Offset", -1)) != len(upload["data"]):
+                self._send_empty(409)
+                return
+            upload["data"] += chunk[:upload["length"] - len(upload["data"])]
+            offset = len(upload["data"])
+        self._send_empty(204, {"Tus-Resumable": "1.0.0", "Upload-Offset": str(offset)})
+
+    def do_GET(self):
+        fake = self.server.fake
+        path = urlparse(self.path).path
+
+        match = re.fullmatch(r"/uploads/([^/]+)", path)
+        if match:
+            # Finished uploads are served without authorization, like a public download URL
+            with fake.lock:
+                upload = fake._get_upload(match.group(1))
+            if upload is None or len(upload["data"]) < upload["length"]:
+                self._send_empty(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/zip")
+            self.send_header("Content-Length", str(upload["length"]))
+            self.end_headers()
+            self.wfile.write(bytes(upload["data"]))
+            return
+
+        if path.startswith("/files/"):
+            if self._maybe_fail("files"):
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(fake.image)))
+            self.end_headers()
+            for offset in range(0, len(fake.image), FILE_CHUNK_SIZE):
+                self.wfile.write(fake.image[offset:offset + FILE_CHUNK_SIZE])
+            return
+
+        if path == "/v1/predictions":
+            if self._maybe_fail("predictions.list"):
+                return
+            offset = int(parse_qs(urlparse(self.path).query).get("cursor", ["0"])[0])
+            with fake.lock:
+                predictions = [job for job in reversed(list(fake.jobs.values())) if job["kind"] == "prediction"]
+            page = predictions[offset:offset + LIST_PAGE_SIZE]
+            next_url = None
+            if offset + LIST_PAGE_SIZE < len(predictions):
+                next_url = f"{fake.base_url}/v1/predictions?cursor={offset + LIST_PAGE_SIZE}"
+            self._send_json(200, {"previous": None, "next": next_url, "results": [fake._describe(job) for job in page]})
+            return
+
+        if path == "/v1/webhooks/default/secret":
+            if self._maybe_fail("webhooks.secret"):
+                return
+            self._send_json(200, {"key": fake.webhook_secret})
+            return
+
+        match = re.fullmatch(r"/v1/(predictions|trainings)/([^/]+)", path)
+        if match:
+            if self._maybe_fail(f"{match.group(1)}.get"):
+                return
+            job = fake.jobs.get(match.group(2))
+            if job is None:
+                self._send_json(404, {"detail": "Not found", "status": 404})
+            else:
+                self._send_json(200, fake._describe(job))
+            return
+
+        match = re.fullmatch(r"/v1/models/([^/]+)/([^/]+)/versions/([^/]+)", path)
+        if match:
+            if self._maybe_fail("versions.get"):
+                return
+            self._send_json(200, {"id": match.group(3), "created_at": _now(), "cog_version": "0.9.0",
+                                  "openapi_schema": {"components": {"schemas": {"Output": {"type": "array",
+                                                                                         "items": {"type": "string"}}}}}})
+            return
+
+        self._send_json(404, {"detail": "Not found", "status": 404})
+
+    def do_POST(self):
+        fake = self.server.fake
+        path = urlparse(self.path).path
+
+        if path == "/uploads":
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if self._maybe_fail("uploads.create") or not self._upload_authorized():
+                return
+            upload_id = uuid.uuid4().hex[:20]
+            with fake.lock:
+                fake.uploads[upload_id] = {"length": int(self.headers["Upload-Length"]), "data": bytearray(),
+                                           "created": time.monotonic()}
+            self._send_empty(201, {"Tus-Resumable": "1.0.0", "Location": f"/uploads/{upload_id}"})
+            return
+
+        body = self._read_body()
+
+        if path == "/v1/predictions":
+            if self._maybe_fail("predictions.create"):
+                return
+            job = fake._create_job("prediction", body, version=body.get("version", ""))
+            self._hold_for_prefer_wait(job)
+            self._send_json(201, fake._describe(job))
+            return
+
+        if path == "/v1/models":
+            if self._maybe_fail("models.create"):
+                return
+            owner, name = body.get("owner", "fake"), body.get("name", "model")
+            self._send_json(201, {"url": f"{fake.base_url}/{owner}/{name}", "owner": owner, "name": name,
+                                  "description": body.get("description"), "visibility": body.get("visibility", "public"),
+                                  "run_count": 0, "latest_version": None})
+            return
+
+        match = re.fullmatch(r"/v1/(predictions|trainings)/([^/]+)/cancel", path)
+        if match:
+            if self._maybe_fail(f"{match.group(1)}.cancel"):
+                return
+            job = fake.jobs.get(match.group(2))
+            if job is None:
+                self._send_json(404, {"detail": "Not found", "status": 404})
+                return
+            if time.monotonic() - job["created"] < job["latency"]:
+                job["canceled"] = True
+            self._send_json(200, fake._describe(job))
+            return
+
+        match = re.fullmatch(r"/v1/models/([^/]+)/([^/]+)/versions/([^/]+)/trainings", path)
+        if match:
+            if self._maybe_fail("trainings.create"):
+                return
+            job = fake._create_job("training", body, model=f"{match.group(1)}/{match.group(2)}",
+                                   version=match.group(3), destination=body.get("destination"))
+            self._send_json(201, fake._describe(job))
+            return
+
+        self._send_json(404, {"detail": "Not found", "status": 404})
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the Replicate API.")
+    parser.add_argument("--host", default=FAKE_SERVER_HOST)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--prediction-latency", type=float, default=FAKE_PREDICTION_LATENCY)
+    parser.add_argument("--training-latency", type=float, default=FAKE_TRAINING_LATENCY)
+    parser.add_argument("--error-rate", type=float, default=FAKE_ERROR_RATE)
+    parser.add_argument("--error-status", type=int, default=FAKE_ERROR_STATUS)
+    parser.add_argument("--image-bytes", type=int, default=FAKE_IMAGE_BYTES)
+    args = parser.parse_args()
+
+    server = FakeReplicateServer(args.host, args.port, args.prediction_latency, args.training_latency,
+                                 error_rate=args.error_rate, error_status=args.error_status, image_bytes=args.image_bytes)
+    print(f"Fake Replicate API listening on {server.base_url}")
+    print(f"Use it with: REPLICATE_BASE_URL={server.base_url} REPLICATE_API_TOKEN=fake python query_lora_model.py")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
@@ -1,6 +1,7 @@
 import requests
 from urllib.parse import urlparse, parse_qs
-from bs4 import BeautifulSoup
+from resilience_utils import retry_call
+from metrics_utils import timed
 
 def get_confirm_token(response):
     for key, value in response.cookies.items():
@@ -8,6 +9,7 @@ def get_confirm_token(response):
             return value
     return None
 
+@timed("generate_direct_download_link")
 def generate_direct_download_link(regular_link):
     file_id = None
     direct_download_url = None
@@ -25,17 +27,26 @@ def generate_direct_download_link(regular_link):
 
     session = requests.Session()
     
-    # Initial request to get confirmation token
+    # Initial request to get confirmation token.
+    # Error statuses are raised inside the retried call, so 429s and 5xx responses are retried (honouring Retry-After)
+    # and count towards the "gdrive" circuit breaker.
     base_url = "https://drive.google.com/uc?export=download"
-    initial_response = session.get(base_url, params={'id': file_id}, allow_redirects=True)
 
-    if initial_response.status_code != 200:
+    def fetch_file_info():
+        response = session.get(base_url, params={'id': file_id}, allow_redirects=True, timeout=30)
+        response.raise_for_status()
+        return response
+
+    try:
+        initial_response = retry_call(fetch_file_info, breaker="gdrive", operation="Google Drive link lookup")
+    except requests.HTTPError:
         return "Failed to fetch the file information from Google Drive."
 
     token = get_confirm_token(initial_response)
 
     if not token:
         # Parse the HTML to find the necessary fields for confirmation
+        from bs4 import BeautifulSoup
         soup = BeautifulSoup(initial_response.content, "html.parser")
         
         form = soup.select_one("form#download-form")
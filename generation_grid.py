@@ -0,0 +1,324 @@
+import os
+import sys
+import csv
+import json
+import time
+import html
+import functools
+import itertools
+from datetime import datetime
+from query_lora_model import (
+    validate_config, initialize_client, run_jobs_async, run_jobs_concurrently, save_images, MODEL_VERSION, CUSTOM_PROMPTS,
+    RUN_MODEL_PARAMETERS, GENERATION_MODE, MAX_IN_FLIGHT_PREDICTIONS, MAX_CONCURRENT_PROMPTS, PROMPT_TIMEOUT,
+    PREDICTION_WEBHOOK_URL, RESULT_CACHE_ENABLED, OUTPUT_STORE_ENABLED, OUTPUT_TRANSCODE_FORMAT,
+    DEFAULT_OUTPUT_FORMAT, DEFAULT_OUTPUT_QUALITY,
+)
+from result_cache_utils import ResultCache
+from output_store_utils import OutputStore
+from prompt_batch_utils import make_job_id
+from resilience_utils import ResilienceError
+from rate_limit_utils import get_scheduler, PRIORITY_BATCH
+from metrics_utils import print_summary, write_prometheus
+from config_utils import ConfigError, is_replicate_error
+
+# GLOBAL VARIABLES for easy tweaks
+
+# Prompts to compare. Every prompt is run in every cell of the grid with every seed.
+GRID_PROMPTS = CUSTOM_PROMPTS[:2]
+
+# Generation settings to compare; each combination is one cell of the grid. A dict maps each setting to a list of values
+# and tries every combination of them; a list of such dicts tries the combinations of each in turn, for settings that
+# only make sense together, like few steps for "schnell" and many for "dev". Parameters not listed keep their DEFAULT_* value.
+GRID_PARAMETERS = [
+    {"model": ["schnell"], "num_inference_steps": [4]},
+    {"model": ["dev"], "num_inference_steps": [28], "lora_scale": [0.8, 1]},
+]
+
+# Seeds shared by every cell, so cells differ only in their settings and the images can be compared side by side
+GRID_SEEDS = [1234, 5678]
+
+# Replicate bills fine-tuned FLUX models by GPU time. Price per second of the hardware they run on (H100), used to
+# estimate each cell's cost from the predictions' measured predict_time. Set to None to leave costs out.
+GPU_COST_PER_SECOND = 0.001525
+
+# Per-cell latency and cost table, and the contact sheet manifest (plus an HTML page of the same layout)
+GRID_RESULTS_FILE = "grid_results.csv"
+GRID_CONTACT_SHEET_FILE = "generated_images/grid_contact_sheet.json"
+GRID_CONTACT_SHEET_HTML_FILE = "generated_images/grid_contact_sheet.html"
+
+# Every combination of the listed values, for one dict or each dict of a list.
+# Every value must be a non-empty list, even a single setting: a bare string would be taken apart character by character.
+def expand_grid(parameters):
+    groups = parameters if isinstance(parameters, list) else [parameters]
+    if not groups or not all(isinstance(group, dict) for group in groups):
+        raise ValueError("Grid parameters must be a dict of setting lists, or a non-empty list of such dicts")
+    for group in groups:
+        for name, values in group.items():
+            if not isinstance(values, list) or not values:
+                raise ValueError(f"Grid parameter '{name}' must be a non-empty list of values, e.g. [{json.dumps(values)}]")
+
+    combinations = []
+    for group in groups:
+        names = sorted(group)
+        combinations += [dict(zip(names, values)) for values in itertools.product(*(group[name] for name in names))]
+    return combinations
+
+# The full run_model settings of each cell, dropping combinations that end up identical once the defaults are
+# filled in. Returns (cells, defaults); each cell is {"cell", "parameters"}, where parameters are only the grid values.
+def build_cells(parameters):
+    import query_lora_model
+
+    combinations = expand_grid(parameters)
+    names = {name for combination in combinations for name in combination}
+    if "seed" in names:
+        raise ValueError("Seeds are shared by every cell, set them in GRID_SEEDS instead of the grid parameters")
+    unknown = names - set(RUN_MODEL_PARAMETERS)
+    if unknown:
+        raise ValueError(f"Unknown grid parameters: {', '.join(sorted(unknown))}")
+
+    defaults = {name: getattr(query_lora_model, f"DEFAULT_{name.upper()}") for name in RUN_MODEL_PARAMETERS if name != "seed"}
+    cells = []
+    seen = set()
+    for combination in combinations:
+        key = json.dumps(dict(defaults, **combination), sort_keys=True)
+        if key not in seen:
+            seen.add(key)
+            cells.append({"cell": len(cells), "parameters": combination})
+    return cells, defaults
+
+# One job per prompt, cell and seed. Repeated prompts and seeds are dropped, so every job is a distinct prediction.
+# Jobs are ordered seed by seed, so the first images of every cell arrive early and can be compared while the rest run.
+def build_grid_jobs(prompts, cells, seeds):
+    prompts = list(dict.fromkeys(prompts))
+    seeds = list(dict.fromkeys(seeds))
+    if 0 in seeds:
+        raise ValueError("Seed 0 draws a random seed, which cannot be shared between cells")
+
+    jobs = []
+    for seed in seeds:
+        for prompt in prompts:
+            for cell in cells:
+                overrides = dict(cell["parameters"], seed=seed)
+                jobs.append({"id": make_job_id(prompt, overrides), "prompt": prompt, "overrides": overrides,
+                             "cell": cell["cell"], "seed": seed})
+    return jobs
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def _round(value, digits=2):
+    return round(value, digits) if value is not None else ""
+
+# Per-cell summary of the grid's results. Latency runs from submitting a prediction to seeing it finish and includes
+# queueing on Replicate, but not downloading its images; predict time is the GPU time Replicate bills. Cache hits keep the timings measured when
+# their prediction ran (see carry_over_timings), so a rerun still reports every cell.
+def summarize_cells(cells, results, cost_per_second=GPU_COST_PER_SECOND):
+    rows = []
+    for cell in cells:
+        cell_results = [result for result in results if result["cell"] == cell["cell"]]
+        succeeded = [result for result in cell_results if result["error"] is None]
+        latencies = [result["latency"] for result in succeeded if result["latency"] is not None]
+        timed = [result for result in succeeded if result["predict_time"] is not None]
+        predict_seconds = sum(result["predict_time"] for result in timed)
+        timed_images = sum(len(result["outputs"]) for result in timed)
+        cost = predict_seconds * cost_per_second if cost_per_second is not None and timed else None
+
+        rows.append(dict(
+            {f"param_{name}": value for name, value in cell["parameters"].items()},
+            cell=cell["cell"],
+            jobs=len(cell_results),
+            succeeded=len(succeeded),
+            failed=len(cell_results) - len(succeeded),
+            cached=sum(1 for result in succeeded if result["cached"]),
+            images=sum(len(result["outputs"]) for result in succeeded),
+            latency_mean_seconds=_round(sum(latencies) / len(latencies) if latencies else None),
+            latency_p50_seconds=_round(_percentile(latencies, 0.5) if latencies else None),
+            latency_p95_seconds=_round(_percentile(latencies, 0.95) if latencies else None),
+            predict_mean_seconds=_round(predict_seconds / len(timed) if timed else None),
+            predict_seconds_per_image=_round(predict_seconds / timed_images if timed_images else None),
+            cost_usd=_round(cost, 4),
+            cost_per_image_usd=_round(cost / timed_images if cost is not None and timed_images else None, 5),
+        ))
+    return rows
+
+def write_cell_table(rows, path=GRID_RESULTS_FILE):
+    parameter_names = sorted({name for row in rows for name in row if name.startswith("param_")})
+    fieldnames = ["cell", *parameter_names, "jobs", "succeeded", "failed", "cached", "images", "latency_mean_seconds",
+                  "latency_p50_seconds", "latency_p95_seconds", "predict_mean_seconds", "predict_seconds_per_image",
+                  "cost_usd", "cost_per_image_usd"]
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, restval="")
+        writer.writeheader()
+        writer.writerows(rows)
+
+# Contact sheet layout: one row per prompt and seed, one column per cell, each slot listing the saved images,
+# so the same seed can be compared across settings
+def build_contact_sheet(cells, defaults, results):
+    slots = {}
+    for result in results:
+        row = slots.setdefault((result["prompt"], result["seed"]), {})
+        row[str(result["cell"])] = {"job_id": result["id"], "images": result["outputs"], "error": result["error"],
+                                    "cached": result["cached"], "latency": result["latency"], "predict_time": result["predict_time"]}
+
+    return {
+        "model_version": MODEL_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "defaults": defaults,
+        "cells": cells,
+        "rows": [{"prompt": prompt, "seed": seed, "cells": row} for (prompt, seed), row in slots.items()],
+    }
+
+# Give cache hits the latency and predict time recorded for the same job by an earlier run's contact sheet
+def carry_over_timings(results, path=GRID_CONTACT_SHEET_FILE):
+    if not os.path.exists(path):
+        return
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            sheet = json.load(f)
+    except ValueError:
+        return
+    previous = {slot["job_id"]: slot for row in sheet.get("rows", []) for slot in row["cells"].values()}
+    for result in results:
+        slot = previous.get(result["id"])
+        if result["cached"] and result["error"] is None and slot is not None:
+            result["latency"] = slot.get("latency")
+            result["predict_time"] = slot.get("predict_time")
+
+def write_contact_sheet(sheet, path=GRID_CONTACT_SHEET_FILE, html_path=GRID_CONTACT_SHEET_HTML_FILE):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(sheet, f, indent=2, sort_keys=True)
+
+    if html_path is None:
+        return
+    base_dir = os.path.dirname(os.path.abspath(html_path))
+    header = "".join(
+        f"<th>{html.escape(', '.join(f'{name}={value}' for name, value in cell['parameters'].items()) or 'defaults')}</th>"
+        for cell in sheet["cells"])
+    body = []
+    for row in sheet["rows"]:
+        columns = []
+        for cell in sheet["cells"]:
+            slot = row["cells"].get(str(cell["cell"]), {})
+            content = "".join(
+                f'<img src="{html.escape(os.path.relpath(os.path.abspath(image), base_dir))}" width="256">'
+                for image in slot.get("images", []))
+            columns.append(f"<td>{content or html.escape(slot.get('error') or '')}</td>")
+        body.append(f"<tr><th>{html.escape(row['prompt'][:80])}<br>seed {row['seed']}</th>{''.join(columns)}</tr>")
+    with open(html_path, 'w', encoding='utf-8') as f:
+        f.write(f"<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>Generation grid</title></head><body>"
+                f"<table border=\"1\"><tr><th></th>{header}</tr>{''.join(body)}</table></body></html>\n")
+
+# Run every job of the grid through one executor, the same one query_lora_model.main uses, and save each result as
+# soon as it arrives. Fixed seeds make every job cacheable, so rerunning an interrupted grid only pays for the rest.
+# Returns one result dict per job with its saved images, prediction ID (None for cache hits), latency and predict time.
+# Both timings are taken where the executor sees the prediction finish, so downloads and queueing behind other results
+# on this thread are not counted.
+def run_grid(client, jobs, mode=GENERATION_MODE, result_cache=None, output_store=None):
+    submitted = {}
+    finished = {}
+
+    def record_submit(job_id, prediction_id):
+        submitted[job_id] = (prediction_id, time.monotonic())
+
+    def record_finish(job_id, prediction):
+        finished[job_id] = (time.monotonic(), (prediction.metrics or {}).get("predict_time"))
+
+    def prepare(jobs):
+        for job in jobs:
+            kwargs = dict(job["overrides"], cache=result_cache, on_submit=functools.partial(record_submit, job["id"]),
+                          on_finish=functools.partial(record_finish, job["id"]))
+            yield dict(job, kwargs=kwargs)
+
+    if mode == "async":
+        results = run_jobs_async(client, MODEL_VERSION, prepare(jobs), MAX_IN_FLIGHT_PREDICTIONS, PROMPT_TIMEOUT,
+                                 PRIORITY_BATCH, PREDICTION_WEBHOOK_URL)
+    else:
+        results = run_jobs_concurrently(client, MODEL_VERSION, prepare(jobs), MAX_CONCURRENT_PROMPTS, PROMPT_TIMEOUT,
+                                        priority=PRIORITY_BATCH)
+
+    grid_results = []
+    for job, output, error in results:
+        prediction_id, submitted_at = submitted.get(job["id"], (None, None))
+        finished_at, predict_time = finished.get(job["id"], (None, None))
+        saved = []
+        if error is None:
+            output_format = job["overrides"].get("output_format", DEFAULT_OUTPUT_FORMAT)
+            saved = save_images(output, MODEL_VERSION, job["id"], output_format, output_store, job["prompt"], job["seed"],
+                                OUTPUT_TRANSCODE_FORMAT, job["overrides"].get("output_quality", DEFAULT_OUTPUT_QUALITY))
+            if len(saved) < len(output):
+                error = RuntimeError(f"{len(output) - len(saved)} of {len(output)} images could not be downloaded")
+        if error is not None:
+            print(f"Grid job {job['id']} (cell {job['cell']}, seed {job['seed']}) failed: {error}")
+
+        grid_results.append({
+            "id": job["id"],
+            "prompt": job["prompt"],
+            "cell": job["cell"],
+            "seed": job["seed"],
+            "prediction_id": prediction_id,
+            "cached": error is None and prediction_id is None,
+            "latency": finished_at - submitted_at if submitted_at is not None and finished_at is not None else None,
+            "predict_time": predict_time,
+            "outputs": saved,
+            "error": str(error) if error is not None else None,
+        })
+    return grid_results
+
+def print_cell_table(cells, rows):
+    for cell, row in zip(cells, rows):
+        settings = ", ".join(f"{name}={value}" for name, value in cell["parameters"].items()) or "defaults"
+        print(f"Cell {cell['cell']} ({settings}): {row['succeeded']}/{row['jobs']} jobs, {row['images']} images, "
+              f"latency p50 {row['latency_p50_seconds'] or '-'}s, {row['predict_seconds_per_image'] or '-'}s GPU per image, "
+              f"${row['cost_per_image_usd'] or '-'} per image")
+
+# Usage: python generation_grid.py [spec.json]
+# A spec file may contain "prompts", "parameters" (a dict or a list of dicts, like GRID_PARAMETERS) and "seeds"
+def main(spec_path=None):
+    spec = {}
+    if spec_path:
+        with open(spec_path, 'r') as f:
+            spec = json.load(f)
+
+    cells, defaults = build_cells(spec.get("parameters", GRID_PARAMETERS))
+    jobs = build_grid_jobs(spec.get("prompts", GRID_PROMPTS), cells, spec.get("seeds", GRID_SEEDS))
+    print(f"Starting grid of {len(jobs)} jobs ({len(cells)} cells) at {datetime.now()}")
+
+    start_time = time.time()
+    validate_config()
+    client = initialize_client()
+    result_cache = ResultCache() if RESULT_CACHE_ENABLED else None
+    output_store = OutputStore() if OUTPUT_STORE_ENABLED else None
+    try:
+        results = run_grid(client, jobs, GENERATION_MODE, result_cache, output_store)
+    finally:
+        if result_cache is not None:
+            result_cache.close()
+        if output_store is not None:
+            output_store.close()
+
+    carry_over_timings(results)
+    rows = summarize_cells(cells, results)
+    write_cell_table(rows)
+    write_contact_sheet(build_contact_sheet(cells, defaults, results))
+    print_cell_table(cells, rows)
+
+    failed = sum(1 for result in results if result["error"] is not None)
+    print(f"Grid finished: {len(results) - failed} of {len(results)} jobs succeeded in {time.time() - start_time:.2f} seconds. "
+          f"Cell table written to '{GRID_RESULTS_FILE}', contact sheet to '{GRID_CONTACT_SHEET_FILE}'.")
+
+    get_scheduler().print_stats()
+    print_summary()
+    write_prometheus()
+
+if __name__ == "__main__":
+    try:
+        main(sys.argv[1] if len(sys.argv) > 1 else None)
+    except Exception as e:
+        if not isinstance(e, (ResilienceError, ConfigError)) and not is_replicate_error(e):
+            raise
+        print(f"Error: {e}")
+        exit(1)
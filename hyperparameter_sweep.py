@@ -0,0 +1,207 @@
+import sys
+import csv
+import json
+import math
+import time
+import random
+import asyncio
+import itertools
+from datetime import datetime
+import train_flux_lora
+from training_monitor_utils import monitor_trainings
+from config_utils import require_env
+
+# GLOBAL VARIABLES for easy tweaks
+
+# "grid" tries every combination of SWEEP_PARAMETERS, "random" samples SWEEP_NUM_TRIALS of them
+SWEEP_MODE = "grid"
+
+# Values to try per training parameter. Lists are used as-is. For random search a parameter can also be
+# a range: {"min": 0.0001, "max": 0.001, "log": True}. Parameters not listed keep their train_flux_lora value.
+SWEEP_PARAMETERS = {
+    "steps": [1000, 2000],
+    "lora_rank": [16, 32],
+    "learning_rate": [0.0004],
+}
+
+SWEEP_NUM_TRIALS = 8  # Only used for random search
+SWEEP_RANDOM_SEED = 0  # Fixed seed so a random search can be reproduced
+
+# Maximum number of trainings running on Replicate at the same time
+MAX_CONCURRENT_JOBS = 2
+
+# CSV file the results table is written to, rewritten as each trial finishes
+SWEEP_RESULTS_FILE = "sweep_results.csv"
+
+# Parameters the trainer only accepts as whole numbers; sampled values are rounded
+INTEGER_PARAMETERS = {"steps", "lora_rank", "batch_size"}
+
+# Training parameters a sweep can vary
+TRIAL_PARAMETERS = ("steps", "lora_rank", "optimizer", "batch_size", "resolution", "autocaption", "learning_rate")
+
+# Current train_flux_lora values of the sweepable parameters, read at call time so edits made after import apply
+def default_trial_parameters():
+    return {name: getattr(train_flux_lora, name.upper()) for name in TRIAL_PARAMETERS}
+
+# Every combination of the listed values
+def expand_grid(parameters):
+    names = sorted(parameters)
+    return [dict(zip(names, values)) for values in itertools.product(*(parameters[name] for name in names))]
+
+# num_trials random combinations; ranges are sampled uniformly, or log-uniformly when "log" is set
+def sample_random(parameters, num_trials, seed=SWEEP_RANDOM_SEED):
+    rng = random.Random(seed)
+    trials = []
+    for _ in range(num_trials):
+        trial = {}
+        for name in sorted(parameters):
+            spec = parameters[name]
+            if isinstance(spec, dict):
+                low, high = spec["min"], spec["max"]
+                if spec.get("log"):
+                    trial[name] = 10 ** rng.uniform(math.log10(low), math.log10(high))
+                else:
+                    trial[name] = rng.uniform(low, high)
+                if name in INTEGER_PARAMETERS:
+                    trial[name] = int(round(trial[name]))
+            else:
+                trial[name] = rng.choice(spec)
+        trials.append(trial)
+    return trials
+
+# Check that every parameter spec suits the mode: grid search needs lists of values,
+# random search also takes {"min", "max"} ranges
+def validate_parameters(mode, parameters):
+    if not isinstance(parameters, dict):
+        raise ValueError("Sweep parameters must map parameter names to their values")
+    for name, spec in parameters.items():
+        if isinstance(spec, list):
+            if not spec:
+                raise ValueError(f"Sweep parameter '{name}' has no values")
+        elif isinstance(spec, dict) and mode == "random":
+            if "min" not in spec or "max" not in spec or spec["min"] > spec["max"]:
+                raise ValueError(f"Range for sweep parameter '{name}' needs \"min\" <= \"max\"")
+            if spec.get("log") and spec["min"] <= 0:
+                raise ValueError(f"Log range for sweep parameter '{name}' must be positive")
+        elif isinstance(spec, dict):
+            raise ValueError(f"Sweep parameter '{name}' is a range, which only random search supports; list its values instead")
+        else:
+            raise ValueError(f"Sweep parameter '{name}' must be a list of values, e.g. [{spec!r}]")
+
+# Turn a sweep spec into the full parameter set of each trial, dropping duplicate combinations
+def build_trials(mode, parameters, num_trials=SWEEP_NUM_TRIALS, seed=SWEEP_RANDOM_SEED):
+    if mode in ("grid", "random"):
+        validate_parameters(mode, parameters)
+    if mode == "grid":
+        combinations = expand_grid(parameters)
+    elif mode == "random":
+        combinations = sample_random(parameters, num_trials, seed)
+    else:
+        raise ValueError(f"Unknown sweep mode '{mode}'. Options: grid, random")
+
+    unknown = set(parameters) - set(TRIAL_PARAMETERS)
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters: {', '.join(sorted(unknown))}")
+
+    defaults = default_trial_parameters()
+    trials = []
+    seen = set()
+    for combination in combinations:
+        trial = dict(defaults, **combination)
+        key = json.dumps(trial, sort_keys=True)
+        if key not in seen:
+            seen.add(key)
+            trials.append(trial)
+    if mode == "random" and len(trials) < num_trials:
+        print(f"Only {len(trials)} of the {num_trials} sampled trials are distinct; duplicates were dropped.")
+    return trials
+
+def write_results(results, path=SWEEP_RESULTS_FILE):
+    fieldnames = ["trial", *TRIAL_PARAMETERS, "model", "hf_repo_id", "training_id", "status", "duration_seconds", "error"]
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        for row in sorted(results, key=lambda r: r["trial"]):
+            writer.writerow(row)
+
+# Create the model and HF repo for one trial, start its training and follow it until it is done.
+# The semaphore bounds how many trials are running on Replicate at once.
+async def run_trial(client, index, trial, dataset_url, semaphore, results, base_name, hf_token):
+    async with semaphore:
+        model_name = f"{base_name}-t{index}"
+        hf_repo_id = f"{train_flux_lora.HF_REPO_ID}-{model_name}"
+        row = dict(trial, trial=index, model=f"{train_flux_lora.REPLICATE_OWNER}/{model_name}", hf_repo_id=hf_repo_id,
+                   training_id="", status="", duration_seconds="", error="")
+        results.append(row)
+        started = time.time()
+
+        try:
+            model, _ = await asyncio.gather(
+                asyncio.to_thread(train_flux_lora.create_model, client, train_flux_lora.REPLICATE_OWNER, model_name,
+                                  train_flux_lora.VISIBILITY, train_flux_lora.HARDWARE, train_flux_lora.DESCRIPTION),
+                asyncio.to_thread(train_flux_lora.create_hf_repo, hf_token, hf_repo_id),
+            )
+            training = await asyncio.to_thread(
+                train_flux_lora.start_training, client, model, dataset_url, trial["steps"], trial["lora_rank"],
+                trial["optimizer"], trial["batch_size"], trial["resolution"], trial["autocaption"],
+                train_flux_lora.TRIGGER_WORD, trial["learning_rate"], hf_token, hf_repo_id, train_flux_lora.VERSION,
+                train_flux_lora.RETRY_DELAY, train_flux_lora.MAX_RETRIES)
+            row["training_id"] = training.id
+
+            final = (await monitor_trainings(client, [training.id]))[training.id]
+            if isinstance(final, Exception):
+                raise final
+            row["status"] = final.status
+            row["error"] = final.error or ""
+        except Exception as e:
+            row["status"] = "error"
+            row["error"] = str(e)
+            print(f"Trial {index} failed: {e}")
+        finally:
+            row["duration_seconds"] = round(time.time() - started)
+            write_results(results)
+
+# Run a whole sweep with one client and one dataset upload shared by every trial
+async def run_sweep(trials, max_concurrent_jobs=MAX_CONCURRENT_JOBS):
+    train_flux_lora.validate_config()
+    hf_token = require_env("HUGGING_FACE_TOKEN")
+    client = train_flux_lora.initialize_client()
+
+    # The dataset is built once at the largest resolution any trial asks for
+    input_dir = train_flux_lora.INPUT_DIR
+    zip_file_name = train_flux_lora.ZIP_FILE_NAME
+    max_side = max(train_flux_lora.parse_max_resolution(trial["resolution"]) for trial in trials)
+    train_flux_lora.build_dataset_archive(input_dir, zip_file_name, train_flux_lora.TRIGGER_WORD,
+                                          train_flux_lora.NORMALIZE_IMAGES, max_side,
+                                          train_flux_lora.NORMALIZE_JPEG_QUALITY, train_flux_lora.ZIP_COMPRESSION,
+                                          train_flux_lora.NORMALIZE_MAX_WORKERS,
+                                          train_flux_lora.validated_sources(input_dir))
+    dataset_url = train_flux_lora.resolve_dataset_url(zip_file_name)
+
+    base_name = train_flux_lora.generate_model_name(train_flux_lora.BASE_MODEL_NAME)
+    semaphore = asyncio.Semaphore(max_concurrent_jobs)
+    results = []
+    await asyncio.gather(*(run_trial(client, index, trial, dataset_url, semaphore, results, base_name, hf_token)
+                           for index, trial in enumerate(trials)))
+    return results
+
+# Usage: python hyperparameter_sweep.py [spec.json]
+# A spec file may contain "mode", "parameters", "num_trials", "seed" and "max_concurrent_jobs"
+def main():
+    spec = {}
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'r') as f:
+            spec = json.load(f)
+
+    trials = build_trials(spec.get("mode", SWEEP_MODE), spec.get("parameters", SWEEP_PARAMETERS),
+                          spec.get("num_trials", SWEEP_NUM_TRIALS), spec.get("seed", SWEEP_RANDOM_SEED))
+    max_concurrent_jobs = spec.get("max_concurrent_jobs", MAX_CONCURRENT_JOBS)
+    print(f"Starting sweep of {len(trials)} trials with up to {max_concurrent_jobs} running at once at {datetime.now()}")
+
+    results = asyncio.run(run_sweep(trials, max_concurrent_jobs))
+
+    succeeded = sum(1 for row in results if row["status"] == "succeeded")
+    print(f"Sweep finished: {succeeded} of {len(results)} trials succeeded. Results written to '{SWEEP_RESULTS_FILE}'.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import os
+import io
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from PIL import Image, ImageOps
+
+# GLOBAL VARIABLES for easy tweaks
+
+# JPEG quality used when re-encoding training images (1 to 95 is the useful range for Pillow)
+DEFAULT_JPEG_QUALITY = 95
+
+# Background colour used to flatten transparent PNGs before encoding to JPEG
+BACKGROUND_COLOR = (255, 255, 255)
+
+# Largest bucket from a trainer resolution string such as "512, 768, 1024"
+def parse_max_resolution(resolution):
+    return max(int(value) for value in str(resolution).split(",") if value.strip())
+
+# Decode an image, apply its EXIF orientation, flatten it to RGB and downscale it.
+# The shorter side is reduced to max_side so every training bucket can still be filled without upscaling.
+def _load_normalized(source_path, max_side):
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image)
+
+        if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, BACKGROUND_COLOR)
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+
+        width, height = image.size
+        scale = max_side / min(width, height)
+        if scale < 1:
+            image = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+        return image
+
+# Normalize an image and write it to dest_path as a real JPEG. Returns the (width, height) written.
+# Runs inside worker processes, so it must stay a top-level function.
+def normalize_image(source_path, dest_path, max_side, quality=DEFAULT_JPEG_QUALITY):
+    image = _load_normalized(source_path, max_side)
+    directory = os.path.dirname(os.path.abspath(dest_path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".part")
+    os.close(fd)
+    try:
+        image.save(temp_path, "JPEG", quality=quality, optimize=True)
+        os.replace(temp_path, dest_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return image.size
+
+# Normalize an image and return the encoded JPEG bytes, for writers that stream straight into an archive
+def normalize_image_to_bytes(source_path, max_side, quality=DEFAULT_JPEG_QUALITY):
+    image = _load_normalized(source_path, max_side)
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+# Normalize many (source_path, dest_path) pairs across all cores, printing progress as they finish.
+# Returns (source_path, dest_path, error) tuples in input order; error is None on success.
+def normalize_images(jobs, max_side, quality=DEFAULT_JPEG_QUALITY, max_workers=None):
+    jobs = list(jobs)
+    if not jobs:
+        return []
+
+    results = [None] * len(jobs)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(normalize_image, source_path, dest_path, max_side, quality): index
+            for index, (source_path, dest_path) in enumerate(jobs)
+        }
+        for completed, future in enumerate(as_completed(futures), start=1):
+            index = futures[future]
+            source_path, dest_path = jobs[index]
+            try:
+                width, height = future.result()
+                results[index] = (source_path, dest_path, None)
+                print(f"[{completed}/{len(jobs)}] Normalized {source_path} to {dest_path} ({width}x{height})")
+            except Exception as e:
+                results[index] = (source_path, dest_path, e)
+                print(f"[{completed}/{len(jobs)}] Failed to normalize {source_path}: {e}")
+    return results
+
+# Normalize source images across all cores and yield (source_path, jpeg_bytes, error) in input order.
+# Only a small window of images is in flight at once, so memory stays bounded for large datasets.
+def iter_normalized_images(source_paths, max_side, quality=DEFAULT_JPEG_QUALITY, max_workers=None):
+    source_paths = list(source_paths)
+    window = 2 * (max_workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = deque()
+        next_index = 0
+        for completed in range(1, len(source_paths) + 1):
+            while next_index < len(source_paths) and len(in_flight) < window:
+                source_path = source_paths[next_index]
+                in_flight.append((source_path, executor.submit(normalize_image_to_bytes, source_path, max_side, quality)))
+                next_index += 1
+
+            source_path, future = in_flight.popleft()
+            try:
+                data = future.result()
+                print(f"[{completed}/{len(source_paths)}] Normalized {source_path} ({len(data)} bytes)")
+                yield source_path, data, None
+            except Exception as e:
+                print(f"[{completed}/{len(source_paths)}] Failed to normalize {source_path}: {e}")
+                yield source_path, None, e
@@ -0,0 +1,229 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import hashlib
+import argparse
+import threading
+
+# GLOBAL VARIABLES for easy tweaks
+
+# SQLite file recording every generation batch and the state of each of its jobs
+JOB_STORE_FILE = "generation_jobs.db"
+
+# Job states. A job moves pending -> submitted (prediction ID recorded) -> succeeded (images saved) or failed.
+JOB_PENDING = "pending"
+JOB_SUBMITTED = "submitted"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+# Jobs in these states are picked up again when an unfinished batch is resumed
+RESUMABLE_STATES = (JOB_PENDING, JOB_SUBMITTED, JOB_FAILED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    batch_id TEXT PRIMARY KEY,
+    batch_key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    completed_at REAL
+);
+CREATE INDEX IF NOT EXISTS batches_by_key ON batches (batch_key, status);
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    batch_id TEXT NOT NULL REFERENCES batches (batch_id),
+    position INTEGER NOT NULL,
+    prompt TEXT NOT NULL,
+    seed INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    prediction_id TEXT,
+    output_paths TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_by_batch ON jobs (batch_id, position);
+"""
+
+# Identify a batch by what it would generate. With random seeds the settings hold seed 0, not the drawn seeds,
+# which are stored per job, so a crashed random-seed batch is still recognised.
+def make_batch_key(model_version, prompts, settings):
+    payload = json.dumps({"model_version": model_version, "prompts": list(prompts), "settings": settings},
+                         sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+# Persistent record of generation batches, so a crashed or interrupted run resumes where it stopped.
+# Each job keeps its seed and prediction ID, so a resumed job re-attaches to its prediction instead of paying for a new one.
+class JobStore:
+    def __init__(self, path=JOB_STORE_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def _execute(self, sql, parameters=()):
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    # Resume the unfinished batch with this key, or start a new one with a job per prompt.
+    # Returns (batch_id, jobs still to run, resumed). A seed of 0 draws a random seed per job.
+    def start_batch(self, batch_key, prompts, seed=0):
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT batch_id FROM batches WHERE batch_key = ? AND status = 'running' ORDER BY created_at DESC LIMIT 1",
+                (batch_key,)).fetchone()
+            resumed = row is not None
+            if resumed:
+                batch_id = row["batch_id"]
+                self._reopen_jobs("batch_id = ?", (batch_id,), now)
+            else:
+                batch_id = f"{batch_key[:12]}-{int(now * 1000)}"
+                self.connection.execute("BEGIN")
+                self.connection.execute("INSERT INTO batches (batch_id, batch_key, status, created_at) VALUES (?, ?, 'running', ?)",
+                                        (batch_id, batch_key, now))
+                self.connection.executemany(
+                    "INSERT INTO jobs (job_id, batch_id, position, prompt, seed, status, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(f"{batch_id}-{position}", batch_id, position, prompt, seed or random.randint(1, 1_000_000), JOB_PENDING, now)
+                     for position, prompt in enumerate(prompts)])
+                self.connection.execute("COMMIT")
+
+            jobs = self.connection.execute(
+                f"SELECT * FROM jobs WHERE batch_id = ? AND status IN ({','.join('?' * len(RESUMABLE_STATES))}) ORDER BY position",
+                (batch_id, *RESUMABLE_STATES)).fetchall()
+        return batch_id, [dict(job) for job in jobs], resumed
+
+    # Failed jobs are retried, so they start this run as pending again (keeping their prediction IDs).
+    # So are succeeded jobs whose images have since been deleted, e.g. by the output store's retention limit.
+    # Their predictions' output URLs may have expired, so they get new predictions with the same seed.
+    # Callers hold the lock.
+    def _reopen_jobs(self, condition, parameters, now):
+        self.connection.execute(f"UPDATE jobs SET status = ?, updated_at = ? WHERE {condition} AND status = ?",
+                                (JOB_PENDING, now, *parameters, JOB_FAILED))
+        for job in self.connection.execute(f"SELECT job_id, output_paths FROM jobs WHERE {condition} AND status = ?",
+                                           (*parameters, JOB_SUCCEEDED)).fetchall():
+            if not all(os.path.exists(path) for path in json.loads(job["output_paths"] or "[]")):
+                self.connection.execute("UPDATE jobs SET status = ?, prediction_id = NULL, updated_at = ? WHERE job_id = ?",
+                                        (JOB_PENDING, now, job["job_id"]))
+
+    # Resume the unfinished batch with this key, or start an empty one, for input that is streamed a job at a time.
+    # Returns (batch_id, resumed). Jobs are recorded with add_job as they are read.
+    def start_stream_batch(self, batch_key):
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT batch_id FROM batches WHERE batch_key = ? AND status = 'running' ORDER BY created_at DESC LIMIT 1",
+                (batch_key,)).fetchone()
+            if row is not None:
+                return row["batch_id"], True
+            batch_id = f"{batch_key[:12]}-{int(now * 1000)}"
+            self.connection.execute("INSERT INTO batches (batch_id, batch_key, status, created_at) VALUES (?, ?, 'running', ?)",
+                                    (batch_id, batch_key, now))
+        return batch_id, False
+
+    # Record a streamed job under its input job ID and return its stored state. A job a previous run already recorded
+    # keeps its seed and prediction ID, so it re-attaches to that prediction instead of paying for a new one.
+    # A seed of 0 draws a random seed.
+    def add_job(self, batch_id, input_job_id, position, prompt, seed=0):
+        job_id = f"{batch_id}-{input_job_id}"
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO jobs (job_id, batch_id, position, prompt, seed, status, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, batch_id, position, prompt, seed or random.randint(1, 1_000_000), JOB_PENDING, now))
+            self._reopen_jobs("job_id = ?", (job_id,), now)
+            job = self.connection.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return dict(job)
+
+    # Only pending or submitted jobs are updated: a job that already timed out or finished in this run keeps its
+    # final state even if its still-running thread reports a submission afterwards
+    def mark_submitted(self, job_id, prediction_id):
+        self._execute("UPDATE jobs SET status = ?, prediction_id = ?, attempts = attempts + 1, error = NULL, updated_at = ? "
+                      "WHERE job_id = ? AND status NOT IN (?, ?)",
+                      (JOB_SUBMITTED, prediction_id, time.time(), job_id, JOB_FAILED, JOB_SUCCEEDED))
+
+    def mark_succeeded(self, job_id, output_paths):
+        self._execute("UPDATE jobs SET status = ?, output_paths = ?, error = NULL, updated_at = ? WHERE job_id = ?",
+                      (JOB_SUCCEEDED, json.dumps(output_paths), time.time(), job_id))
+
+    # A failed job keeps its prediction ID, so a still-running prediction (e.g. one that only timed out locally)
+    # is re-attached on the next run rather than started again
+    def mark_failed(self, job_id, error):
+        self._execute("UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE job_id = ?",
+                      (JOB_FAILED, str(error), time.time(), job_id))
+
+    # Close the batch if every job succeeded. Returns True if it is now complete.
+    # With kept_job_ids, unfinished jobs not among them (e.g. lines since removed from a streamed input) are dropped first.
+    def finish_batch(self, batch_id, kept_job_ids=None):
+        with self.lock:
+            if kept_job_ids is not None:
+                kept_job_ids = set(kept_job_ids)
+                for job in self.connection.execute("SELECT job_id FROM jobs WHERE batch_id = ? AND status != ?",
+                                                   (batch_id, JOB_SUCCEEDED)).fetchall():
+                    if job["job_id"] not in kept_job_ids:
+                        self.connection.execute("DELETE FROM jobs WHERE job_id = ?", (job["job_id"],))
+            remaining = self.connection.execute("SELECT COUNT(*) FROM jobs WHERE batch_id = ? AND status != ?",
+                                                (batch_id, JOB_SUCCEEDED)).fetchone()[0]
+            if remaining == 0:
+                self.connection.execute("UPDATE batches SET status = 'completed', completed_at = ? WHERE batch_id = ?",
+                                        (time.time(), batch_id))
+        return remaining == 0
+
+    # Stop resuming unfinished batches, so the next run starts from scratch
+    def abandon_batches(self, batch_id=None):
+        sql = "UPDATE batches SET status = 'abandoned' WHERE status = 'running'"
+        parameters = ()
+        if batch_id is not None:
+            sql += " AND batch_id = ?"
+            parameters = (batch_id,)
+        with self.lock:
+            return self.connection.execute(sql, parameters).rowcount
+
+    # Job counts per state for every batch, newest first
+    def batch_summaries(self):
+        batches = self._execute("SELECT * FROM batches ORDER BY created_at DESC")
+        summaries = []
+        for batch in batches:
+            counts = dict(self._execute("SELECT status, COUNT(*) FROM jobs WHERE batch_id = ? GROUP BY status",
+                                        (batch["batch_id"],)))
+            summaries.append(dict(batch, jobs=counts))
+        return summaries
+
+    def jobs(self, batch_id):
+        return [dict(job) for job in self._execute("SELECT * FROM jobs WHERE batch_id = ? ORDER BY position", (batch_id,))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the generation job store.")
+    parser.add_argument("--store", default=JOB_STORE_FILE, help="Job store file.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("batches", help="List batches and their job counts, newest first.")
+    jobs_parser = subparsers.add_parser("jobs", help="List the jobs of a batch.")
+    jobs_parser.add_argument("batch_id")
+    abandon_parser = subparsers.add_parser("abandon", help="Stop resuming unfinished batches.")
+    abandon_parser.add_argument("batch_id", nargs="?", help="Batch to abandon. Abandons every unfinished batch if omitted.")
+    args = parser.parse_args()
+
+    store = JobStore(args.store)
+
+    if args.command == "batches":
+        for batch in store.batch_summaries():
+            created = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(batch["created_at"]))
+            counts = ", ".join(f"{count} {status}" for status, count in sorted(batch["jobs"].items()))
+            print(f"{batch['batch_id']}  {batch['status']:<9}  created {created}  {counts}")
+    elif args.command == "jobs":
+        for job in store.jobs(args.batch_id):
+            print(f"{job['job_id']}  {job['status']:<9}  seed {job['seed']}  prediction {job['prediction_id'] or '-'}  "
+                  f"{job['error'] or job['prompt'][:60]}")
+    elif args.command == "abandon":
+        abandoned = store.abandon_batches(args.batch_id)
+        print(f"Abandoned {abandoned} unfinished batches.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import atexit
+import threading
+import functools
+from contextlib import contextmanager
+
+# GLOBAL VARIABLES for easy tweaks
+
+# Set to False to turn off all timing and counters
+METRICS_ENABLED = True
+
+# Every span and counter update is appended here as one JSON object per line, e.g. "metrics/events.jsonl".
+# Off by default: the stage summary and the Prometheus snapshot do not need it. Set METRICS_JSONL_FILE to enable.
+METRICS_JSONL_FILE = os.getenv("METRICS_JSONL_FILE") or None
+
+# Events are buffered in memory and appended this many at a time (and at exit), so hot paths never touch the disk
+METRICS_JSONL_FLUSH_EVENTS = 1000
+
+# Once the event log grows past this size it is renamed to "<file>.1" (replacing the previous one) and started afresh
+METRICS_JSONL_MAX_BYTES = 100 * 1024 ** 2  # 100 MB
+
+# Prometheus text-format snapshot written by write_prometheus(). Set to None to disable.
+METRICS_PROMETHEUS_FILE = os.getenv("METRICS_PROMETHEUS_FILE", "metrics/metrics.prom")
+
+METRIC_PREFIX = "flux_lora_"
+
+_lock = threading.Lock()
+_durations = {}  # (stage, labels) -> {"count", "sum", "max"}
+_counters = {}  # (name, labels) -> value
+_pending_events = []
+_flush_lock = threading.Lock()
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _emit(event):
+    if not METRICS_JSONL_FILE:
+        return
+    with _lock:
+        _pending_events.append(event)
+        full = len(_pending_events) >= METRICS_JSONL_FLUSH_EVENTS
+    if full:
+        flush_events()
+
+# Append the buffered events to the event log, rotating it first if it has grown too large
+def flush_events():
+    with _flush_lock:
+        with _lock:
+            events = _pending_events[:]
+            del _pending_events[:]
+        path = METRICS_JSONL_FILE
+        if not events or not path:
+            return
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if METRICS_JSONL_MAX_BYTES is not None and os.path.exists(path) and os.path.getsize(path) > METRICS_JSONL_MAX_BYTES:
+            os.replace(path, f"{path}.1")
+        with open(path, 'a') as f:
+            f.write("".join(json.dumps(event, sort_keys=True) + "\n" for event in events))
+
+atexit.register(flush_events)
+
+# Forget every recorded duration, counter and unflushed event, e.g. between benchmark scenarios
+def reset_metrics():
+    with _lock:
+        _durations.clear()
+        _counters.clear()
+        del _pending_events[:]
+
+# Record a duration for a stage without a context manager, e.g. a wait measured elsewhere
+def observe(stage, seconds, error=False, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = (stage, _label_key(labels))
+    with _lock:
+        stats = _durations.setdefault(key, {"count": 0, "sum": 0.0, "max": 0.0})
+        stats["count"] += 1
+        stats["sum"] += seconds
+        stats["max"] = max(stats["max"], seconds)
+    _emit({"type": "span", "ts": time.time(), "stage": stage, "duration": seconds, "error": error, "labels": labels})
+
+# Add to a counter such as bytes transferred or images written
+def increment(name, value=1, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = (name, _label_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+    _emit({"type": "counter", "ts": time.time(), "name": name, "value": value, "labels": labels})
+
+# Time the enclosed block as one span of a stage
+@contextmanager
+def span(stage, **labels):
+    started = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        observe(stage, time.perf_counter() - started, error=error, **labels)
+
+# Decorator form of span for whole functions
+def timed(stage, **labels):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = []
+    for key, value in labels:
+        value = value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        escaped.append(f'{key}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+# Current metrics in the Prometheus text exposition format
+def format_prometheus():
+    with _lock:
+        durations = dict(_durations)
+        counters = dict(_counters)
+
+    lines = []
+    if durations:
+        name = f"{METRIC_PREFIX}stage_duration_seconds"
+        lines.append(f"# HELP {name} Time spent per pipeline stage.")
+        lines.append(f"# TYPE {name} summary")
+        for (stage, labels), stats in sorted(durations.items()):
+            label_text = _format_labels((("stage", stage),) + labels)
+            lines.append(f"{name}_count{label_text} {stats['count']}")
+            lines.append(f"{name}_sum{label_text} {stats['sum']:.6f}")
+        lines.append(f"# HELP {name}_max Longest single span per pipeline stage.")
+        lines.append(f"# TYPE {name}_max gauge")
+        for (stage, labels), stats in sorted(durations.items()):
+            lines.append(f"{name}_max{_format_labels((('stage', stage),) + labels)} {stats['max']:.6f}")
+
+    for counter_name in sorted({name for name, _ in counters}):
+        name = f"{METRIC_PREFIX}{counter_name}"
+        lines.append(f"# TYPE {name} counter")
+        for (other_name, labels), value in sorted(counters.items()):
+            if other_name == counter_name:
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+# Write the Prometheus snapshot, e.g. for the node exporter textfile collector. Also flushes the event log.
+def write_prometheus(path=None):
+    flush_events()
+    path = path or METRICS_PROMETHEUS_FILE
+    if not METRICS_ENABLED or not path:
+        return
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        f.write(format_prometheus())
+    os.replace(temp_path, path)
+    print(f"Metrics written to '{path}'.")
+
+# Print the time spent per stage, slowest total first
+def print_summary():
+    with _lock:
+        durations = dict(_durations)
+    if not durations:
+        return
+    print("Stage timings:")
+    for (stage, labels), stats in sorted(durations.items(), key=lambda item: item[1]["sum"], reverse=True):
+        label_text = "".join(f" {key}={value}" for key, value in labels)
+        print(f"  {stage}{label_text}: {stats['count']}x, total {stats['sum']:.2f}s, "
+              f"avg {stats['sum'] / stats['count']:.2f}s, max {stats['max']:.2f}s")
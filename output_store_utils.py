@@ -0,0 +1,253 @@
+import os
+import time
+import shutil
+import hashlib
+import sqlite3
+import argparse
+import threading
+
+# GLOBAL VARIABLES for easy tweaks
+
+# Content-addressed copies of every generated image, one file per distinct image, named by its SHA-256.
+# Kept inside generated_images so the visible files can be hardlinks to them (hardlinks cannot cross file systems).
+OUTPUT_STORE_DIR = "generated_images/.objects"
+
+# SQLite index of which visible file holds which image, and the prompt, seed and model version that produced it
+OUTPUT_INDEX_FILE = "generated_images/.output_index.db"
+
+# Maximum total size of the distinct images (bytes). Above it the least recently generated images are deleted,
+# together with every file linked to them. Set to None to keep everything.
+OUTPUT_STORE_MAX_BYTES = 50 * 1024 ** 3  # 50 GB
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Pillow format names and file extensions for transcoding
+TRANSCODE_FORMATS = {"webp": ("WEBP", ".webp"), "jpg": ("JPEG", ".jpg"), "jpeg": ("JPEG", ".jpg"), "png": ("PNG", ".png")}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    extension TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outputs (
+    path TEXT PRIMARY KEY,
+    hash TEXT NOT NULL REFERENCES blobs (hash),
+    model_version TEXT,
+    prompt TEXT,
+    seed INTEGER,
+    job_id TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outputs_by_generation ON outputs (model_version, prompt, seed);
+CREATE INDEX IF NOT EXISTS outputs_by_hash ON outputs (hash);
+"""
+
+def file_sha256(path, chunk_size=HASH_CHUNK_SIZE):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Re-encode an image as webp or jpg (or png) next to the original and remove the original. Returns the new path.
+# JPEG has no alpha channel, so transparent images are flattened onto white first.
+def transcode_image(path, output_format, quality):
+    from PIL import Image
+
+    pil_format, extension = TRANSCODE_FORMATS[output_format]
+    dest_path = os.path.splitext(path)[0] + extension
+    if dest_path == path:
+        return path
+
+    with Image.open(path) as image:
+        if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGBA")
+            flattened = Image.new("RGB", image.size, (255, 255, 255))
+            flattened.paste(image, mask=image.getchannel("A"))
+            image = flattened
+        temp_path = dest_path + ".part"
+        image.save(temp_path, pil_format, quality=quality)
+    os.replace(temp_path, dest_path)
+    os.remove(path)
+    return dest_path
+
+# Hardlink dest to source, copying instead where the file system does not support links
+def _link_or_copy(source_path, dest_path):
+    try:
+        os.link(source_path, dest_path)
+    except OSError:
+        shutil.copy2(source_path, dest_path)
+
+# Content-addressed store for generated images. Every saved image is hashed on ingest: the first copy of an image
+# is moved into OUTPUT_STORE_DIR and its visible file becomes a hardlink to it, and later identical images
+# (repeated seeds, regenerations, cache hits) are hardlinked to the same copy, so each distinct image uses disk once.
+class OutputStore:
+    def __init__(self, store_dir=OUTPUT_STORE_DIR, index_path=OUTPUT_INDEX_FILE, max_bytes=OUTPUT_STORE_MAX_BYTES):
+        self.store_dir = store_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(store_dir, exist_ok=True)
+        index_dir = os.path.dirname(index_path)
+        if index_dir:
+            os.makedirs(index_dir, exist_ok=True)
+        self.connection = sqlite3.connect(index_path, check_same_thread=False, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def _blob_path(self, digest, extension):
+        return os.path.join(self.store_dir, digest[:2], digest + extension)
+
+    # Take ownership of a freshly written image at path, optionally transcoding it first.
+    # Returns (path, hash, duplicate); path changes extension when the image was transcoded.
+    def ingest(self, path, model_version=None, prompt=None, seed=None, job_id=None, transcode_format=None, quality=None):
+        if transcode_format:
+            try:
+                path = transcode_image(path, transcode_format, quality)
+            except (OSError, ValueError) as e:
+                print(f"Could not transcode {path} to {transcode_format}, storing it as is: {e}")
+
+        digest = file_sha256(path)
+        extension = os.path.splitext(path)[1].lower()
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT extension FROM blobs WHERE hash = ?", (digest,)).fetchone()
+            blob_path = self._blob_path(digest, row["extension"] if row is not None else extension)
+            duplicate = row is not None and os.path.exists(blob_path)
+            if duplicate:
+                os.remove(path)
+            else:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                os.replace(path, blob_path)
+            _link_or_copy(blob_path, path)
+
+            self.connection.execute("BEGIN")
+            self.connection.execute(
+                "INSERT INTO blobs (hash, extension, size, created_at, last_used_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (hash) DO UPDATE SET last_used_at = excluded.last_used_at",
+                (digest, os.path.splitext(blob_path)[1], os.path.getsize(blob_path), now, now))
+            self.connection.execute(
+                "INSERT OR REPLACE INTO outputs (path, hash, model_version, prompt, seed, job_id, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", (path, digest, model_version, prompt, seed, job_id, now))
+            self.connection.execute("COMMIT")
+            self._enforce_limit(keep=digest)
+        return path, digest, duplicate
+
+    # Delete one image: every visible file linked to it, its stored copy and its index rows
+    def _remove_blob(self, digest, extension):
+        for row in self.connection.execute("SELECT path FROM outputs WHERE hash = ?", (digest,)).fetchall():
+            try:
+                os.remove(row["path"])
+            except FileNotFoundError:
+                pass
+        try:
+            os.remove(self._blob_path(digest, extension))
+        except FileNotFoundError:
+            pass
+        self.connection.execute("DELETE FROM outputs WHERE hash = ?", (digest,))
+        self.connection.execute("DELETE FROM blobs WHERE hash = ?", (digest,))
+
+    # Delete the least recently generated images until the distinct images fit within max_bytes
+    def _enforce_limit(self, keep=None, max_bytes=None):
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        if max_bytes is None:
+            return 0
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        removed = 0
+        if total <= max_bytes:
+            return removed
+        for blob in self.connection.execute("SELECT hash, extension, size FROM blobs ORDER BY last_used_at").fetchall():
+            if total <= max_bytes:
+                break
+            if blob["hash"] == keep:
+                continue
+            print(f"Retention limit reached, deleting image {blob['hash'][:12]} and its files.")
+            self._remove_blob(blob["hash"], blob["extension"])
+            total -= blob["size"]
+            removed += 1
+        return removed
+
+    # Forget visible files that were deleted by hand, delete images no file links to any more,
+    # then apply the size limit (max_bytes overrides the configured one). Returns (forgotten files, deleted images).
+    def prune(self, max_bytes=None):
+        with self.lock:
+            forgotten = 0
+            for row in self.connection.execute("SELECT path FROM outputs").fetchall():
+                if not os.path.exists(row["path"]):
+                    self.connection.execute("DELETE FROM outputs WHERE path = ?", (row["path"],))
+                    forgotten += 1
+            orphans = self.connection.execute(
+                "SELECT hash, extension FROM blobs WHERE hash NOT IN (SELECT hash FROM outputs)").fetchall()
+            for blob in orphans:
+                self._remove_blob(blob["hash"], blob["extension"])
+            return forgotten, len(orphans) + self._enforce_limit(max_bytes=max_bytes)
+
+    # Saved files for a prompt, optionally narrowed to a seed and model version, newest first
+    def find(self, prompt, seed=None, model_version=None):
+        sql = "SELECT * FROM outputs WHERE prompt = ?"
+        parameters = [prompt]
+        if seed is not None:
+            sql += " AND seed = ?"
+            parameters.append(seed)
+        if model_version is not None:
+            sql += " AND model_version = ?"
+            parameters.append(model_version)
+        with self.lock:
+            return [dict(row) for row in self.connection.execute(sql + " ORDER BY created_at DESC", parameters).fetchall()]
+
+    # Number of files and distinct images, and the disk space hardlinking saves
+    def stats(self):
+        with self.lock:
+            files, linked_bytes = self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(blobs.size), 0) FROM outputs JOIN blobs ON blobs.hash = outputs.hash").fetchone()
+            images, stored_bytes = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        return {
+            "files": files,
+            "images": images,
+            "stored_bytes": stored_bytes,
+            "saved_bytes": linked_bytes - stored_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+# Command line interface to inspect and prune the output store
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and prune the content-addressed store of generated images.")
+    parser.add_argument("--store-dir", default=OUTPUT_STORE_DIR, help="Directory holding one copy of each image.")
+    parser.add_argument("--index", default=OUTPUT_INDEX_FILE, help="Index file.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="Show file and image counts and the space saved by deduplication.")
+    find_parser = subparsers.add_parser("find", help="List the saved files for a prompt.")
+    find_parser.add_argument("prompt")
+    find_parser.add_argument("--seed", type=int)
+    find_parser.add_argument("--model-version")
+    prune_parser = subparsers.add_parser("prune", help="Drop deleted files from the index and apply the size limit.")
+    prune_parser.add_argument("--max-gb", type=float, help="Size limit to apply (default: OUTPUT_STORE_MAX_BYTES)")
+    args = parser.parse_args()
+
+    store = OutputStore(args.store_dir, args.index)
+
+    if args.command == "stats":
+        stats = store.stats()
+        limit = f"{stats['max_bytes'] / 1024 ** 2:.1f} MB" if stats["max_bytes"] is not None else "no limit"
+        print(f"Files: {stats['files']}  Distinct images: {stats['images']}")
+        print(f"Size: {stats['stored_bytes'] / 1024 ** 2:.1f} MB of {limit}")
+        print(f"Saved by deduplication: {stats['saved_bytes'] / 1024 ** 2:.1f} MB")
+    elif args.command == "find":
+        for output in store.find(args.prompt, args.seed, args.model_version):
+            created = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(output["created_at"]))
+            print(f"{output['path']}  {output['hash'][:12]}  seed {output['seed']}  {output['model_version']}  {created}")
+    elif args.command == "prune":
+        max_bytes = int(args.max_gb * 1024 ** 3) if args.max_gb is not None else None
+        forgotten, deleted = store.prune(max_bytes)
+        print(f"Forgot {forgotten} deleted files and deleted {deleted} images.")
+    store.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+import json
+import time
+import queue
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from resilience_utils import retry_call, CircuitOpenError
+from rate_limit_utils import get_scheduler, PRIORITY_INTERACTIVE, PRIORITY_BATCH
+from metrics_utils import observe, increment
+from config_utils import is_replicate_error
+
+# GLOBAL VARIABLES for easy tweaks
+
+# Seconds before the first status check of a new prediction, and the longest gap between checks.
+# While a prediction keeps running the gap grows by PREDICTION_POLL_BACKOFF after every check.
+PREDICTION_POLL_MIN_INTERVAL = 1
+PREDICTION_POLL_MAX_INTERVAL = 5
+PREDICTION_POLL_BACKOFF = 1.5
+
+# When at least this many predictions are due for a check, they are looked up in the prediction list,
+# where one request reports on up to 100 recent predictions, instead of with one request each
+PREDICTION_LIST_MIN_DUE = 5
+
+# Most list pages read per check. Predictions not found on them are checked one by one.
+PREDICTION_LIST_MAX_PAGES = 5
+
+# Address the webhook receiver listens on. Replicate must be able to reach it, usually through a tunnel or reverse proxy.
+WEBHOOK_HOST = "0.0.0.0"
+WEBHOOK_PORT = 8787
+
+# With webhooks, predictions are still polled this often in case a delivery is lost (seconds)
+WEBHOOK_FALLBACK_POLL_INTERVAL = 60
+
+# Seconds a signed webhook's timestamp may differ from the local clock before it is rejected
+WEBHOOK_TOLERANCE = 300
+
+# A webhook can arrive before submit() has registered its prediction ID. Up to this many such updates are kept
+# (oldest dropped first) and applied when the prediction is registered.
+WEBHOOK_EARLY_UPDATES_MAX = 1000
+
+TERMINAL_STATUSES = ("succeeded", "failed", "canceled")
+
+def _parse_timestamp(value):
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+
+# Start a prediction, or re-attach to an earlier one by ID if it has not failed, and return it without waiting.
+# on_submit(prediction_id) is called as soon as a new prediction exists, so callers can record it before waiting.
+# With webhook_url, Replicate posts the finished prediction there.
+def start_prediction(client, model_version, input_params, priority=PRIORITY_INTERACTIVE, prediction_id=None, on_submit=None,
+                     webhook_url=None):
+    scheduler = get_scheduler()
+
+    prediction = None
+    if prediction_id:
+        get_prediction = scheduler.wrap(client.predictions.get, priority, operation="predictions.get")
+        try:
+            prediction = retry_call(get_prediction, prediction_id, breaker="replicate", wait_for_circuit=True,
+                                    operation=f"Status check of {prediction_id}")
+        except Exception as e:
+            if not is_replicate_error(e):
+                raise
+            print(f"Could not re-attach to prediction {prediction_id}: {e}")
+        if prediction is not None and prediction.status in ("failed", "canceled"):
+            print(f"Earlier prediction {prediction_id} {prediction.status}, starting a new one.")
+            prediction = None
+        elif prediction is not None:
+            print(f"Re-attached to prediction {prediction_id} ({prediction.status}).")
+
+    if prediction is None:
+        create_params = {}
+        if webhook_url:
+            create_params = {"webhook": webhook_url, "webhook_events_filter": ["completed"]}
+        # Each attempt creates a new paid prediction, so only failures that never reached Replicate are retried
+        create = scheduler.wrap(client.predictions.create, priority, operation="predictions.create")
+        prediction = retry_call(lambda: create(version=model_version.split(":")[-1], input=input_params, **create_params),
+                                idempotent=False, breaker="replicate", operation="Model run")
+        if on_submit is not None:
+            on_submit(prediction.id)
+    return prediction
+
+# Follows many predictions from one background thread, so waiting on them costs no thread per prediction.
+# Finished predictions are put on the completions queue as (key, output, error) tuples, where key is whatever
+# the caller passed to submit. Status comes from webhooks (see WebhookReceiver) or from polling: due predictions are
+# looked up in the prediction list in bulk, and checks back off while a prediction keeps running.
+class PredictionTracker:
+    def __init__(self, client, priority=PRIORITY_BATCH, timeout=None, webhook_url=None):
+        self.client = client
+        self.priority = priority
+        self.timeout = timeout
+        self.webhook_url = webhook_url
+        self.completions = queue.Queue()
+        self.lock = threading.Lock()
+        self.tracked = {}  # prediction ID -> entry
+        self.early_updates = OrderedDict()  # prediction ID -> webhook update received before submit() registered it
+        self.wake = threading.Event()
+        self.closed = threading.Event()
+
+        scheduler = get_scheduler()
+        self.get_prediction = scheduler.wrap(client.predictions.get, priority, operation="predictions.get")
+        self.list_predictions = scheduler.wrap(client.predictions.list, priority, operation="predictions.list")
+        self.cancel_prediction = scheduler.wrap(client.predictions.cancel, priority, operation="predictions.cancel")
+
+        self.thread = threading.Thread(target=self._poll_loop, name="prediction-tracker", daemon=True)
+        self.thread.start()
+
+    # Start (or re-attach to) a prediction and follow it. Returns the prediction ID.
+    # on_finish(prediction) is called with the final prediction the moment it is seen to finish, before its completion
+    # is queued. It runs under the tracker's lock, so it must be quick and must not call back into the tracker.
+    def submit(self, key, model_version, input_params, prediction_id=None, on_submit=None, on_finish=None):
+        prediction = start_prediction(self.client, model_version, input_params, self.priority, prediction_id, on_submit,
+                                      self.webhook_url)
+        now = time.monotonic()
+        entry = {
+            "key": key,
+            "id": prediction.id,
+            "created_at": _parse_timestamp(prediction.created_at),
+            "submitted": now,
+            "deadline": now + self.timeout if self.timeout is not None else None,
+            "interval": PREDICTION_POLL_MIN_INTERVAL,
+            "next_check": now + self._first_interval(),
+            "on_finish": on_finish,
+        }
+        with self.lock:
+            self.tracked[prediction.id] = entry
+            early_update = self.early_updates.pop(prediction.id, None)
+        if prediction.status not in TERMINAL_STATUSES and early_update is not None:
+            prediction = early_update
+        if prediction.status in TERMINAL_STATUSES:
+            self._finish(entry, prediction)
+        self.wake.set()
+        return prediction.id
+
+    def in_flight(self):
+        with self.lock:
+            return len(self.tracked)
+
+    # Stop following predictions. Those still running keep running on Replicate.
+    def close(self):
+        self.closed.set()
+        self.wake.set()
+        self.thread.join()
+
+    # Apply a prediction update pushed to the webhook receiver. Returns False for predictions this tracker does not
+    # follow (yet); their updates are held for a while in case submit() is still registering them.
+    def handle_update(self, data):
+        from replicate.prediction import Prediction
+
+        prediction = Prediction(**data)
+        with self.lock:
+            entry = self.tracked.get(prediction.id)
+            if entry is None:
+                self.early_updates[prediction.id] = prediction
+                self.early_updates.move_to_end(prediction.id)
+                while len(self.early_updates) > WEBHOOK_EARLY_UPDATES_MAX:
+                    self.early_updates.popitem(last=False)
+                return False
+        if prediction.status in TERMINAL_STATUSES:
+            self._finish(entry, prediction)
+        return True
+
+    def _first_interval(self):
+        return WEBHOOK_FALLBACK_POLL_INTERVAL if self.webhook_url else PREDICTION_POLL_MIN_INTERVAL
+
+    def _next_interval(self, entry):
+        if self.webhook_url:
+            return WEBHOOK_FALLBACK_POLL_INTERVAL
+        entry["interval"] = min(PREDICTION_POLL_MAX_INTERVAL, entry["interval"] * PREDICTION_POLL_BACKOFF)
+        return entry["interval"]
+
+    # Hand a finished prediction to the caller. The entry is dropped and the completion queued under one lock,
+    # so a caller that sees nothing in flight has already been given every result.
+    def _finish(self, entry, prediction=None, error=None):
+        output = None
+        if error is None and prediction.status == "succeeded":
+            output = prediction.output
+        elif error is None:
+            from replicate.exceptions import ModelError
+            error = ModelError(prediction)
+
+        with self.lock:
+            if self.tracked.pop(entry["id"], None) is None:
+                return  # already reported, e.g. by a webhook and a poll at the same time
+            if prediction is not None and entry["on_finish"] is not None:
+                entry["on_finish"](prediction)
+            self.completions.put((entry["key"], output, error))
+
+        status = prediction.status if prediction is not None else "timed_out"
+        observe("prediction", time.monotonic() - entry["submitted"], error=error is not None, status=status)
+        increment("predictions_completed_total", status=status)
+
+    # Record a status seen by a check. Returns False if the prediction still needs a full lookup: list entries
+    # may leave out the output, so a prediction listed as succeeded without one is looked up on its own.
+    def _apply(self, entry, prediction, listed=False):
+        if prediction.status not in TERMINAL_STATUSES:
+            entry["next_check"] = time.monotonic() + self._next_interval(entry)
+            return True
+        if listed and prediction.status == "succeeded" and prediction.output is None:
+            return False
+        self._finish(entry, prediction)
+        return True
+
+    def _poll_loop(self):
+        while not self.closed.is_set():
+            with self.lock:
+                entries = list(self.tracked.values())
+
+            now = time.monotonic()
+            expired = {entry["id"] for entry in entries if entry["deadline"] is not None and entry["deadline"] <= now}
+            for entry in entries:
+                if entry["id"] in expired:
+                    self._expire(entry)
+
+            due = [entry for entry in entries if entry["next_check"] <= now and entry["id"] not in expired]
+            if due:
+                self._check(due)
+
+            with self.lock:
+                wake_times = [entry["next_check"] for entry in self.tracked.values()]
+                wake_times += [entry["deadline"] for entry in self.tracked.values() if entry["deadline"] is not None]
+            timeout = max(0, min(wake_times) - time.monotonic()) if wake_times else None
+            self.wake.wait(timeout)
+            self.wake.clear()
+
+    # Report a prediction that ran past the timeout and cancel it, so it stops costing money
+    def _expire(self, entry):
+        self._finish(entry, error=TimeoutError(f"Prediction {entry['id']} did not finish within {self.timeout} seconds"))
+        try:
+            retry_call(self.cancel_prediction, entry["id"], breaker="replicate", operation=f"Cancel of {entry['id']}")
+            print(f"Canceled prediction {entry['id']} after {self.timeout} seconds.")
+        except Exception as e:
+            print(f"Could not cancel prediction {entry['id']}: {e}")
+
+    def _check(self, due):
+        remaining = {entry["id"]: entry for entry in due}
+        if len(remaining) >= PREDICTION_LIST_MIN_DUE:
+            try:
+                self._check_listed(remaining)
+            except Exception as e:
+                print(f"Could not list predictions, checking them one by one: {e}")
+
+        entries = list(remaining.values())
+        for index, entry in enumerate(entries):
+            if self.closed.is_set():
+                return
+            try:
+                prediction = retry_call(self.get_prediction, entry["id"], breaker="replicate",
+                                        operation=f"Status check of {entry['id']}")
+            except CircuitOpenError as e:
+                # The predictions keep running on Replicate; check them again once the circuit may let calls through
+                print(f"Postponing {len(entries) - index} status checks: {e}")
+                for postponed in entries[index:]:
+                    postponed["next_check"] = time.monotonic() + e.retry_in
+                return
+            except Exception as e:
+                # Keep following it; the prediction itself may well be fine, and the timeout still applies
+                print(f"Status check of prediction {entry['id']} failed: {e}")
+                entry["next_check"] = time.monotonic() + self._next_interval(entry)
+                continue
+            self._apply(entry, prediction)
+
+    # Resolve due predictions from the newest pages of the prediction list, removing them from remaining.
+    # Other tracked predictions on the same pages are updated too, since their status comes for free.
+    # Paging stops once it reaches predictions older than all the due ones.
+    def _check_listed(self, remaining):
+        created = [entry["created_at"] for entry in remaining.values()]
+        oldest = min(created) if None not in created else None
+
+        cursor = ...
+        for _ in range(PREDICTION_LIST_MAX_PAGES):
+            page = retry_call(self.list_predictions, cursor, breaker="replicate", operation="Prediction list")
+            for prediction in page.results:
+                with self.lock:
+                    entry = self.tracked.get(prediction.id)
+                if entry is not None and self._apply(entry, prediction, listed=True):
+                    remaining.pop(prediction.id, None)
+
+            last_created = _parse_timestamp(page.results[-1].created_at) if page.results else None
+            if not remaining or page.next is None or (oldest is not None and last_created is not None and last_created < oldest):
+                return
+            cursor = page.next
+
+# Signing secret Replicate uses for webhooks sent to this account
+def get_webhook_secret(client):
+    get_secret = get_scheduler().wrap(client.webhooks.default.secret, PRIORITY_INTERACTIVE, operation="webhooks.default.secret")
+    return retry_call(get_secret, breaker="replicate", operation="Webhook secret lookup")
+
+# Small HTTP server that takes prediction webhooks from Replicate and passes them to a PredictionTracker.
+# Replicate cannot reach a local port by itself: expose WEBHOOK_PORT through a tunnel or reverse proxy and pass its
+# public URL as the tracker's webhook_url. With a signing secret, unsigned or forged requests are rejected.
+class WebhookReceiver:
+    def __init__(self, tracker, host=WEBHOOK_HOST, port=WEBHOOK_PORT, secret=None, tolerance=WEBHOOK_TOLERANCE):
+        self.tracker = tracker
+        self.secret = secret
+        self.tolerance = tolerance
+        self.httpd = ThreadingHTTPServer((host, port), _WebhookHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.receiver = self
+        self.thread = None
+        self.received = 0
+        self.rejected = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="webhook-receiver", daemon=True)
+        self.thread.start()
+        host, port = self.httpd.server_address[:2]
+        print(f"Listening for prediction webhooks on {host}:{port}.")
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _is_valid(self, headers, body):
+        if self.secret is None:
+            return True
+        from replicate.webhook import Webhooks, WebhookValidationError
+        try:
+            Webhooks.validate(headers=headers, body=body, secret=self.secret, tolerance=self.tolerance)
+            return True
+        # A malformed or missing timestamp or signature header surfaces as ValueError or KeyError rather than a
+        # validation error, and is rejected the same way
+        except (WebhookValidationError, ValueError, KeyError):
+            return False
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        receiver = self.server.receiver
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode("utf-8")
+
+        if not receiver._is_valid(dict(self.headers), body):
+            receiver.rejected += 1
+            self._respond(401)
+            return
+        try:
+            receiver.tracker.handle_update(json.loads(body))
+        except (ValueError, TypeError, AttributeError) as e:
+            print(f"Ignoring malformed webhook: {e}")
+            self._respond(400)
+            return
+
+        receiver.received += 1
+        # Predictions this process does not follow are acknowledged too, so Replicate does not retry them
+        self._respond(200)
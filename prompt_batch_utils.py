@@ -0,0 +1,149 @@
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import threading
+
+# GLOBAL VARIABLES for easy tweaks
+
+# Length of the hex digest used as a job ID
+JOB_ID_LENGTH = 12
+
+# Explicit job IDs end up in output file names, so they are limited to these characters
+JOB_ID_PATTERN = r"[A-Za-z0-9_-]+"
+
+# Stable ID for a job: a hash of its prompt and parameter overrides, so the same line always maps to the same files
+# and manifest entries. Repeats of an identical job get "-2", "-3", ... in the order they appear.
+def make_job_id(prompt, overrides=None):
+    payload = json.dumps({"prompt": prompt, "overrides": overrides or {}}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:JOB_ID_LENGTH]
+
+# The next free ID for a job, skipping any ID that is already taken (e.g. by an explicit "id" in the input)
+def _unique_job_id(prompt, overrides, occurrences, taken=()):
+    job_id = make_job_id(prompt, overrides)
+    while True:
+        count = occurrences.get(job_id, 0) + 1
+        occurrences[job_id] = count
+        candidate = job_id if count == 1 else f"{job_id}-{count}"
+        if candidate not in taken:
+            return candidate
+
+# Jobs for an in-memory list of prompts, with the same IDs the prompts would get as lines of a prompt file
+def jobs_from_prompts(prompts):
+    occurrences = {}
+    for position, prompt in enumerate(prompts):
+        yield {"id": _unique_job_id(prompt, {}, occurrences), "prompt": prompt, "overrides": {}, "line": position + 1}
+
+def _open_source(source):
+    if source == "-":
+        return sys.stdin, False
+    return open(source, 'r', encoding='utf-8'), True
+
+# Lazily read jobs from a prompt file, a JSONL file or stdin ("-"), one job per line, without loading the whole input.
+# A line is either a plain prompt or a JSON object with "prompt", an optional "id" and parameter overrides, e.g.
+#   {"prompt": "on a beach at sunset", "seed": 42, "aspect_ratio": "16:9"}
+# Overrides must be names in allowed_parameters, and an "id" must match JOB_ID_PATTERN and be unique in the input.
+# Blank lines and lines starting with "#" are skipped, and invalid lines are reported and skipped.
+# Yields {"id", "prompt", "overrides", "line"} dicts.
+def iter_prompt_jobs(source, allowed_parameters):
+    allowed_parameters = set(allowed_parameters)
+    occurrences = {}
+    seen = {}  # job ID -> line it was first used on
+    f, should_close = _open_source(source)
+    try:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+
+            if line.startswith("{"):
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    print(f"Skipping line {line_number} of '{source}': invalid JSON ({e})")
+                    continue
+                prompt = record.pop("prompt", None)
+                job_id = record.pop("id", None)
+                unknown = sorted(set(record) - allowed_parameters)
+                if not isinstance(prompt, str) or not prompt.strip():
+                    print(f"Skipping line {line_number} of '{source}': missing \"prompt\"")
+                    continue
+                if unknown:
+                    print(f"Skipping line {line_number} of '{source}': unknown parameters {', '.join(unknown)}")
+                    continue
+                if job_id is not None:
+                    job_id = str(job_id) if isinstance(job_id, int) and not isinstance(job_id, bool) else job_id
+                    if not isinstance(job_id, str) or not re.fullmatch(JOB_ID_PATTERN, job_id):
+                        print(f"Skipping line {line_number} of '{source}': \"id\" must only use letters, digits, '_' and '-'")
+                        continue
+                    if job_id in seen:
+                        print(f"Skipping line {line_number} of '{source}': id '{job_id}' is already used on line {seen[job_id]}")
+                        continue
+                overrides = record
+            else:
+                prompt, job_id, overrides = line, None, {}
+
+            if job_id is None:
+                job_id = _unique_job_id(prompt, overrides, occurrences, seen)
+            seen[job_id] = line_number
+            yield {"id": job_id, "prompt": prompt, "overrides": overrides, "line": line_number}
+    finally:
+        if should_close:
+            f.close()
+
+# IDs of jobs that already succeeded according to an existing output manifest, so a rerun can skip them.
+# A job whose saved images no longer all exist (e.g. deleted by the output store's retention limit) is run again.
+def load_completed_job_ids(manifest_path):
+    completed = set()
+    if not os.path.exists(manifest_path):
+        return completed
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by a crash
+            if record.get("status") == "succeeded" and all(os.path.exists(path) for path in record.get("outputs") or []):
+                completed.add(record["id"])
+            else:
+                completed.discard(record.get("id"))
+    return completed
+
+# Append-only JSONL manifest of job results. Each record is flushed as soon as it is written,
+# so the manifest is usable while a batch is still running and survives a crash.
+class ManifestWriter:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def write(self, job, status, seed=None, outputs=None, error=None):
+        record = {
+            "id": job["id"],
+            "prompt": job["prompt"],
+            "overrides": job.get("overrides") or {},
+            "seed": seed,
+            "status": status,
+            "outputs": outputs or [],
+            "error": str(error) if error is not None else None,
+            "completed_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        line = json.dumps(record, sort_keys=True)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,19 +1,25 @@
 import os
-import replicate
-import requests
+import sys
 import random
-from dotenv import load_dotenv
+import functools
+import itertools
 from datetime import datetime
 import time
-
-# Load environment variables from .env file
-load_dotenv()
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from download_utils import download_files
+from result_cache_utils import ResultCache, make_cache_key
+from job_store_utils import JobStore, make_batch_key
+from output_store_utils import OutputStore, TRANSCODE_FORMATS
+from prompt_batch_utils import iter_prompt_jobs, jobs_from_prompts, load_completed_job_ids, ManifestWriter
+from resilience_utils import retry_call, ResilienceError
+from rate_limit_utils import get_scheduler, PRIORITY_INTERACTIVE, PRIORITY_BATCH
+from metrics_utils import timed, increment, print_summary, write_prometheus
+from config_utils import ConfigError, create_replicate_client, is_replicate_error, require_env
+from prediction_tracker_utils import PredictionTracker, WebhookReceiver, start_prediction, get_webhook_secret, TERMINAL_STATUSES
 
 # GLOBAL VARIABLES for easy tweaks
 
-# API token for authenticating with Replicate
-REPLICATE_API_TOKEN = os.getenv("REPLICATE_API_TOKEN")
-
 # Version of the model to use on Replicate
 MODEL_VERSION = "tillo13/flux1-dev-lora-20240826183521:4da855938dfa7424753aaaad5ba1f0e905453413ccbb1e5a8c029046558122bb"
 
@@ -98,33 +104,114 @@ DEFAULT_OUTPUT_QUALITY = 100  # Best quality, max value is 100
 # Disable safety checker for generated images. Set to True to disable, False to keep enabled.
 DEFAULT_DISABLE_SAFETY_CHECKER = False  # Default is False, for safety
 
-# Ensure tokens are correctly loaded
-if not REPLICATE_API_TOKEN:
-    print("Error: REPLICATE_API_TOKEN is not set in the .env file")
-    exit(1)
+# Maximum number of prompts running on Replicate at the same time in "threads" mode. Set to 1 to run prompts one after another.
+MAX_CONCURRENT_PROMPTS = 4
+
+# Seconds a single prompt may spend running on Replicate before it is reported as timed out. Set to None to wait forever.
+PROMPT_TIMEOUT = 600
+
+# Reuse earlier outputs when run_model is called again with the exact same inputs. Only applies when the seed is fixed.
+RESULT_CACHE_ENABLED = True
+
+# Record every prompt's state, seed and prediction ID in a local job store, so an interrupted run resumes
+# the unfinished prompts and re-attaches to predictions that are already running instead of paying for them again
+JOB_STORE_ENABLED = True
+
+# Results of every job (ID, prompt, overrides, seed, status and saved files) are appended here as JSON lines
+OUTPUT_MANIFEST_FILE = "generated_images/manifest.jsonl"
+
+# run_model parameters a line of a JSONL batch file may override; the rest come from the DEFAULT_* values above
+RUN_MODEL_PARAMETERS = ("model", "aspect_ratio", "width", "height", "num_outputs", "lora_scale", "num_inference_steps",
+                        "guidance_scale", "seed", "output_format", "output_quality", "extra_lora_scale", "extra_lora",
+                        "disable_safety_checker")
+
+# Seconds between status checks while run_model waits for a prediction to finish
+PREDICTION_POLL_INTERVAL = 0.5
 
-# Initialize the Replicate client with your API token
+# How a batch waits for its predictions.
+# "async": submit predictions and collect them as they finish with one background poller (or webhooks), handing each
+#          result straight to the download stage. Hundreds of predictions can be in flight with a few threads.
+# "threads": run each prompt through run_model in its own worker thread, MAX_CONCURRENT_PROMPTS at a time.
+GENERATION_MODE = "async"
+
+# Maximum number of predictions in flight at once in "async" mode
+MAX_IN_FLIGHT_PREDICTIONS = 100
+
+# Keep one copy of each distinct image: saved images are hashed and identical ones hardlinked to a shared copy,
+# with an index of the prompt, seed and model version behind every file and a size limit (see output_store_utils.py)
+OUTPUT_STORE_ENABLED = True
+
+# Re-encode saved images as "webp" or "jpg" ("jpeg" works too) at the job's output quality (DEFAULT_OUTPUT_QUALITY
+# unless overridden) to save space. Set to None to keep the format Replicate returned.
+OUTPUT_TRANSCODE_FORMAT = None
+
+# Public URL that forwards to the local webhook receiver (WEBHOOK_PORT in prediction_tracker_utils), e.g. a tunnel.
+# When set, "async" mode learns about finished predictions from Replicate's webhooks instead of polling for them.
+PREDICTION_WEBHOOK_URL = None
+
+# Fail fast on settings that would otherwise only break once images are being saved
+def validate_config():
+    require_env("REPLICATE_API_TOKEN")
+    if OUTPUT_TRANSCODE_FORMAT is not None and OUTPUT_TRANSCODE_FORMAT not in TRANSCODE_FORMATS:
+        raise ConfigError(f"Unknown OUTPUT_TRANSCODE_FORMAT '{OUTPUT_TRANSCODE_FORMAT}'. "
+                          f"Options: {', '.join(TRANSCODE_FORMATS)} or None")
+
+# Initialize the Replicate client with REPLICATE_API_TOKEN from the environment or .env file
+@timed("initialize_client")
 def initialize_client():
     print("Initializing Replicate client with API token...")
-    client = replicate.Client(api_token=REPLICATE_API_TOKEN)
+    client = create_replicate_client()
     print("Replicate client initialized successfully.")
     return client
 
 # Run the model using Replicate's API
+@timed("run_model")
 def run_model(client, model_version, prompt, model=DEFAULT_MODEL, aspect_ratio=DEFAULT_ASPECT_RATIO, width=DEFAULT_WIDTH,
               height=DEFAULT_HEIGHT, num_outputs=DEFAULT_NUM_OUTPUTS, lora_scale=DEFAULT_LORA_SCALE, num_inference_steps=DEFAULT_NUM_INFERENCE_STEPS,
               guidance_scale=DEFAULT_GUIDANCE_SCALE, seed=DEFAULT_SEED, output_format=DEFAULT_OUTPUT_FORMAT, output_quality=DEFAULT_OUTPUT_QUALITY,
-              extra_lora_scale=DEFAULT_EXTRA_LORA_SCALE, extra_lora=DEFAULT_EXTRA_LORA, disable_safety_checker=DEFAULT_DISABLE_SAFETY_CHECKER):
+              extra_lora_scale=DEFAULT_EXTRA_LORA_SCALE, extra_lora=DEFAULT_EXTRA_LORA, disable_safety_checker=DEFAULT_DISABLE_SAFETY_CHECKER, cache=None,
+              priority=PRIORITY_INTERACTIVE, prediction_id=None, on_submit=None, on_finish=None):
     print(f"Running model with prompt: {prompt}...")
 
+    # A random seed never repeats, so only fixed-seed runs are worth caching
+    if seed == 0:
+        cache = None
+
+    input_params = build_input_params(prompt, model, aspect_ratio, width, height, num_outputs, lora_scale, num_inference_steps,
+                                      guidance_scale, seed, output_format, output_quality, extra_lora_scale, extra_lora,
+                                      disable_safety_checker)
+
+    cache_key = None
+    if cache is not None:
+        cache_key = make_cache_key(model_version, input_params)
+        cached_files = cache.get(cache_key)
+        if cached_files is not None:
+            print(f"Result cache hit ({cache_key[:12]}), skipping remote inference.")
+            return cached_files
+
+    output = run_prediction(client, model_version, input_params, priority, prediction_id, on_submit, on_finish)
+
+    print("Model run successfully.")
+
+    # Store the outputs locally; the returned file paths are saved like URLs by save_images
+    if cache_key is not None:
+        output = cache.put(cache_key, output)
+    return output
+
+# Replicate input for a prompt, shared by run_model and the async batch mode. A seed of 0 draws a random seed.
+def build_input_params(prompt, model=DEFAULT_MODEL, aspect_ratio=DEFAULT_ASPECT_RATIO, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT,
+                       num_outputs=DEFAULT_NUM_OUTPUTS, lora_scale=DEFAULT_LORA_SCALE, num_inference_steps=DEFAULT_NUM_INFERENCE_STEPS,
+                       guidance_scale=DEFAULT_GUIDANCE_SCALE, seed=DEFAULT_SEED, output_format=DEFAULT_OUTPUT_FORMAT,
+                       output_quality=DEFAULT_OUTPUT_QUALITY, extra_lora_scale=DEFAULT_EXTRA_LORA_SCALE, extra_lora=DEFAULT_EXTRA_LORA,
+                       disable_safety_checker=DEFAULT_DISABLE_SAFETY_CHECKER):
     if seed == 0:
         seed = random.randint(1, 1_000_000)
         print(f"Random seed generated: {seed}")
 
     full_prompt = f"{ALWAYS_PREPENDED_PROMPT} {prompt}"
-    
+
     # Prepare input parameters
-    input_params = {
+    return {
         "model": model,
         "prompt": full_prompt,
         "aspect_ratio": aspect_ratio,
@@ -141,50 +228,343 @@ def run_model(client, model_version, prompt, model=DEFAULT_MODEL, aspect_ratio=D
         "extra_lora": extra_lora,
         "disable_safety_checker": disable_safety_checker
     }
-    
-    # Run the model
-    output = client.run(model_version, input=input_params)
-    
-    print("Model run successfully.")
-    return output
 
-# Save the generated images
-def save_images(urls, model_version, prompt, output_format):
+# Start a prediction, or re-attach to an earlier one by ID, and wait for its output in this thread.
+# on_submit(prediction_id) is called as soon as a new prediction exists, so callers can record it before waiting,
+# and on_finish(prediction) with the final prediction as soon as it is seen to finish, before any output is downloaded.
+# The shared scheduler keeps all Replicate calls within the configured rate and in-flight limits.
+def run_prediction(client, model_version, input_params, priority=PRIORITY_INTERACTIVE, prediction_id=None, on_submit=None,
+                   on_finish=None):
+    get_prediction = get_scheduler().wrap(client.predictions.get, priority, operation="predictions.get")
+    prediction = start_prediction(client, model_version, input_params, priority, prediction_id, on_submit)
+
+    while prediction.status not in TERMINAL_STATUSES:
+        time.sleep(PREDICTION_POLL_INTERVAL)
+        prediction = retry_call(get_prediction, prediction.id, breaker="replicate", wait_for_circuit=True,
+                                operation=f"Status check of {prediction.id}")
+    if on_finish is not None:
+        on_finish(prediction)
+
+    if prediction.status != "succeeded":
+        from replicate.exceptions import ModelError
+        raise ModelError(prediction)
+    return prediction.output
+
+# Run jobs through run_model with a bounded worker pool.
+# jobs may be any iterable, including a lazy stream: only a small window of jobs beyond the running ones is pulled
+# from it at a time, so memory use does not grow with the batch. Each job is a dict with a "prompt" and optionally
+# "kwargs", extra run_model arguments such as its seed or parameter overrides.
+# Yields (job, output, error) tuples in completion order; error is None on success.
+# The timeout clock for a job starts when a worker picks it up, not when it is queued.
+# A timed out call cannot be interrupted, so it keeps its worker until Replicate answers and its result is discarded.
+def run_jobs_concurrently(client, model_version, jobs, max_workers=MAX_CONCURRENT_PROMPTS, timeout=PROMPT_TIMEOUT, **run_kwargs):
+    max_workers = max(1, max_workers)
+    max_queued = 2 * max_workers
+    started_at = {}
+    lock = threading.Lock()
+
+    def run_job(future_id, job):
+        with lock:
+            started_at[future_id] = time.monotonic()
+        return run_model(client, model_version, job["prompt"], **dict(run_kwargs, **job.get("kwargs", {})))
+
+    jobs = iter(jobs)
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = {}
+    future_ids = itertools.count()
+    try:
+        print(f"Running prompts with up to {max_workers} at once.")
+        while True:
+            for job in itertools.islice(jobs, max(0, max_queued - len(pending))):
+                future_id = next(future_ids)
+                pending[executor.submit(run_job, future_id, job)] = (future_id, job)
+            if not pending:
+                break
+
+            wait_timeout = None
+            if timeout is not None:
+                with lock:
+                    deadlines = [started_at[future_id] + timeout for future_id, _ in pending.values() if future_id in started_at]
+                wait_timeout = max(0, min(deadlines) - time.monotonic()) if deadlines else timeout
+
+            done, _ = wait(pending, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                future_id, job = pending.pop(future)
+                with lock:
+                    started_at.pop(future_id, None)
+                try:
+                    yield job, future.result(), None
+                except Exception as e:
+                    yield job, None, e
+
+            if timeout is not None:
+                now = time.monotonic()
+                for future, (future_id, job) in list(pending.items()):
+                    with lock:
+                        start = started_at.get(future_id)
+                    if start is not None and now - start >= timeout:
+                        pending.pop(future)
+                        yield job, None, TimeoutError(f"Prompt did not finish within {timeout} seconds")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+# Run jobs without a thread per prediction: a feeder thread pulls jobs from the (possibly lazy) iterable and submits
+# them, keeping up to max_in_flight predictions running, while a PredictionTracker follows them all from one thread.
+# Jobs are the same dicts run_jobs_concurrently takes, and results are yielded the same way, as (job, output, error)
+# tuples in completion order, so the caller can download each result the moment its prediction finishes.
+# The timeout clock for a job starts when its prediction is submitted; a prediction that runs past it is canceled.
+# With webhook_url, completions arrive through a local WebhookReceiver, with slow polling as a fallback.
+def run_jobs_async(client, model_version, jobs, max_in_flight=MAX_IN_FLIGHT_PREDICTIONS, timeout=PROMPT_TIMEOUT,
+                   priority=PRIORITY_BATCH, webhook_url=PREDICTION_WEBHOOK_URL):
+    max_in_flight = max(1, max_in_flight)
+    slots = threading.Semaphore(max_in_flight)
+    stopped = threading.Event()
+    feed_done = object()
+
+    tracker = PredictionTracker(client, priority, timeout, webhook_url)
+    results = tracker.completions
+    receiver = None
+
+    def submit(job):
+        kwargs = dict(job.get("kwargs", {}))
+        cache = kwargs.pop("cache", None)
+        prediction_id = kwargs.pop("prediction_id", None)
+        on_submit = kwargs.pop("on_submit", None)
+        on_finish = kwargs.pop("on_finish", None)
+        if kwargs.get("seed", DEFAULT_SEED) == 0:
+            cache = None
+        input_params = build_input_params(job["prompt"], **kwargs)
+
+        cache_key = None
+        if cache is not None:
+            cache_key = make_cache_key(model_version, input_params)
+            cached_files = cache.get(cache_key)
+            if cached_files is not None:
+                print(f"Result cache hit ({cache_key[:12]}), skipping remote inference.")
+                results.put(((job, None, None), cached_files, None))
+                return
+
+        key = (job, cache, cache_key)
+        submitted_id = tracker.submit(key, model_version, input_params, prediction_id, on_submit, on_finish)
+        print(f"Submitted prediction {submitted_id} for prompt: {job['prompt'][:60]}...")
+
+    def feed():
+        try:
+            for job in jobs:
+                while not slots.acquire(timeout=1):
+                    if stopped.is_set():
+                        return
+                if stopped.is_set():
+                    return
+                try:
+                    submit(job)
+                except Exception as e:
+                    results.put(((job, None, None), None, e))
+            results.put(feed_done)
+        except BaseException as e:
+            # Reading the jobs failed; the error is raised to the caller
+            results.put(((None, None, None), None, e))
+
+    feeder = threading.Thread(target=feed, name="prediction-feeder", daemon=True)
+    try:
+        if webhook_url:
+            receiver = WebhookReceiver(tracker, secret=get_webhook_secret(client)).start()
+        print(f"Running prompts asynchronously with up to {max_in_flight} predictions in flight.")
+        feeder.start()
+
+        feeding = True
+        while feeding or tracker.in_flight() or not results.empty():
+            item = results.get()
+            if item is feed_done:
+                feeding = False
+                continue
+            (job, cache, cache_key), output, error = item
+            if job is None:
+                raise error
+            slots.release()
+            if error is None and cache_key is not None:
+                output = cache.put(cache_key, output)
+            yield job, output, error
+    finally:
+        stopped.set()
+        tracker.close()
+        if receiver is not None:
+            receiver.stop()
+
+# Save the generated images and return the paths that were written.
+# With an output_store, each image is deduplicated into it and indexed under prompt and seed, and re-encoded first
+# if transcode_format is set.
+@timed("save_images")
+def save_images(urls, model_version, job_id, output_format, output_store=None, prompt=None, seed=None, transcode_format=None,
+                quality=None):
     if not os.path.exists("generated_images"):
         os.makedirs("generated_images")
         print("Directory 'generated_images' created.")
     
-    for index, url in enumerate(urls):
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        file_name = f"generated_images/{timestamp}_{model_version.split(':')[1]}_{index}_prompt_{CUSTOM_PROMPTS.index(prompt)}.{output_format}"
-        response = requests.get(url)
-        if response.status_code == 200:
-            with open(file_name, 'wb') as f:
-                f.write(response.content)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    downloads = [
+        (url, f"generated_images/{timestamp}_{model_version.split(':')[1]}_{job_id}_{index}.{output_format}")
+        for index, url in enumerate(urls)
+    ]
+
+    # Stream all outputs to disk in parallel over the shared download session
+    saved = []
+    for url, file_name, error in download_files(downloads):
+        if error is None and output_store is not None:
+            try:
+                file_name, digest, duplicate = output_store.ingest(
+                    file_name, model_version, prompt, seed, job_id, transcode_format,
+                    DEFAULT_OUTPUT_QUALITY if quality is None else quality)
+                if duplicate:
+                    increment("images_deduplicated_total")
+                    print(f"Image {digest[:12]} is already stored, linked instead of copied.")
+            except OSError as e:
+                print(f"Could not add {file_name} to the output store, keeping it as is: {e}")
+        if error is None:
+            saved.append(file_name)
+            increment("images_saved_total")
             print(f"Image saved as {file_name}")
         else:
-            print(f"Failed to download image from {url}")
+            print(f"Failed to download image from {url}: {error}")
+    return saved
 
-# Main function to encapsulate the sequence of operations
-def main():
+# Main function to encapsulate the sequence of operations.
+# With prompt_source (a prompt file, a JSONL file or "-" for stdin), jobs are streamed from it instead of CUSTOM_PROMPTS
+# and jobs already recorded as succeeded in the output manifest are skipped.
+def main(prompt_source=None, manifest_path=OUTPUT_MANIFEST_FILE):
     start_time = time.time()
     print("Starting main process...")
+    validate_config()
 
     client = initialize_client()
-    
-    # Loop through each prompt in the CUSTOM_PROMPTS list
-    for prompt in CUSTOM_PROMPTS:
-        output = run_model(client, MODEL_VERSION, prompt)
-        
-        print("Output URLs:")
-        for url in output:
-            print(url)
-        
-        save_images(output, MODEL_VERSION, prompt, DEFAULT_OUTPUT_FORMAT)
-    
+    result_cache = ResultCache() if RESULT_CACHE_ENABLED else None
+    output_store = OutputStore() if OUTPUT_STORE_ENABLED else None
+
+    job_store = None
+    if JOB_STORE_ENABLED:
+        job_store = JobStore()
+        settings = {name: globals()[f"DEFAULT_{name.upper()}"] for name in RUN_MODEL_PARAMETERS}
+        settings["prepended_prompt"] = ALWAYS_PREPENDED_PROMPT
+
+    if prompt_source is not None:
+        completed = load_completed_job_ids(manifest_path)
+        if completed:
+            print(f"Skipping {len(completed)} jobs already completed in '{manifest_path}'.")
+        jobs = (job for job in iter_prompt_jobs(prompt_source, RUN_MODEL_PARAMETERS) if job["id"] not in completed)
+        if job_store is not None:
+            # Jobs are recorded by their job ID as they are read, so an interrupted run re-attaches to the predictions
+            # it already started. Stdin has no name, so every "-" run shares one batch and is matched by job ID alone.
+            source_name = prompt_source if prompt_source == "-" else os.path.abspath(prompt_source)
+            batch_id, resumed = job_store.start_stream_batch(
+                make_batch_key(MODEL_VERSION, [], dict(settings, prompt_source=source_name)))
+            print(f"{'Resuming' if resumed else 'Started'} batch {batch_id} for '{prompt_source}'.")
+            jobs = (dict(job, stored=job_store.add_job(batch_id, job["id"], job["line"], job["prompt"],
+                                                       job["overrides"].get("seed", DEFAULT_SEED)))
+                    for job in jobs)
+    else:
+        jobs = list(jobs_from_prompts(CUSTOM_PROMPTS))
+        if job_store is not None:
+            # Resume the unfinished batch for these prompts and settings, if a previous run was interrupted
+            batch_id, stored_jobs, resumed = job_store.start_batch(make_batch_key(MODEL_VERSION, CUSTOM_PROMPTS, settings),
+                                                                   CUSTOM_PROMPTS, DEFAULT_SEED)
+            if resumed:
+                print(f"Resuming batch {batch_id}: {len(stored_jobs)} of {len(CUSTOM_PROMPTS)} prompts left to run.")
+            else:
+                print(f"Started batch {batch_id} with {len(stored_jobs)} prompts.")
+            jobs = [dict(jobs[stored["position"]], stored=stored) for stored in stored_jobs]
+
+    # Settle each job's run_model arguments as it is pulled from the input.
+    # Random seeds are drawn here so the manifest records the seed that produced each image;
+    # their outputs never repeat, so they skip the result cache.
+    def prepare(jobs):
+        for job in jobs:
+            kwargs = dict(job["overrides"])
+            requested_seed = kwargs.get("seed", DEFAULT_SEED)
+            stored = job.get("stored")
+            if stored is not None:
+                kwargs["seed"] = stored["seed"]
+                kwargs["prediction_id"] = stored["prediction_id"]
+                kwargs["on_submit"] = functools.partial(job_store.mark_submitted, stored["job_id"])
+            else:
+                kwargs["seed"] = requested_seed or random.randint(1, 1_000_000)
+            kwargs["cache"] = result_cache if requested_seed else None
+            yield dict(job, kwargs=kwargs)
+
+    # Run the jobs concurrently, save each result as soon as it completes and record it in the manifest
+    total_jobs = 0
+    failed_jobs = 0
+    pulled_job_ids = []
+    with ManifestWriter(manifest_path) as manifest:
+        if GENERATION_MODE == "async":
+            results = run_jobs_async(client, MODEL_VERSION, prepare(jobs), MAX_IN_FLIGHT_PREDICTIONS, PROMPT_TIMEOUT,
+                                     PRIORITY_BATCH, PREDICTION_WEBHOOK_URL)
+        else:
+            results = run_jobs_concurrently(client, MODEL_VERSION, prepare(jobs), MAX_CONCURRENT_PROMPTS, PROMPT_TIMEOUT,
+                                            priority=PRIORITY_BATCH)
+        for job, output, error in results:
+            total_jobs += 1
+            saved = []
+            if error is None:
+                print("Output URLs:")
+                for url in output:
+                    print(url)
+
+                output_format = job["kwargs"].get("output_format", DEFAULT_OUTPUT_FORMAT)
+                saved = save_images(output, MODEL_VERSION, job["id"], output_format, output_store, job["prompt"],
+                                    job["kwargs"]["seed"], OUTPUT_TRANSCODE_FORMAT,
+                                    job["kwargs"].get("output_quality", DEFAULT_OUTPUT_QUALITY))
+                if len(saved) < len(output):
+                    error = RuntimeError(f"{len(output) - len(saved)} of {len(output)} images could not be downloaded")
+
+            stored = job.get("stored")
+            if stored is not None:
+                pulled_job_ids.append(stored["job_id"])
+            if error is not None:
+                failed_jobs += 1
+                print(f"Prompt failed: {job['prompt'][:60]}... ({error})")
+                if stored is not None:
+                    job_store.mark_failed(stored["job_id"], error)
+            elif stored is not None:
+                job_store.mark_succeeded(stored["job_id"], saved)
+            manifest.write(job, "failed" if error is not None else "succeeded", job["kwargs"]["seed"], saved, error)
+
+    print(f"Results recorded in '{manifest_path}'.")
+    if failed_jobs:
+        print(f"{failed_jobs} of {total_jobs} prompts failed.")
+
+    if job_store is not None:
+        # A streamed input is read to the end, so jobs of this batch it no longer contains are dropped
+        if job_store.finish_batch(batch_id, pulled_job_ids if prompt_source is not None else None):
+            print(f"Batch {batch_id} is complete.")
+        else:
+            print(f"Batch {batch_id} is unfinished. Run again to retry the failed prompts.")
+        job_store.close()
+
+    if result_cache is not None:
+        stats = result_cache.stats()
+        print(f"Result cache: {stats['session_hits']} hits, {stats['session_misses']} misses this run.")
+        result_cache.close()
+
+    if output_store is not None:
+        stats = output_store.stats()
+        print(f"Output store: {stats['images']} distinct images in {stats['files']} files, "
+              f"{stats['stored_bytes'] / 1024 ** 2:.1f} MB stored, {stats['saved_bytes'] / 1024 ** 2:.1f} MB saved by deduplication.")
+        output_store.close()
+
+    get_scheduler().print_stats()
+    print_summary()
+    write_prometheus()
+
     end_time = time.time()
     total_time = end_time - start_time
     print(f"Total execution time: {total_time:.2f} seconds")
 
+# Usage: python query_lora_model.py [prompts.jsonl | prompts.txt | -]
 if __name__ == "__main__":
-    main()
+    try:
+        main(sys.argv[1] if len(sys.argv) > 1 else None)
+    except Exception as e:
+        if not isinstance(e, (ResilienceError, ConfigError)) and not is_replicate_error(e):
+            raise
+        print(f"Error: {e}")
+        exit(1)
@@ -0,0 +1,163 @@
+import time
+import heapq
+import itertools
+import threading
+from contextlib import contextmanager
+from metrics_utils import observe, span
+
+# GLOBAL VARIABLES for easy tweaks
+
+# Outgoing Replicate API calls allowed per second on average, and how many may be sent back-to-back after a pause.
+# Set REPLICATE_REQUESTS_PER_SECOND to None to disable rate limiting.
+REPLICATE_REQUESTS_PER_SECOND = 10
+REPLICATE_BURST = 10
+
+# Maximum number of Replicate API calls in flight at once. Slots are held for single HTTP requests only (create, get,
+# list, cancel); waiting for an inference to finish happens between status checks, outside any slot, so training and
+# interactive calls never queue behind running batch inferences.
+REPLICATE_MAX_IN_FLIGHT = 16
+
+# Priorities for queued calls; lower numbers are served first
+PRIORITY_TRAINING = 0
+PRIORITY_INTERACTIVE = 1
+PRIORITY_BATCH = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_TRAINING: "training",
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_BATCH: "batch",
+}
+
+# Token-bucket rate limiter with a priority queue and an in-flight cap.
+# Waiters are served strictly by (priority, arrival order); only the head of the queue may take a token.
+class RequestScheduler:
+    def __init__(self, requests_per_second=REPLICATE_REQUESTS_PER_SECOND, burst=REPLICATE_BURST,
+                 max_in_flight=REPLICATE_MAX_IN_FLIGHT):
+        self.requests_per_second = requests_per_second
+        self.burst = max(1, burst)
+        self.max_in_flight = max_in_flight
+        self.condition = threading.Condition()
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.in_flight = 0
+        self.max_queue_depth = 0
+        self.wait_stats = {}
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.requests_per_second is None:
+            self.tokens = self.burst
+        else:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.requests_per_second)
+        self.updated_at = now
+
+    def _record_wait(self, priority, waited):
+        stats = self.wait_stats.setdefault(priority, {"requests": 0, "total_wait": 0.0, "max_wait": 0.0})
+        stats["requests"] += 1
+        stats["total_wait"] += waited
+        stats["max_wait"] = max(stats["max_wait"], waited)
+
+    # Block until this caller may send a request, then take a token and an in-flight slot
+    def acquire(self, priority=PRIORITY_INTERACTIVE):
+        ticket = (priority, next(self.sequence))
+        queued_at = time.monotonic()
+
+        with self.condition:
+            heapq.heappush(self.waiting, ticket)
+            self.max_queue_depth = max(self.max_queue_depth, len(self.waiting))
+            try:
+                while True:
+                    self._refill()
+                    at_head = self.waiting[0] == ticket
+                    has_slot = self.max_in_flight is None or self.in_flight < self.max_in_flight
+                    if at_head and has_slot and self.tokens >= 1:
+                        break
+                    # Only the head waits on the clock; everyone else waits to be notified
+                    timeout = None
+                    if at_head and has_slot:
+                        timeout = (1 - self.tokens) / self.requests_per_second
+                    self.condition.wait(timeout)
+            except BaseException:
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+                self.condition.notify_all()
+                raise
+
+            heapq.heappop(self.waiting)
+            self.tokens -= 1
+            self.in_flight += 1
+            waited = time.monotonic() - queued_at
+            self._record_wait(priority, waited)
+            self.condition.notify_all()
+
+        observe("replicate_queue_wait", waited, priority=PRIORITY_NAMES.get(priority, str(priority)))
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    @contextmanager
+    def slot(self, priority=PRIORITY_INTERACTIVE):
+        self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    # Wrap fn so every call goes through the scheduler at the given priority.
+    # Time spent queueing and time spent in the call itself are recorded as separate stages.
+    # fn should be a single API request; never wrap a call that blocks until a prediction or training finishes.
+    def wrap(self, fn, priority=PRIORITY_INTERACTIVE, operation=None):
+        operation = operation or getattr(fn, "__qualname__", "scheduled")
+
+        def scheduled(*args, **kwargs):
+            with self.slot(priority):
+                with span("replicate_call", operation=operation):
+                    return fn(*args, **kwargs)
+        scheduled.__qualname__ = operation
+        return scheduled
+
+    # Queue depth, in-flight count and wait times per priority
+    def stats(self):
+        with self.condition:
+            per_priority = {}
+            for priority, stats in sorted(self.wait_stats.items()):
+                per_priority[PRIORITY_NAMES.get(priority, str(priority))] = {
+                    "requests": stats["requests"],
+                    "avg_wait": stats["total_wait"] / stats["requests"],
+                    "max_wait": stats["max_wait"],
+                }
+            return {
+                "queue_depth": len(self.waiting),
+                "max_queue_depth": self.max_queue_depth,
+                "in_flight": self.in_flight,
+                "wait": per_priority,
+            }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"Request scheduler: queue depth {stats['queue_depth']} (max {stats['max_queue_depth']}), "
+              f"{stats['in_flight']} in flight")
+        for name, wait in stats["wait"].items():
+            print(f"  {name}: {wait['requests']} requests, avg wait {wait['avg_wait']:.2f}s, max wait {wait['max_wait']:.2f}s")
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+# The scheduler shared by every module that talks to Replicate
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+        return _scheduler
+
+# Drop the shared scheduler, so the next get_scheduler() starts idle with the current REPLICATE_* settings.
+# Meant for tests and benchmarks; callers holding wrapped functions keep using the old scheduler.
+def reset_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = None
@@ -0,0 +1,213 @@
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+
+# GLOBAL VARIABLES for easy tweaks
+
+# Attempts per call and the exponential backoff bounds (seconds). Delays use full jitter: uniform(0, bound).
+RETRY_MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 1
+RETRY_MAX_DELAY = 60
+
+# Longest Retry-After a server may ask for before the call is given up instead (seconds)
+RETRY_AFTER_MAX = 300
+
+# Consecutive transient failures that open a circuit, and how long it stays open before a trial call (seconds)
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 30
+
+# Status codes that mean the request was rejected before any work was done, so retrying is always safe
+REJECTED_STATUS_CODES = {429}
+
+# Status codes worth retrying for idempotent calls; the request may or may not have been processed
+TRANSIENT_STATUS_CODES = {500, 502, 503, 504}
+
+class ResilienceError(Exception):
+    pass
+
+# Raised when every attempt failed; the last underlying error is chained as __cause__
+class RetryExhaustedError(ResilienceError):
+    def __init__(self, operation, attempts, last_error):
+        super().__init__(f"{operation} failed after {attempts} attempts: {last_error}")
+        self.attempts = attempts
+        self.last_error = last_error
+
+# Raised without calling out when a service's circuit is open
+class CircuitOpenError(ResilienceError):
+    def __init__(self, name, retry_in):
+        super().__init__(f"Circuit '{name}' is open after repeated failures; retry in {retry_in:.0f} seconds")
+        self.name = name
+        self.retry_in = retry_in
+
+# Stops calling a failing service for a while instead of piling more requests onto it.
+# closed: calls flow normally. open: calls fail fast. half-open: one trial call decides whether to close again.
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0
+        self.trial_in_flight = False
+
+    def before_call(self):
+        with self.lock:
+            if self.state == "open":
+                retry_in = self.opened_at + self.reset_timeout - time.monotonic()
+                if retry_in > 0:
+                    raise CircuitOpenError(self.name, retry_in)
+                self.state = "half-open"
+                self.trial_in_flight = False
+            if self.state == "half-open":
+                if self.trial_in_flight:
+                    raise CircuitOpenError(self.name, self.reset_timeout)
+                self.trial_in_flight = True
+
+    def record_success(self):
+        with self.lock:
+            if self.state != "closed":
+                print(f"Circuit '{self.name}' closed again.")
+            self.state = "closed"
+            self.failures = 0
+            self.trial_in_flight = False
+
+    # The service turned the call away (429) before doing any work. That says nothing about its health,
+    # so the circuit is left as it is; only a pending trial call is released.
+    def record_rejected(self):
+        with self.lock:
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.state == "half-open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"Circuit '{self.name}' opened after {self.failures} consecutive failures.")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+# Shared circuit breaker per service name, e.g. "replicate", "downloads" or "gdrive"
+def get_circuit_breaker(name):
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+# Forget every shared circuit breaker, so all circuits start closed again. Meant for tests and benchmarks.
+def reset_circuit_breakers():
+    with _breakers_lock:
+        _breakers.clear()
+
+# Exponential backoff bound for this attempt with full jitter
+def compute_backoff(attempt, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+def _get_status_code(error):
+    response = getattr(error, "response", None)
+    status_code = getattr(response, "status_code", None)
+    if status_code is None:
+        status_code = getattr(error, "status", None)  # replicate.exceptions.ReplicateError
+    return status_code if isinstance(status_code, int) else None
+
+# Seconds requested by a Retry-After header (delta-seconds or HTTP date), or None
+def get_retry_after(error):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    value = headers.get("Retry-After") if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+# Network error classes, split by whether the request can have reached the server.
+# Imported lazily so this module stays cheap to import.
+def _network_error_types():
+    import requests
+    import httpx
+    connect_errors = (requests.exceptions.ConnectTimeout, httpx.ConnectError, httpx.ConnectTimeout,
+                      httpx.PoolTimeout, ConnectionRefusedError)
+    ambiguous_errors = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                        httpx.TransportError, ConnectionError, TimeoutError)
+    return connect_errors, ambiguous_errors
+
+# Decide whether a failed call may be retried.
+# Rejected requests (429) and connection failures never reached the service, so they are always safe.
+# Server errors and dropped responses may have been processed, so they are only retried for idempotent calls.
+def is_retryable(error, idempotent=True):
+    status_code = _get_status_code(error)
+    if status_code is not None:
+        if status_code in REJECTED_STATUS_CODES:
+            return True
+        return idempotent and status_code in TRANSIENT_STATUS_CODES
+
+    connect_errors, ambiguous_errors = _network_error_types()
+    if isinstance(error, connect_errors):
+        return True
+    return idempotent and isinstance(error, ambiguous_errors)
+
+# Wait until the breaker lets a call through. Used by calls that follow work which already exists and is billed,
+# such as status checks of a running prediction, which should outlast an outage rather than fail the job.
+def _wait_for_circuit(breaker, operation, base_delay):
+    while True:
+        try:
+            breaker.before_call()
+            return
+        except CircuitOpenError as e:
+            delay = e.retry_in + random.uniform(0, base_delay)
+            print(f"{operation} is waiting {delay:.1f} seconds for circuit '{breaker.name}' to close...")
+            time.sleep(delay)
+
+# Call fn(*args, **kwargs), retrying transient failures with jittered exponential backoff and Retry-After.
+# Non-retryable errors are raised unchanged; RetryExhaustedError is raised once attempts run out.
+# An open circuit raises CircuitOpenError, unless wait_for_circuit is set: then the call waits for the circuit
+# instead, without using up attempts.
+def retry_call(fn, *args, idempotent=True, breaker=None, max_attempts=RETRY_MAX_ATTEMPTS, base_delay=RETRY_BASE_DELAY,
+               max_delay=RETRY_MAX_DELAY, operation=None, wait_for_circuit=False, **kwargs):
+    operation = operation or getattr(fn, "__qualname__", repr(fn))
+    if isinstance(breaker, str):
+        breaker = get_circuit_breaker(breaker)
+
+    for attempt in range(max_attempts):
+        if breaker is not None and wait_for_circuit:
+            _wait_for_circuit(breaker, operation, base_delay)
+        elif breaker is not None:
+            breaker.before_call()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            if not is_retryable(e, idempotent):
+                if breaker is not None:
+                    breaker.record_success()  # the service answered; the request itself was bad
+                raise
+            if breaker is not None and _get_status_code(e) in REJECTED_STATUS_CODES:
+                breaker.record_rejected()  # rate limited, not failing
+            elif breaker is not None:
+                breaker.record_failure()
+            if attempt == max_attempts - 1:
+                raise RetryExhaustedError(operation, max_attempts, e) from e
+
+            retry_after = get_retry_after(e)
+            if retry_after is not None and retry_after > RETRY_AFTER_MAX:
+                raise RetryExhaustedError(operation, attempt + 1, e) from e
+            delay = compute_backoff(attempt, base_delay, max_delay)
+            if retry_after is not None:
+                delay = retry_after + random.uniform(0, base_delay)
+            print(f"{operation} failed (attempt {attempt + 1} of {max_attempts}): {e}. Retrying in {delay:.1f} seconds...")
+            time.sleep(delay)
+        else:
+            if breaker is not None:
+                breaker.record_success()
+            return result
@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+from urllib.parse import urlparse
+from download_utils import download_files
+
+# GLOBAL VARIABLES for easy tweaks
+
+# Directory holding cached generations, one sub-directory per cache key
+RESULT_CACHE_DIR = ".result_cache"
+
+# Maximum total size of the cached images (bytes). Least recently used entries are evicted above this.
+RESULT_CACHE_MAX_BYTES = 2 * 1024 ** 3  # 2 GB
+
+INDEX_FILE_NAME = "index.json"
+
+# Hits, misses and last-access times are kept in memory and written to the index at most once per this many lookups
+# (and on every put, purge and close), so lookups do not rewrite the whole index each time
+RESULT_CACHE_SAVE_EVERY = 100
+
+# Build a canonical hash of the model version plus the full input payload
+def make_cache_key(model_version, input_params):
+    payload = json.dumps({"model_version": model_version, "input": input_params},
+                         sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+# On-disk LRU cache of run_model outputs. Outputs are stored as local files because Replicate output URLs expire.
+class ResultCache:
+    def __init__(self, cache_dir=RESULT_CACHE_DIR, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, INDEX_FILE_NAME)
+        self.lock = threading.Lock()
+        self.session_hits = 0
+        self.session_misses = 0
+        self.unsaved_lookups = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index = self._load_index()
+
+    def _load_index(self):
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, "r") as f:
+                    return json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Result cache index is unreadable, starting fresh: {e}")
+        return {"entries": {}, "hits": 0, "misses": 0}
+
+    # Write the index to a temp file and rename it so a crash never leaves it half written
+    def _save_index(self):
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".", suffix=".part")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(temp_path, self.index_path)
+        self.unsaved_lookups = 0
+
+    # Count a lookup, writing the index once enough of them have piled up
+    def _record_lookup(self):
+        self.unsaved_lookups += 1
+        if self.unsaved_lookups >= RESULT_CACHE_SAVE_EVERY:
+            self._save_index()
+
+    # Write lookups not yet saved to the index
+    def close(self):
+        with self.lock:
+            if self.unsaved_lookups:
+                self._save_index()
+
+    def _remove_entry(self, key):
+        self.index["entries"].pop(key, None)
+        shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+
+    # Return the cached file paths for key, or None on a miss
+    def get(self, key):
+        with self.lock:
+            entry = self.index["entries"].get(key)
+            if entry is not None and not all(os.path.exists(path) for path in entry["files"]):
+                self._remove_entry(key)
+                entry = None
+
+            if entry is None:
+                self.index["misses"] += 1
+                self.session_misses += 1
+                self._record_lookup()
+                return None
+
+            entry["last_access"] = time.time()
+            self.index["hits"] += 1
+            self.session_hits += 1
+            self._record_lookup()
+            return list(entry["files"])
+
+    # Download the output URLs into the cache under key and return the local file paths.
+    # If any download fails, or the outputs alone are larger than the whole cache, nothing is cached and the
+    # original URLs are returned.
+    def put(self, key, urls):
+        urls = [str(url) for url in urls]
+        entry_dir = os.path.join(self.cache_dir, key)
+        os.makedirs(entry_dir, exist_ok=True)
+
+        downloads = []
+        for index, url in enumerate(urls):
+            extension = os.path.splitext(urlparse(url).path)[1]
+            downloads.append((url, os.path.join(entry_dir, f"{index}{extension}")))
+
+        results = download_files(downloads)
+        if any(error is not None for _, _, error in results):
+            print("Failed to store outputs in the result cache; continuing without caching.")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return urls
+
+        files = [file_name for _, file_name, _ in results]
+        size = sum(os.path.getsize(path) for path in files)
+        if size > self.max_bytes:
+            print(f"Outputs ({size / 1024 ** 2:.1f} MB) are larger than the result cache, continuing without caching.")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return urls
+
+        now = time.time()
+        with self.lock:
+            self.index["entries"][key] = {
+                "files": files,
+                "size": size,
+                "created": now,
+                "last_access": now,
+            }
+            self._evict()
+            self._save_index()
+        return files
+
+    # Drop least recently used entries until the cache fits within max_bytes
+    def _evict(self):
+        entries = self.index["entries"]
+        total = sum(entry["size"] for entry in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            total -= entries[key]["size"]
+            print(f"Evicting cached result {key} from the result cache.")
+            self._remove_entry(key)
+
+    # Remove one entry, or every entry when key is None. Returns the number of entries removed.
+    def purge(self, key=None):
+        with self.lock:
+            entries = self.index["entries"]
+            if key is None:
+                keys = list(entries)
+            else:
+                keys = [key] if key in entries else []
+            for k in keys:
+                self._remove_entry(k)
+            self._save_index()
+            return len(keys)
+
+    def stats(self):
+        with self.lock:
+            entries = self.index["entries"]
+            return {
+                "entries": len(entries),
+                "total_bytes": sum(entry["size"] for entry in entries.values()),
+                "max_bytes": self.max_bytes,
+                "hits": self.index["hits"],
+                "misses": self.index["misses"],
+                "session_hits": self.session_hits,
+                "session_misses": self.session_misses,
+            }
+
+# Command line interface to inspect and purge the result cache
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and purge the run_model result cache.")
+    parser.add_argument("--cache-dir", default=RESULT_CACHE_DIR, help="Cache directory to operate on.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="Show size and hit/miss counters.")
+    subparsers.add_parser("list", help="List cached entries, most recently used first.")
+    purge_parser = subparsers.add_parser("purge", help="Remove cached entries.")
+    purge_parser.add_argument("key", nargs="?", help="Cache key to remove. Removes everything if omitted.")
+    args = parser.parse_args()
+
+    cache = ResultCache(cache_dir=args.cache_dir)
+
+    if args.command == "stats":
+        stats = cache.stats()
+        lookups = stats["hits"] + stats["misses"]
+        hit_rate = stats["hits"] / lookups * 100 if lookups else 0
+        print(f"Entries: {stats['entries']}")
+        print(f"Size: {stats['total_bytes'] / 1024 ** 2:.1f} MB of {stats['max_bytes'] / 1024 ** 2:.1f} MB")
+        print(f"Hits: {stats['hits']}  Misses: {stats['misses']}  Hit rate: {hit_rate:.1f}%")
+    elif args.command == "list":
+        entries = cache.index["entries"]
+        for key in sorted(entries, key=lambda k: entries[k]["last_access"], reverse=True):
+            entry = entries[key]
+            last_access = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry["last_access"]))
+            print(f"{key}  {len(entry['files'])} files  {entry['size'] / 1024 ** 2:.1f} MB  last used {last_access}")
+    elif args.command == "purge":
+        removed = cache.purge(args.key)
+        print(f"Removed {removed} cached entries.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+import os
+import sys
+import pytest
+
+# The modules live at the repository root rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics_utils
+import rate_limit_utils
+import resilience_utils
+
+# Every test starts with an idle scheduler, closed circuits and no recorded metrics
+@pytest.fixture(autouse=True)
+def reset_shared_state():
+    rate_limit_utils.reset_scheduler()
+    resilience_utils.reset_circuit_breakers()
+    metrics_utils.reset_metrics()
+    yield
+    rate_limit_utils.reset_scheduler()
+    resilience_utils.reset_circuit_breakers()
@@ -0,0 +1,54 @@
+import time
+import threading
+import query_lora_model
+from query_lora_model import run_jobs_concurrently
+
+# Stand-in for run_model: each prompt names how long its "prediction" takes
+class SlowModel:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+
+    def __call__(self, client, model_version, prompt, **kwargs):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        try:
+            time.sleep(float(prompt))
+            return [f"{prompt}.png"]
+        finally:
+            with self.lock:
+                self.running -= 1
+
+def test_at_most_max_workers_jobs_run_at_once(monkeypatch):
+    model = SlowModel()
+    monkeypatch.setattr(query_lora_model, "run_model", model)
+    jobs = [{"prompt": "0.05"} for _ in range(12)]
+
+    results = list(run_jobs_concurrently(None, "fake/model:1", jobs, max_workers=3, timeout=None))
+
+    assert len(results) == 12
+    assert all(error is None for _, _, error in results)
+    assert model.peak == 3
+
+def test_results_arrive_in_completion_order(monkeypatch):
+    monkeypatch.setattr(query_lora_model, "run_model", SlowModel())
+    jobs = [{"prompt": "0.3"}, {"prompt": "0.1"}, {"prompt": "0.2"}]
+
+    results = run_jobs_concurrently(None, "fake/model:1", jobs, max_workers=3, timeout=None)
+
+    assert [job["prompt"] for job, _, _ in results] == ["0.1", "0.2", "0.3"]
+
+def test_slow_job_times_out_without_holding_up_the_others(monkeypatch):
+    monkeypatch.setattr(query_lora_model, "run_model", SlowModel())
+    jobs = [{"prompt": "2"}, {"prompt": "0.05"}, {"prompt": "0.05"}]
+
+    started = time.monotonic()
+    results = list(run_jobs_concurrently(None, "fake/model:1", jobs, max_workers=2, timeout=0.5))
+    elapsed = time.monotonic() - started
+
+    timed_out = [job["prompt"] for job, _, error in results if isinstance(error, TimeoutError)]
+    assert timed_out == ["2"]
+    assert sum(error is None for _, _, error in results) == 2
+    assert elapsed < 1.5
@@ -0,0 +1,36 @@
+import os
+import zipfile
+import pytest
+import train_flux_lora
+from dataset_archive_utils import build_dataset_archive
+
+@pytest.fixture
+def source_dir(tmp_path):
+    from PIL import Image
+    directory = tmp_path / "sources"
+    directory.mkdir()
+    Image.new("RGBA", (900, 600), (0, 128, 0, 128)).save(directory / "b.png")
+    Image.effect_noise((1200, 800), 50).convert("RGB").save(directory / "a.jpg")
+    Image.effect_noise((500, 700), 30).convert("L").save(directory / "c.jpg")
+    return str(directory)
+
+def _members(zip_path):
+    with zipfile.ZipFile(zip_path) as archive:
+        return [(info.filename, info.date_time, info.compress_type, archive.read(info)) for info in archive.infolist()]
+
+@pytest.mark.parametrize("normalize", [True, False])
+def test_streamed_archive_matches_the_staged_one(tmp_path, monkeypatch, source_dir, normalize):
+    monkeypatch.setattr(train_flux_lora, "NORMALIZE_IMAGES", normalize)
+    monkeypatch.setattr(train_flux_lora, "NORMALIZE_MAX_WORKERS", 1)
+    max_side = train_flux_lora.parse_max_resolution(train_flux_lora.RESOLUTION)
+
+    staged_dir = str(tmp_path / "prepared")
+    train_flux_lora.prepare_images(source_dir, staged_dir, "TOK")
+    train_flux_lora.zip_images(staged_dir, str(tmp_path / "staged.zip"))
+    build_dataset_archive(source_dir, str(tmp_path / "streamed.zip"), "TOK", normalize, max_side,
+                          train_flux_lora.NORMALIZE_JPEG_QUALITY, max_workers=1)
+
+    streamed = _members(str(tmp_path / "streamed.zip"))
+    assert [name for name, *_ in streamed] == [f"{index}_A_photo_of_TOK.jpg" for index in range(3)]
+    assert streamed == _members(str(tmp_path / "staged.zip"))
+    assert not os.path.exists(os.path.join(source_dir, ".manifest.json"))
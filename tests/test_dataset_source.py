@@ -0,0 +1,79 @@
+import os
+import pytest
+import requests
+import dataset_source_utils
+from dataset_source_utils import FileUploadSource, GoogleDriveSource
+from config_utils import ConfigError
+from download_utils import get_session
+from fake_replicate_server import FakeReplicateServer
+
+def _make_zip(path, size=300 * 1024):
+    with open(path, 'wb') as f:
+        f.write(os.urandom(size))
+    return str(path)
+
+def _download(url):
+    response = get_session().get(url, timeout=10)
+    response.raise_for_status()
+    return response.content
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(dataset_source_utils, "compute_backoff", lambda attempt: 0)
+
+def test_upload_resumes_after_interruptions(tmp_path):
+    zip_file = _make_zip(tmp_path / "data.zip")
+    with FakeReplicateServer(error_rate=0.3, error_status=503, seed=1) as server:
+        source = FileUploadSource(f"{server.base_url}/uploads", cache_file=str(tmp_path / "cache.json"),
+                                  chunk_size=32 * 1024, max_retries=50)
+        url = source.resolve(zip_file)
+        server.error_rate = 0
+        assert server.stats()["uploads"] == 1
+        assert _download(url) == open(zip_file, 'rb').read()
+
+def test_finished_upload_is_reused_until_the_server_drops_it(tmp_path):
+    zip_file = _make_zip(tmp_path / "data.zip")
+    cache_file = str(tmp_path / "cache.json")
+    with FakeReplicateServer() as server:
+        first = FileUploadSource(f"{server.base_url}/uploads", cache_file=cache_file).resolve(zip_file)
+        assert FileUploadSource(f"{server.base_url}/uploads", cache_file=cache_file).resolve(zip_file) == first
+        assert server.stats()["uploads"] == 1
+
+        # Past the TTL the upload is checked first, and uploaded again once the server has expired it
+        server.uploads.clear()
+        second = FileUploadSource(f"{server.base_url}/uploads", cache_file=cache_file, cache_ttl=0).resolve(zip_file)
+        assert second != first
+        assert server.stats()["uploads"] == 1
+        assert _download(second) == open(zip_file, 'rb').read()
+
+def test_token_uploads_need_a_public_download_url(tmp_path):
+    zip_file = _make_zip(tmp_path / "data.zip")
+    with FakeReplicateServer(upload_token="secret") as server:
+        with pytest.raises(ValueError):
+            FileUploadSource(f"{server.base_url}/uploads", token="secret")
+
+        source = FileUploadSource(f"{server.base_url}/uploads", token="secret", download_url=f"{server.base_url}/uploads/",
+                                  cache_file=str(tmp_path / "cache.json"))
+        url = source.resolve(zip_file)
+        assert _download(url) == open(zip_file, 'rb').read()
+
+def test_wrong_token_is_a_config_error_and_not_retried(tmp_path):
+    zip_file = _make_zip(tmp_path / "data.zip")
+    with FakeReplicateServer(upload_token="secret") as server:
+        source = FileUploadSource(f"{server.base_url}/uploads", token="wrong", download_url=f"{server.base_url}/uploads/",
+                                  cache_file=str(tmp_path / "cache.json"))
+        with pytest.raises(ConfigError, match="DATASET_UPLOAD_TOKEN"):
+            source.resolve(zip_file)
+        assert server.stats()["requests"]["uploads.create"] == 1
+
+def test_wrong_upload_url_is_not_retried(tmp_path):
+    zip_file = _make_zip(tmp_path / "data.zip")
+    with FakeReplicateServer() as server:
+        source = FileUploadSource(f"{server.base_url}/not-uploads", cache_file=str(tmp_path / "cache.json"))
+        with pytest.raises(requests.HTTPError):
+            source.resolve(zip_file)
+
+def test_unresolvable_drive_link_is_a_config_error(tmp_path):
+    source = GoogleDriveSource("https://example.com/not-a-drive-link", cache_file=str(tmp_path / "cache.json"))
+    with pytest.raises(ConfigError, match="not-a-drive-link"):
+        source.resolve()
@@ -0,0 +1,22 @@
+import os
+from dataset_validation_utils import validate_dataset, load_validated_sources
+
+def _write_images(directory, sizes):
+    from PIL import Image
+    os.makedirs(directory, exist_ok=True)
+    for index, size in enumerate(sizes):
+        Image.effect_noise(size, 64).convert("RGB").save(os.path.join(directory, f"{index}.png"))
+
+def test_filtered_manifest_is_reused_until_the_sources_or_settings_change(tmp_path):
+    input_dir = str(tmp_path / "images")
+    manifest = str(tmp_path / "validated.json")
+    _write_images(input_dir, [(600, 600), (300, 300)])
+
+    accepted = validate_dataset(input_dir, str(tmp_path / "report.json"), manifest, min_side=512, max_workers=1)
+    assert accepted == ["0.png"]
+    assert load_validated_sources(manifest, input_dir, min_side=512) == ["0.png"]
+
+    assert load_validated_sources(manifest, input_dir, min_side=256) is None
+    assert load_validated_sources(manifest, str(tmp_path), min_side=512) is None
+    _write_images(input_dir, [(600, 600), (300, 300), (700, 700)])
+    assert load_validated_sources(manifest, input_dir, min_side=512) is None
@@ -0,0 +1,52 @@
+import os
+import pytest
+import requests
+from download_utils import download_file, download_files
+from fake_replicate_server import FakeReplicateServer
+
+def test_transient_errors_are_retried(tmp_path):
+    with FakeReplicateServer(image_bytes=5000, error_rate=0.5, error_status=503, seed=2) as server:
+        for index in range(5):
+            target = str(tmp_path / f"{index}.png")
+            assert download_file(f"{server.base_url}/files/a/{index}.png", target, max_retries=20, retry_delay=0.01) == 5000
+            assert os.path.getsize(target) == 5000
+        stats = server.stats()
+    assert stats["injected_errors"] > 0
+
+def test_client_errors_are_not_retried(tmp_path):
+    with FakeReplicateServer(error_rate=1.0, error_status=404) as server:
+        with pytest.raises(requests.HTTPError):
+            download_file(f"{server.base_url}/files/a/0.png", str(tmp_path / "image.png"), max_retries=5, retry_delay=0.01)
+        assert server.stats()["requests"]["files"] == 1
+
+# A response whose body breaks off after the first chunk
+class _BrokenResponse:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        yield b"partial"
+        raise requests.exceptions.ChunkedEncodingError("connection dropped")
+
+class _BrokenSession:
+    def get(self, url, **kwargs):
+        return _BrokenResponse()
+
+def test_interrupted_download_leaves_nothing_behind(tmp_path):
+    target = tmp_path / "image.png"
+    with pytest.raises(Exception):
+        download_file("https://example.com/image.png", str(target), session=_BrokenSession(), max_retries=2, retry_delay=0.01)
+    assert os.listdir(tmp_path) == []
+
+def test_download_files_reports_each_file(tmp_path):
+    with FakeReplicateServer(image_bytes=100) as server:
+        downloads = [(f"{server.base_url}/files/a/{index}.png", str(tmp_path / f"{index}.png")) for index in range(4)]
+        results = download_files(downloads, max_workers=2)
+    assert [(url, error) for url, _, error in results] == [(url, None) for url, _ in downloads]
+    assert sorted(os.listdir(tmp_path)) == ["0.png", "1.png", "2.png", "3.png"]
@@ -0,0 +1,31 @@
+import pytest
+import replicate
+import generation_grid
+from generation_grid import build_cells, build_grid_jobs, expand_grid, run_grid, summarize_cells
+from fake_replicate_server import FakeReplicateServer
+
+def test_expand_grid_requires_lists_of_values():
+    assert expand_grid({"model": ["dev"], "lora_scale": [0.8, 1]}) == [
+        {"lora_scale": 0.8, "model": "dev"}, {"lora_scale": 1, "model": "dev"}]
+    for parameters in ({"model": "schnell"}, {"model": []}, [{"model": ["dev"]}, "x"], []):
+        with pytest.raises(ValueError):
+            expand_grid(parameters)
+
+@pytest.mark.parametrize("mode", ["async", "threads"])
+def test_grid_records_timings_where_predictions_finish(tmp_path, monkeypatch, mode):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(generation_grid, "MODEL_VERSION", "fake/flux-lora:0123456789abcdef")
+    cells, _ = build_cells([{"num_inference_steps": [4]}, {"num_inference_steps": [28]}])
+    jobs = build_grid_jobs(["a cat"], cells, [1, 2])
+
+    with FakeReplicateServer(prediction_latency=0.2, latency_jitter=0, image_bytes=1000) as server:
+        client = replicate.Client(api_token="test", base_url=server.base_url)
+        results = run_grid(client, jobs, mode)
+
+    assert all(result["error"] is None and result["prediction_id"] for result in results)
+    assert all(result["predict_time"] == pytest.approx(0.2) for result in results)
+    assert all(result["latency"] is not None and result["latency"] >= 0.2 for result in results)
+    rows = summarize_cells(cells, results, cost_per_second=0.001)
+    # Two jobs per cell of DEFAULT_NUM_OUTPUTS (4) images, 0.2 GPU seconds each
+    assert [row["images"] for row in rows] == [8, 8]
+    assert all(row["cost_per_image_usd"] == pytest.approx(0.00005) for row in rows)
@@ -0,0 +1,41 @@
+import pytest
+import train_flux_lora
+from hyperparameter_sweep import build_trials
+
+def test_grid_covers_every_combination_on_top_of_the_defaults():
+    trials = build_trials("grid", {"steps": [500, 1000], "lora_rank": [8, 16, 32]})
+    assert len(trials) == 6
+    assert {(t["steps"], t["lora_rank"]) for t in trials} == {(s, r) for s in (500, 1000) for r in (8, 16, 32)}
+    assert all(t["optimizer"] == train_flux_lora.OPTIMIZER for t in trials)
+
+def test_defaults_follow_train_flux_lora_at_call_time(monkeypatch):
+    monkeypatch.setattr(train_flux_lora, "LEARNING_RATE", 0.0001)
+    trials = build_trials("grid", {"steps": [500]})
+    assert trials[0]["learning_rate"] == 0.0001
+
+def test_random_ranges_stay_in_bounds_and_integers_are_rounded():
+    parameters = {"learning_rate": {"min": 0.0001, "max": 0.001, "log": True}, "steps": {"min": 500, "max": 1500}}
+    trials = build_trials("random", parameters, num_trials=5, seed=3)
+    assert len(trials) == 5
+    for trial in trials:
+        assert 0.0001 <= trial["learning_rate"] <= 0.001
+        assert isinstance(trial["steps"], int) and 500 <= trial["steps"] <= 1500
+    assert build_trials("random", parameters, num_trials=5, seed=3) == trials
+
+def test_duplicate_samples_are_dropped(capsys):
+    trials = build_trials("random", {"lora_rank": [16]}, num_trials=4)
+    assert len(trials) == 1
+    assert "Only 1 of the 4 sampled trials are distinct" in capsys.readouterr().out
+
+@pytest.mark.parametrize("mode, parameters, message", [
+    ("grid", {"steps": 1000}, "must be a list of values"),
+    ("grid", {"steps": []}, "has no values"),
+    ("grid", {"steps": {"min": 1, "max": 2}}, "only random search supports"),
+    ("random", {"steps": {"min": 2, "max": 1}}, "needs \"min\" <= \"max\""),
+    ("random", {"learning_rate": {"min": 0, "max": 1, "log": True}}, "must be positive"),
+    ("grid", {"warmup": [1]}, "Unknown sweep parameters: warmup"),
+    ("bayes", {"steps": [1000]}, "Unknown sweep mode"),
+])
+def test_invalid_specs_are_rejected(mode, parameters, message):
+    with pytest.raises(ValueError, match=message):
+        build_trials(mode, parameters)
@@ -0,0 +1,44 @@
+from PIL import Image
+from image_normalization_utils import normalize_image, normalize_images, parse_max_resolution
+
+def test_large_image_is_downscaled_to_the_largest_bucket(tmp_path):
+    source = str(tmp_path / "large.png")
+    Image.new("RGB", (3000, 2000), (10, 20, 30)).save(source)
+
+    assert normalize_image(source, str(tmp_path / "out.jpg"), parse_max_resolution("512, 768, 1024")) == (1536, 1024)
+    with Image.open(tmp_path / "out.jpg") as image:
+        assert (image.format, image.mode, image.size) == ("JPEG", "RGB", (1536, 1024))
+
+def test_small_image_is_never_upscaled(tmp_path):
+    source = str(tmp_path / "small.jpg")
+    Image.new("RGB", (300, 200)).save(source)
+    assert normalize_image(source, str(tmp_path / "out.jpg"), 1024) == (300, 200)
+
+def test_transparency_is_flattened_onto_white(tmp_path):
+    source = str(tmp_path / "transparent.png")
+    Image.new("RGBA", (20, 20), (255, 0, 0, 0)).save(source)
+    normalize_image(source, str(tmp_path / "out.jpg"), 1024)
+    with Image.open(tmp_path / "out.jpg") as image:
+        assert image.mode == "RGB"
+        assert all(channel > 245 for channel in image.getpixel((10, 10)))
+
+def test_exif_orientation_is_applied(tmp_path):
+    source = str(tmp_path / "rotated.jpg")
+    exif = Image.Exif()
+    exif[0x0112] = 6  # stored landscape, displayed rotated 90 degrees clockwise
+    Image.new("RGB", (400, 200)).save(source, exif=exif)
+
+    normalize_image(source, str(tmp_path / "out.jpg"), 1024)
+    with Image.open(tmp_path / "out.jpg") as image:
+        assert image.size == (200, 400)
+        assert image.getexif().get(0x0112) in (None, 1)
+
+def test_unreadable_image_is_reported_not_raised(tmp_path):
+    good = str(tmp_path / "good.png")
+    Image.new("RGB", (10, 10)).save(good)
+    bad = tmp_path / "bad.jpg"
+    bad.write_bytes(b"not an image")
+
+    results = normalize_images([(good, str(tmp_path / "0.jpg")), (str(bad), str(tmp_path / "1.jpg"))], 1024, max_workers=1)
+    assert [error is None for _, _, error in results] == [True, False]
+    assert not (tmp_path / "1.jpg").exists()
@@ -0,0 +1,53 @@
+from job_store_utils import JobStore, JOB_FAILED, JOB_PENDING, JOB_SUBMITTED
+
+def test_late_submission_does_not_revive_a_failed_job(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    batch_id, jobs, resumed = store.start_batch("key", ["a cat"], seed=1)
+    job_id = jobs[0]["job_id"]
+    store.mark_failed(job_id, "timed out")
+    store.mark_submitted(job_id, "late")
+    assert store.jobs(batch_id)[0]["status"] == JOB_FAILED
+
+    # Resuming the batch makes the failed job pending again, so its next submission is recorded
+    _, jobs, resumed = store.start_batch("key", ["a cat"], seed=1)
+    assert resumed and jobs[0]["status"] == JOB_PENDING
+    store.mark_submitted(job_id, "retry")
+    job = store.jobs(batch_id)[0]
+    assert (job["status"], job["prediction_id"]) == (JOB_SUBMITTED, "retry")
+    store.close()
+
+def test_resume_reruns_succeeded_jobs_whose_images_were_deleted(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    batch_id, jobs, _ = store.start_batch("key", ["a cat", "a dog", "a bird"], seed=1)
+    kept = str(tmp_path / "kept.png")
+    open(kept, 'wb').close()
+    store.mark_submitted(jobs[0]["job_id"], "p0")
+    store.mark_succeeded(jobs[0]["job_id"], [kept])
+    store.mark_submitted(jobs[1]["job_id"], "p1")
+    store.mark_succeeded(jobs[1]["job_id"], [str(tmp_path / "deleted.png")])
+
+    _, jobs, resumed = store.start_batch("key", ["a cat", "a dog", "a bird"], seed=1)
+    assert resumed
+    assert [(job["position"], job["prediction_id"]) for job in jobs] == [(1, None), (2, None)]
+    store.close()
+
+def test_streamed_jobs_keep_their_seed_and_prediction_when_resumed(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    batch_id, resumed = store.start_stream_batch("stream")
+    assert not resumed
+    first = store.add_job(batch_id, "cat-1", 1, "a cat")
+    store.mark_submitted(first["job_id"], "p0")
+    store.add_job(batch_id, "dog-1", 2, "a dog", seed=7)
+    store.close()
+
+    # After a crash the same input reads the jobs again and gets back what was recorded for them
+    store = JobStore(str(tmp_path / "jobs.db"))
+    assert store.start_stream_batch("stream") == (batch_id, True)
+    again = store.add_job(batch_id, "cat-1", 1, "a cat")
+    assert (again["seed"], again["prediction_id"], again["status"]) == (first["seed"], "p0", JOB_SUBMITTED)
+    store.mark_succeeded(again["job_id"], [])
+
+    # The dog line was removed from the input, so it no longer holds the batch open
+    assert store.finish_batch(batch_id, [again["job_id"]])
+    assert [job["job_id"] for job in store.jobs(batch_id)] == [again["job_id"]]
+    store.close()
@@ -0,0 +1,12 @@
+import os
+import sys
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter, since this test process has already imported the SDKs
+def test_importing_cli_does_not_load_the_sdks():
+    env = {key: value for key, value in os.environ.items() if key not in ("REPLICATE_API_TOKEN", "HUGGING_FACE_TOKEN")}
+    code = "import sys, cli; print(' '.join(name for name in ('replicate', 'huggingface_hub') if name in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, env=env, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ""
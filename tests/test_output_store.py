@@ -0,0 +1,44 @@
+import os
+from output_store_utils import OutputStore
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+def _store(tmp_path, max_bytes=None):
+    return OutputStore(str(tmp_path / "objects"), str(tmp_path / "index.db"), max_bytes=max_bytes)
+
+def test_identical_outputs_are_stored_once(tmp_path):
+    store = _store(tmp_path)
+    data = os.urandom(1000)
+    first, digest, duplicate = store.ingest(_write(str(tmp_path / "out" / "a.png"), data), prompt="a cat", seed=1)
+    second, same_digest, second_duplicate = store.ingest(_write(str(tmp_path / "out" / "b.png"), data), prompt="a cat", seed=2)
+
+    assert (duplicate, second_duplicate) == (False, True)
+    assert digest == same_digest
+    assert open(second, 'rb').read() == data
+    stats = store.stats()
+    assert (stats["files"], stats["images"], stats["saved_bytes"]) == (2, 1, 1000)
+    assert [row["seed"] for row in store.find("a cat")] == [2, 1]
+    store.close()
+
+def test_prune_forgets_deleted_files_and_orphaned_images(tmp_path):
+    store = _store(tmp_path)
+    path, _, _ = store.ingest(_write(str(tmp_path / "out" / "a.png"), os.urandom(1000)))
+    store.ingest(_write(str(tmp_path / "out" / "b.png"), os.urandom(1000)))
+    os.remove(path)
+
+    assert store.prune() == (1, 1)
+    assert store.stats()["images"] == 1
+    assert store.prune() == (0, 0)
+    store.close()
+
+def test_retention_limit_deletes_the_oldest_images(tmp_path):
+    store = _store(tmp_path, max_bytes=2500)
+    paths = [store.ingest(_write(str(tmp_path / "out" / f"{index}.png"), os.urandom(1000)))[0] for index in range(3)]
+
+    assert [os.path.exists(path) for path in paths] == [False, True, True]
+    assert store.stats()["stored_bytes"] == 2000
+    store.close()
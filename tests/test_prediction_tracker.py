@@ -0,0 +1,35 @@
+import replicate
+import requests
+from prediction_tracker_utils import PredictionTracker, WebhookReceiver
+from fake_replicate_server import FakeReplicateServer
+
+MODEL_VERSION = "fake/flux-lora:0123456789abcdef"
+
+def test_webhook_before_registration_is_applied_at_submit():
+    with FakeReplicateServer(prediction_latency=30) as server:
+        client = replicate.Client(api_token="test", base_url=server.base_url)
+        prediction = client.predictions.create(version=MODEL_VERSION, input={"prompt": "a cat"})
+        tracker = PredictionTracker(client)
+        try:
+            # The webhook for the finished prediction arrives before the tracker knows the ID
+            update = dict(prediction.dict(), status="succeeded", output=["https://example.com/0.png"])
+            assert tracker.handle_update(update) is False
+
+            tracker.submit("job", MODEL_VERSION, {"prompt": "a cat"}, prediction_id=prediction.id)
+            key, output, error = tracker.completions.get(timeout=5)
+            assert (key, output, error) == ("job", ["https://example.com/0.png"], None)
+            assert tracker.in_flight() == 0
+        finally:
+            tracker.close()
+
+def test_webhook_with_a_malformed_timestamp_is_rejected():
+    tracker = PredictionTracker(replicate.Client(api_token="test"))
+    try:
+        with WebhookReceiver(tracker, host="127.0.0.1", port=0, secret="whsec_" + "c2VjcmV0" * 4) as receiver:
+            host, port = receiver.httpd.server_address[:2]
+            response = requests.post(f"http://{host}:{port}/", data=b'{"id": "p1"}', timeout=5, headers={
+                "webhook-id": "msg_1", "webhook-timestamp": "not-a-number", "webhook-signature": "v1,c2ln"})
+            assert response.status_code == 401
+            assert (receiver.received, receiver.rejected) == (0, 1)
+    finally:
+        tracker.close()
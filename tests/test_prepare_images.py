@@ -0,0 +1,50 @@
+import os
+import re
+import time
+import train_flux_lora
+from train_flux_lora import prepare_images, zip_images
+from dataset_manifest_utils import list_image_files
+
+def _make_sources(directory, count):
+    from PIL import Image
+    os.makedirs(directory)
+    for index in range(count):
+        Image.effect_noise((64, 48), 40 + index).convert("RGB").save(os.path.join(directory, f"{chr(97 + index)}.jpg"))
+
+def _stats(output):
+    line = [line for line in output.splitlines() if line.startswith("Prepared ")][-1]
+    return {name: int(count) for count, name in re.findall(r"(\d+) (written|renamed|unchanged|removed|failed)", line)}
+
+def test_same_sources_give_byte_identical_zips(tmp_path, monkeypatch):
+    monkeypatch.setattr(train_flux_lora, "NORMALIZE_MAX_WORKERS", 1)
+    sources = str(tmp_path / "sources")
+    _make_sources(sources, 4)
+
+    archives = []
+    for build in ("first", "second"):
+        output_dir = str(tmp_path / build)
+        prepare_images(sources, output_dir, "TOK")
+        archives.append(str(tmp_path / f"{build}.zip"))
+        zip_images(output_dir, archives[-1])
+        time.sleep(0.01)  # different file times must not leak into the archive
+
+    with open(archives[0], 'rb') as first, open(archives[1], 'rb') as second:
+        assert first.read() == second.read()
+
+def test_rerun_after_removing_a_source_only_moves_what_changed(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(train_flux_lora, "NORMALIZE_IMAGES", False)
+    sources = str(tmp_path / "sources")
+    output_dir = str(tmp_path / "prepared")
+    _make_sources(sources, 6)
+    prepare_images(sources, output_dir, "TOK")
+    assert _stats(capsys.readouterr().out)["written"] == 6
+
+    os.remove(os.path.join(sources, "b.jpg"))
+    prepare_images(sources, output_dir, "TOK")
+
+    assert _stats(capsys.readouterr().out) == {"written": 0, "renamed": 4, "unchanged": 1, "removed": 1, "failed": 0}
+    assert list_image_files(output_dir) == [f"{index}_A_photo_of_TOK.jpg" for index in range(5)]
+    for index, source in enumerate("acdef"):
+        with open(os.path.join(sources, f"{source}.jpg"), 'rb') as f, \
+                open(os.path.join(output_dir, f"{index}_A_photo_of_TOK.jpg"), 'rb') as prepared:
+            assert f.read() == prepared.read()
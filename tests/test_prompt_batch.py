@@ -0,0 +1,41 @@
+import json
+from prompt_batch_utils import iter_prompt_jobs, load_completed_job_ids, make_job_id
+
+def _write_lines(path, lines):
+    path.write_text("\n".join(line if isinstance(line, str) else json.dumps(line) for line in lines) + "\n")
+    return str(path)
+
+def test_invalid_and_duplicate_ids_are_skipped(tmp_path, capsys):
+    source = _write_lines(tmp_path / "prompts.jsonl", [
+        {"prompt": "a", "id": "ok_1"},
+        {"prompt": "b", "id": "../escape"},
+        {"prompt": "c", "id": "ok_1"},
+        {"prompt": "d", "id": 7},
+        {"prompt": "e", "id": ["x"]},
+    ])
+    jobs = list(iter_prompt_jobs(source, ["seed"]))
+
+    assert [(job["id"], job["line"]) for job in jobs] == [("ok_1", 1), ("7", 4)]
+    output = capsys.readouterr().out
+    assert "line 2" in output and "line 3" in output and "already used on line 1" in output and "line 5" in output
+
+def test_generated_ids_avoid_explicit_ones(tmp_path):
+    generated = make_job_id("a cat")
+    source = _write_lines(tmp_path / "prompts.jsonl", [
+        {"prompt": "a dog", "id": generated},
+        "a cat",
+        "a cat",
+    ])
+    ids = [job["id"] for job in iter_prompt_jobs(source, [])]
+
+    assert ids == [generated, f"{generated}-2", f"{generated}-3"]
+
+def test_completed_jobs_with_deleted_images_are_run_again(tmp_path):
+    kept = tmp_path / "kept.png"
+    kept.write_bytes(b"")
+    manifest = _write_lines(tmp_path / "manifest.jsonl", [
+        {"id": "a", "status": "succeeded", "outputs": [str(kept)]},
+        {"id": "b", "status": "succeeded", "outputs": [str(tmp_path / "deleted.png")]},
+        {"id": "c", "status": "failed", "outputs": []},
+    ])
+    assert load_completed_job_ids(manifest) == {"a"}
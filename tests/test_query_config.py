@@ -0,0 +1,15 @@
+import pytest
+import query_lora_model
+from config_utils import ConfigError
+
+@pytest.mark.parametrize("output_format", [None, "webp", "jpg", "jpeg", "png"])
+def test_known_transcode_formats_are_accepted(monkeypatch, output_format):
+    monkeypatch.setenv("REPLICATE_API_TOKEN", "test")
+    monkeypatch.setattr(query_lora_model, "OUTPUT_TRANSCODE_FORMAT", output_format)
+    query_lora_model.validate_config()
+
+def test_unknown_transcode_format_is_rejected(monkeypatch):
+    monkeypatch.setenv("REPLICATE_API_TOKEN", "test")
+    monkeypatch.setattr(query_lora_model, "OUTPUT_TRANSCODE_FORMAT", "gif")
+    with pytest.raises(ConfigError, match="OUTPUT_TRANSCODE_FORMAT"):
+        query_lora_model.validate_config()
@@ -0,0 +1,64 @@
+import time
+import threading
+from rate_limit_utils import RequestScheduler, PRIORITY_BATCH, PRIORITY_INTERACTIVE, PRIORITY_TRAINING
+
+def _wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+def test_waiters_are_served_by_priority():
+    scheduler = RequestScheduler(requests_per_second=None, max_in_flight=1)
+    order = []
+
+    def call(priority):
+        with scheduler.slot(priority):
+            order.append(priority)
+
+    scheduler.acquire()
+    threads = []
+    for priority in (PRIORITY_BATCH, PRIORITY_INTERACTIVE, PRIORITY_TRAINING):
+        thread = threading.Thread(target=call, args=(priority,))
+        thread.start()
+        threads.append(thread)
+        _wait_until(lambda: len(scheduler.waiting) == len(threads))
+    scheduler.release()
+    for thread in threads:
+        thread.join()
+
+    assert order == [PRIORITY_TRAINING, PRIORITY_INTERACTIVE, PRIORITY_BATCH]
+
+def test_in_flight_cap():
+    scheduler = RequestScheduler(requests_per_second=None, max_in_flight=2)
+    lock = threading.Lock()
+    active = [0]
+    peak = [0]
+
+    def request():
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+
+    wrapped = scheduler.wrap(request, PRIORITY_BATCH, operation="test")
+    threads = [threading.Thread(target=wrapped) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert peak[0] == 2
+    assert scheduler.stats()["in_flight"] == 0
+    assert scheduler.stats()["wait"]["batch"]["requests"] == 8
+
+def test_requests_are_paced_to_the_rate():
+    scheduler = RequestScheduler(requests_per_second=20, burst=1)
+    started = time.monotonic()
+    for _ in range(5):
+        with scheduler.slot():
+            pass
+    # The first request uses the burst token, the other four wait 1/20 s each
+    assert time.monotonic() - started >= 0.18
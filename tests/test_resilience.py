@@ -0,0 +1,49 @@
+import time
+import pytest
+import replicate
+from replicate.exceptions import ReplicateError
+from resilience_utils import CircuitBreaker, CircuitOpenError, RetryExhaustedError, get_circuit_breaker, retry_call
+from fake_replicate_server import FakeReplicateServer
+
+MODEL_VERSION = "fake/flux-lora:0123456789abcdef"
+
+def _create(client):
+    return client.predictions.create(version=MODEL_VERSION, input={"prompt": "test"})
+
+def test_rate_limited_create_is_retried_without_duplicates():
+    with FakeReplicateServer(error_rate=0.5, error_status=429, seed=3) as server:
+        client = replicate.Client(api_token="test", base_url=server.base_url)
+        for _ in range(10):
+            retry_call(_create, client, idempotent=False, breaker="replicate", max_attempts=30, base_delay=0.01)
+        stats = server.stats()
+
+    assert stats["injected_errors"] > 0
+    assert stats["jobs"] == 10
+    # 429s are the service pacing us, not failing, so they never open the circuit
+    assert get_circuit_breaker("replicate").state == "closed"
+
+def test_create_is_not_retried_after_server_error():
+    with FakeReplicateServer(error_rate=1.0, error_status=503) as server:
+        client = replicate.Client(api_token="test", base_url=server.base_url)
+        with pytest.raises(ReplicateError):
+            retry_call(_create, client, idempotent=False, max_attempts=5, base_delay=0.01)
+        assert server.stats()["requests"]["predictions.create"] == 1
+
+def test_server_errors_open_the_circuit_and_waiting_callers_outlast_it():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=0.3)
+    with FakeReplicateServer(error_rate=1.0, error_status=503) as server:
+        client = replicate.Client(api_token="test", base_url=server.base_url)
+        with pytest.raises(RetryExhaustedError):
+            retry_call(_create, client, breaker=breaker, max_attempts=3, base_delay=0.01)
+        assert breaker.state == "open"
+
+        # An open circuit fails fast without calling out
+        with pytest.raises(CircuitOpenError):
+            retry_call(_create, client, breaker=breaker, base_delay=0.01)
+        assert server.stats()["requests"]["predictions.create"] == 3
+
+        server.error_rate = 0
+        started = time.monotonic()
+        retry_call(_create, client, breaker=breaker, base_delay=0.01, wait_for_circuit=True)
+        assert time.monotonic() - started >= 0.2
+        assert breaker.state == "closed"
@@ -0,0 +1,75 @@
+import os
+from result_cache_utils import ResultCache, make_cache_key
+from fake_replicate_server import FakeReplicateServer
+
+IMAGE_BYTES = 1000
+
+def _urls(server, name, count=1):
+    return [f"{server.base_url}/files/{name}/{index}.png" for index in range(count)]
+
+def test_put_then_get(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    key = make_cache_key("fake/model:1", {"prompt": "a cat", "seed": 1})
+    with FakeReplicateServer(image_bytes=IMAGE_BYTES) as server:
+        files = cache.put(key, _urls(server, "a", 2))
+
+    assert [os.path.getsize(path) for path in files] == [IMAGE_BYTES, IMAGE_BYTES]
+    assert cache.get(key) == files
+    assert cache.get(make_cache_key("fake/model:1", {"prompt": "a cat", "seed": 2})) is None
+    stats = cache.stats()
+    assert (stats["entries"], stats["hits"], stats["misses"]) == (1, 1, 1)
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=2 * IMAGE_BYTES)
+    with FakeReplicateServer(image_bytes=IMAGE_BYTES) as server:
+        cache.put("a", _urls(server, "a"))
+        cache.put("b", _urls(server, "b"))
+        cache.get("a")
+        cache.put("c", _urls(server, "c"))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert not os.path.exists(tmp_path / "cache" / "b")
+
+def test_outputs_larger_than_the_cache_are_not_cached(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=IMAGE_BYTES // 2)
+    with FakeReplicateServer(image_bytes=IMAGE_BYTES) as server:
+        urls = _urls(server, "a")
+        assert cache.put("a", urls) == urls
+
+    assert cache.stats()["entries"] == 0
+    assert not os.path.exists(tmp_path / "cache" / "a")
+
+def test_failed_download_is_not_cached(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    with FakeReplicateServer(image_bytes=IMAGE_BYTES, error_rate=1.0, error_status=404) as server:
+        urls = _urls(server, "a")
+        assert cache.put("a", urls) == urls
+    assert cache.stats()["entries"] == 0
+
+def test_purge_counts_removed_entries(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    with FakeReplicateServer(image_bytes=IMAGE_BYTES) as server:
+        for key in ("a", "b", "c"):
+            cache.put(key, _urls(server, key))
+
+    assert cache.purge("missing") == 0
+    assert cache.purge("a") == 1
+    assert cache.purge() == 2
+    assert cache.stats()["entries"] == 0
+
+def test_lookups_are_saved_in_batches(tmp_path, monkeypatch):
+    import result_cache_utils
+    monkeypatch.setattr(result_cache_utils, "RESULT_CACHE_SAVE_EVERY", 3)
+    cache = ResultCache(str(tmp_path / "cache"))
+    index_path = tmp_path / "cache" / "index.json"
+
+    cache.get("a")
+    cache.get("b")
+    assert not index_path.exists()
+    cache.get("c")
+    assert ResultCache(str(tmp_path / "cache")).stats()["misses"] == 3
+
+    cache.get("d")
+    cache.close()
+    assert ResultCache(str(tmp_path / "cache")).stats()["misses"] == 4
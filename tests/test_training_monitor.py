@@ -0,0 +1,23 @@
+from training_monitor_utils import next_interval
+
+def test_interval_backs_off_until_the_cap():
+    intervals = [5]
+    for _ in range(7):
+        intervals.append(next_interval(intervals[-1], changed=False, finish_time=None, now=0))
+    assert intervals == [5, 10, 20, 40, 80, 120, 120, 120]
+
+def test_change_resets_to_the_minimum():
+    assert next_interval(80, changed=True, finish_time=None, now=0) == 5
+
+def test_interval_tightens_ahead_of_the_expected_finish():
+    # 200s to go: the next poll lands at the start of the 120s window instead of 160s from now
+    assert next_interval(80, changed=False, finish_time=200, now=0) == 80
+    assert next_interval(40, changed=False, finish_time=200, now=0) == 80
+    assert next_interval(80, changed=False, finish_time=250, now=100) == 30
+
+def test_minimum_interval_inside_the_finish_window():
+    assert next_interval(120, changed=False, finish_time=100, now=0) == 5
+
+def test_overdue_training_backs_off_again():
+    assert next_interval(5, changed=False, finish_time=100, now=160) == 10
+    assert next_interval(80, changed=False, finish_time=100, now=1000) == 120
@@ -1,20 +1,20 @@
 import os
-import replicate
-import time
+import asyncio
 import shutil
-from zipfile import ZipFile
-from dotenv import load_dotenv
 from datetime import datetime
-from httpx import RemoteProtocolError, ReadTimeout, ConnectTimeout, HTTPStatusError, RequestError
-from huggingface_hub import HfApi, create_repo, whoami
-from gdrive_large_file_utils import generate_direct_download_link
-
-# Load environment variables from .env file
-load_dotenv()
+from config_utils import ConfigError, get_env, require_env, create_replicate_client, is_replicate_error
+from dataset_source_utils import get_dataset_source
+from training_monitor_utils import monitor_trainings
+from resilience_utils import retry_call, ResilienceError
+from rate_limit_utils import get_scheduler, PRIORITY_TRAINING
+from metrics_utils import timed, increment, print_summary, write_prometheus
+from dataset_manifest_utils import (MANIFEST_FILE_NAME, IMAGE_EXTENSIONS, hash_file, list_image_files,
+                                    load_manifest, save_manifest, scan_sources, manifest_digest)
+from dataset_archive_utils import ARCHIVE_COMPRESSION, archive_is_current, write_archive_file, build_dataset_archive
+from image_normalization_utils import normalize_images, parse_max_resolution
+import dataset_validation_utils
 
 # GLOBAL VARIABLES for easy tweaks
-REPLICATE_API_TOKEN = os.getenv("REPLICATE_API_TOKEN")
-HUGGING_FACE_TOKEN = os.getenv("HUGGING_FACE_TOKEN")
 REPLICATE_OWNER = "tillo13"  # Replicate username
 HUGGING_FACE_OWNER = "andytillo1"  # Hugging Face username
 BASE_MODEL_NAME = "flux1-dev-lora"
@@ -34,33 +34,66 @@ INPUT_DIR = 'initial_images/'
 OUTPUT_DIR = 'prepared_images/'
 ZIP_FILE_NAME = 'prepared_images.zip'
 
+# Decode, EXIF-rotate, downscale to the largest RESOLUTION bucket and re-encode images as JPEG while preparing them.
+# Set to False to copy the original files unchanged.
+NORMALIZE_IMAGES = True
+NORMALIZE_JPEG_QUALITY = 95
+NORMALIZE_MAX_WORKERS = None  # None uses every CPU core
+
+# Validate the source images before they are prepared: unreadable images, images whose shorter side is below
+# MIN_IMAGE_SIDE and near-duplicate shots (NEAR_DUPLICATE_MAX_DISTANCE, both in dataset_validation_utils.py) are left
+# out of the dataset. The verdict for every image is written to VALIDATION_REPORT_FILE and the accepted images to
+# VALIDATED_MANIFEST_FILE, which is reused as long as the source images and settings are unchanged.
+VALIDATE_DATASET = True
+VALIDATION_REPORT_FILE = 'dataset_validation.json'
+VALIDATED_MANIFEST_FILE = 'dataset_validated.json'
+
+# Build the zip straight from INPUT_DIR without writing a copy of every image into OUTPUT_DIR first.
+# Set to True to keep the prepared_images/ staging directory.
+STAGE_PREPARED_IMAGES = False
+
+# Compression for zip entries: "auto" (STORED for already-compressed images), "stored", "deflated", "bzip2" or "lzma"
+ZIP_COMPRESSION = ARCHIVE_COMPRESSION
+
 # Use standard Google Drive link for the images zip file
 GOOGLE_DRIVE_PATH_TO_IMAGES_ZIP = (
     "https://drive.google.com/file/d/1JRwuj-fUkGgRlLk78jxnXivqRsNZ3bXP/view?usp=drive_link"
 )
 
+# Where the trainer downloads the images zip from:
+# "gdrive" - the pre-uploaded GOOGLE_DRIVE_PATH_TO_IMAGES_ZIP (the freshly built zip is not sent anywhere)
+# "upload" - upload the freshly built ZIP_FILE_NAME to DATASET_UPLOAD_URL (a tus resumable upload endpoint)
+# DATASET_UPLOAD_URL and the optional DATASET_UPLOAD_TOKEN are read from the environment or .env file. With a token,
+# DATASET_UPLOAD_DOWNLOAD_URL must also be set: a public URL prefix the trainer can download finished uploads from.
+DATASET_SOURCE = "gdrive"
+
 HF_REPO_ID = "andytillo1/flux-lora"
 VISIBILITY = "public"  # Or "private" for a private model
 HARDWARE = "gpu-t4"  # Replicate will override this for fine-tuned models
 DESCRIPTION = "A fine-tuned FLUX.1 model via andytillo"
 USE_CAPTIONS = False  # Set to True if you want to enable Llava autocaptioning
 MAX_RETRIES = 3
-RETRY_DELAY = 5  # seconds
+RETRY_DELAY = 5  # seconds, base of the jittered exponential backoff between attempts
+MONITOR_TRAINING = True  # Follow the training until it finishes instead of returning right after it starts
 VERSION = "ostris/flux-dev-lora-trainer:7f53f82066bcdfb1c549245a624019c26ca6e3c8034235cd4826425b61e77bec"
 
-# Ensure tokens are correctly loaded
-if not REPLICATE_API_TOKEN:
-    print("Error: REPLICATE_API_TOKEN is not set in the .env file")
-    exit(1)
-
-if not HUGGING_FACE_TOKEN:
-    print("Error: HUGGING_FACE_TOKEN is not set in the .env file")
-    exit(1)
-
-# Initialize the Replicate client with your API token
+# Check the settings a training run needs before anything is created remotely.
+# Tokens are read from the environment or .env when a command runs, never at import.
+def validate_config():
+    require_env("REPLICATE_API_TOKEN")
+    require_env("HUGGING_FACE_TOKEN")
+    if DATASET_SOURCE == "upload":
+        require_env("DATASET_UPLOAD_URL")
+        if get_env("DATASET_UPLOAD_TOKEN"):
+            require_env("DATASET_UPLOAD_DOWNLOAD_URL")
+    if DATASET_SOURCE not in ("gdrive", "upload"):
+        raise ConfigError(f"Unknown DATASET_SOURCE '{DATASET_SOURCE}'. Options: gdrive, upload")
+
+# Initialize the Replicate client with REPLICATE_API_TOKEN from the environment or .env file
+@timed("initialize_client")
 def initialize_client():
     print("Initializing Replicate client with API token...")
-    client = replicate.Client(api_token=REPLICATE_API_TOKEN)
+    client = create_replicate_client()
     print("Replicate client initialized successfully.")
     return client
 
@@ -70,148 +103,227 @@ def generate_model_name(base_name):
     return f"{base_name}-{timestamp}"
 
 # Create a new model to store your fine-tuned weights
+@timed("create_model")
 def create_model(client, owner, name, visibility, hardware, description):
     print(f"Creating a new model on Replicate to store fine-tuned weights... (Model Name: {name})")
     try:
-        model = client.models.create(
-            owner=owner,
-            name=name,
-            visibility=visibility,
-            hardware=hardware,
-            description=description
-        )
+        # Creating a model is not idempotent, so only failures that never reached Replicate are retried
+        create = get_scheduler().wrap(client.models.create, PRIORITY_TRAINING, operation="models.create")
+        model = retry_call(lambda: create(owner=owner, name=name, visibility=visibility, hardware=hardware,
+                                          description=description),
+                           idempotent=False, breaker="replicate", operation="Model creation")
         print(f"Model created: {model.name}")
         print(f"Model URL: https://replicate.com/{model.owner}/{model.name}")
         return model
-    except replicate.exceptions.ReplicateError as e:
-        print(f"Error creating model on Replicate: {str(e)}")
-        if "already exists" in str(e.detail):
-            print(f"Model creation failed: {e.detail}")
-            exit(1)
-        else:
-            raise
+    except Exception as e:
+        if is_replicate_error(e):
+            print(f"Error creating model on Replicate: {str(e)}")
+            if "already exists" in str(getattr(e, "detail", "")):
+                print(f"Model creation failed: {e.detail}")
+        raise
 
 # Create a Hugging Face repository if it doesn't exist
+@timed("create_hf_repo")
 def create_hf_repo(hf_token, repo_id):
+    from huggingface_hub import HfApi, whoami
     api = HfApi()
-    user = whoami(token=hf_token)
+    user = retry_call(whoami, token=hf_token, breaker="huggingface", operation="Hugging Face whoami")
     username = user["name"]
 
     if "/" not in repo_id:
         repo_id = f"{username}/{repo_id}"
 
     try:
-        api.create_repo(repo_id=repo_id, token=hf_token, private=(VISIBILITY == "private"), exist_ok=True)
+        # exist_ok makes repeating the call harmless, so it is retried like any idempotent request
+        retry_call(api.create_repo, repo_id=repo_id, token=hf_token, private=(VISIBILITY == "private"), exist_ok=True,
+                   breaker="huggingface", operation="Hugging Face repository creation")
         print(f"Repository '{repo_id}' created or already exists.")
     except Exception as e:
         print(f"Error creating Hugging Face repository: {e}")
-        exit(1)
-
-# Prepare images and zip them
-def prepare_images(input_dir, output_dir, token):
+        raise
+
+# Source images accepted by the dataset validation, or None (every image) when VALIDATE_DATASET is off.
+# The filtered manifest of an earlier validation is used as is while it is up to date.
+def validated_sources(input_dir):
+    if not VALIDATE_DATASET:
+        return None
+    min_side = dataset_validation_utils.MIN_IMAGE_SIDE
+    max_distance = dataset_validation_utils.NEAR_DUPLICATE_MAX_DISTANCE
+    sources = dataset_validation_utils.load_validated_sources(VALIDATED_MANIFEST_FILE, input_dir, min_side, max_distance)
+    if sources is not None:
+        print(f"Validation of '{input_dir}' is up to date: {len(sources)} images accepted (see '{VALIDATION_REPORT_FILE}').")
+        return sources
+    return dataset_validation_utils.validate_dataset(input_dir, VALIDATION_REPORT_FILE, VALIDATED_MANIFEST_FILE, min_side,
+                                                     max_distance, max_workers=NORMALIZE_MAX_WORKERS)
+
+# Prepare images incrementally: unchanged images are skipped, moved images are renamed and stale outputs are dropped.
+# sources limits the preparation to those file names, e.g. the images accepted by validated_sources.
+@timed("prepare_images")
+def prepare_images(input_dir, output_dir, token, sources=None):
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
         print(f"Directory '{output_dir}' created.")
     else:
         print(f"Directory '{output_dir}' already exists.")
 
-    # List all files in the input directory
-    files = os.listdir(input_dir)
-    image_files = [f for f in files if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-
-    for i, file_name in enumerate(image_files):
-        # Construct the new file name
-        new_file_name = f"{i}_A_photo_of_{token}.jpg"
-
-        # Construct the full file paths
-        old_path = os.path.join(input_dir, file_name)
-        new_path = os.path.join(output_dir, new_file_name)
-
-        # Copy and rename the file
-        shutil.copyfile(old_path, new_path)
-        print(f"Copied {old_path} to {new_path}")
-
-    print(f"Prepared {len(image_files)} images and saved in '{output_dir}'.")
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE_NAME)
+    previous_manifest = load_manifest(manifest_path)
+
+    # Outputs produced with different normalization settings cannot be reused
+    settings = {"normalize": NORMALIZE_IMAGES}
+    if NORMALIZE_IMAGES:
+        settings.update(max_side=parse_max_resolution(RESOLUTION), jpeg_quality=NORMALIZE_JPEG_QUALITY)
+
+    # Hash the sources (reusing hashes of files whose size and mtime are unchanged) and assign output names
+    images = scan_sources(input_dir, previous_manifest, sources)
+    for i, entry in enumerate(images):
+        entry["output"] = f"{i}_A_photo_of_{token}.jpg"
+
+    # Content currently on disk per output name, according to the previous manifest
+    current = {}
+    if previous_manifest and previous_manifest.get("settings") == settings:
+        for entry in previous_manifest.get("images", []):
+            if os.path.exists(os.path.join(output_dir, entry["output"])):
+                current[entry["output"]] = entry["sha256"]
+
+    desired = {entry["output"]: entry["sha256"] for entry in images}
+    missing_hashes = {sha256 for name, sha256 in desired.items() if current.get(name) != sha256}
+
+    # Park existing outputs whose content is needed under another name, remove the rest of the stale files
+    parked = {}
+    removed = 0
+    for file_name in sorted(os.listdir(output_dir)):
+        path = os.path.join(output_dir, file_name)
+        if file_name.startswith(".pending-"):
+            os.remove(path)
+            continue
+        if not file_name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        sha256 = current.get(file_name)
+        if file_name in desired and sha256 == desired[file_name]:
+            continue
+        if sha256 in missing_hashes and sha256 not in parked:
+            parked[sha256] = os.path.join(output_dir, f".pending-{sha256}")
+            os.replace(path, parked[sha256])
+        else:
+            os.remove(path)
+            removed += 1
+            print(f"Removed stale file {path}")
+
+    pending = []
+    renamed = skipped = 0
+    for entry in images:
+        old_path = os.path.join(input_dir, entry["source"])
+        new_path = os.path.join(output_dir, entry["output"])
+
+        if current.get(entry["output"]) == entry["sha256"]:
+            skipped += 1
+        elif entry["sha256"] in parked:
+            os.replace(parked.pop(entry["sha256"]), new_path)
+            renamed += 1
+            print(f"Renamed existing copy of {old_path} to {new_path}")
+        else:
+            pending.append((old_path, new_path))
 
-def zip_images(output_dir, zip_file_name):
-    with ZipFile(zip_file_name, 'w') as zipf:
-        for root, _, files in os.walk(output_dir):
-            for file in files:
-                if file.lower().endswith(('.jpg', '.jpeg', '.png')):
-                    zipf.write(os.path.join(root, file), file)
-                    print(f"Added {file} to {zip_file_name}")
+    # Produce the new outputs, either normalized in a process pool or as plain copies
+    failed_paths = set()
+    if NORMALIZE_IMAGES:
+        results = normalize_images(pending, settings["max_side"], NORMALIZE_JPEG_QUALITY, NORMALIZE_MAX_WORKERS)
+        failed_paths = {new_path for _, new_path, error in results if error is not None}
+    else:
+        for old_path, new_path in pending:
+            shutil.copyfile(old_path, new_path)
+            print(f"Copied {old_path} to {new_path}")
+
+    # Images that could not be decoded are left out of the manifest and therefore out of the zip
+    images = [entry for entry in images if os.path.join(output_dir, entry["output"]) not in failed_paths]
+
+    save_manifest(manifest_path, {"token": token, "settings": settings, "images": images})
+    increment("images_prepared_total", len(pending) - len(failed_paths))
+    print(f"Prepared {len(images)} images and saved in '{output_dir}' ({len(pending) - len(failed_paths)} written, "
+          f"{renamed} renamed, {skipped} unchanged, {removed} removed, {len(failed_paths)} failed).")
+
+# Zip the prepared images deterministically. The archive is only rewritten when the manifest changes.
+@timed("zip_images")
+def zip_images(output_dir, zip_file_name, compression=ARCHIVE_COMPRESSION):
+    files = list_image_files(output_dir)
+    manifest = load_manifest(os.path.join(output_dir, MANIFEST_FILE_NAME))
+    if manifest is None or sorted(entry["output"] for entry in manifest["images"]) != files:
+        manifest = {"images": [{"output": f, "sha256": hash_file(os.path.join(output_dir, f))} for f in files]}
+    manifest = dict(manifest, settings={"prepared": manifest.get("settings"), "compression": compression})
+    digest = manifest_digest(manifest)
+
+    # The manifest digest is stored as the zip comment, so an up-to-date archive can be recognised cheaply
+    if archive_is_current(zip_file_name, digest):
+        print(f"'{zip_file_name}' is up to date, skipping re-zip.")
+        return
+
+    members = ((file, os.path.join(output_dir, file), None) for file in files)
+    write_archive_file(zip_file_name, members, compression, digest.encode('ascii'))
     print(f"Images have been zipped into '{zip_file_name}'.")
 
+# Resolve the URL the trainer downloads the dataset from, using the configured DATASET_SOURCE
+def resolve_dataset_url(zip_file_name):
+    if DATASET_SOURCE == "upload":
+        dataset_source = get_dataset_source("upload", upload_url=require_env("DATASET_UPLOAD_URL"),
+                                            token=get_env("DATASET_UPLOAD_TOKEN"),
+                                            download_url=get_env("DATASET_UPLOAD_DOWNLOAD_URL"))
+    else:
+        dataset_source = get_dataset_source("gdrive", link=GOOGLE_DRIVE_PATH_TO_IMAGES_ZIP)
+    return dataset_source.resolve(zip_file_name)
+
 # Initialize the training process on Replicate
+@timed("start_training")
 def start_training(client, model, path_to_images, steps, lora_rank, optimizer, batch_size, resolution,
                    autocaption, trigger_word, learning_rate, hf_token, hf_repo_id, version, retry_delay, max_retries):
-    for attempt in range(max_retries):
-        print(f"Attempt {attempt + 1} to start the training process...")
-
-        try:
-            print("Initializing training on Replicate...")
-            training = client.trainings.create(
-                version=version,
-                input={
-                    "input_images": path_to_images,
-                    "steps": steps,
-                    "lora_rank": lora_rank,
-                    "optimizer": optimizer,
-                    "batch_size": batch_size,
-                    "resolution": resolution,
-                    "autocaption": autocaption,
-                    "trigger_word": trigger_word,
-                    "learning_rate": learning_rate,
-                    "hf_token": hf_token,
-                    "hf_repo_id": hf_repo_id,
-                },
-                destination=f"{model.owner}/{model.name}"
-            )
-
-            print(f"Training initiation payload:\n"
-                  f"{{\n"
-                  f"  'input_images': '{path_to_images}',\n"
-                  f"  'steps': {steps},\n"
-                  f"  'lora_rank': {lora_rank},\n"
-                  f"  'optimizer': '{optimizer}',\n"
-                  f"  'batch_size': {batch_size},\n"
-                  f"  'resolution': '{resolution}',\n"
-                  f"  'autocaption': {autocaption},\n"
-                  f"  'trigger_word': '{trigger_word}',\n"
-                  f"  'learning_rate': {learning_rate},\n"
-                  f"  'hf_token': '{hf_token}',\n"
-                  f"  'hf_repo_id': '{hf_repo_id}'\n"
-                  f" }}")
-
-            print("Training has started successfully.")
-            print(f"Training ID: {training.id}")
-            print(f"Training URL: https://replicate.com/p/{training.id}")
-            print("Monitor the training progress using the URL provided above. Refresh the page periodically to check the status.")
-            return training
-
-        except (RemoteProtocolError, ReadTimeout, ConnectTimeout, HTTPStatusError, RequestError) as e:
-            print(f"Attempt {attempt + 1} failed due to network issue: {e}")
-            if attempt < max_retries - 1:
-                print(f"Retrying in {retry_delay} seconds...")
-                time.sleep(retry_delay)
-            else:
-                print("Max retries reached. Exiting.")
-                exit(1)
-        except replicate.exceptions.ReplicateError as e:
-            print(f"Attempt {attempt + 1} failed due to Replicate error: {e}")
-            if attempt < max_retries - 1:
-                print(f"Retrying in {retry_delay} seconds...")
-                time.sleep(retry_delay)
-            else:
-                print("Max retries reached. Exiting.")
-                exit(1)
-        except Exception as e:
-            print(f"An unexpected error occurred during attempt {attempt + 1}: {e}")
-            exit(1)
+    print("Initializing training on Replicate...")
+
+    # Creating a training is not idempotent: a retry after an ambiguous failure could start a second paid training,
+    # so only rejected (429) and connection failures are retried
+    create = get_scheduler().wrap(client.trainings.create, PRIORITY_TRAINING, operation="trainings.create")
+    training = retry_call(lambda: create(
+        version=version,
+        input={
+            "input_images": path_to_images,
+            "steps": steps,
+            "lora_rank": lora_rank,
+            "optimizer": optimizer,
+            "batch_size": batch_size,
+            "resolution": resolution,
+            "autocaption": autocaption,
+            "trigger_word": trigger_word,
+            "learning_rate": learning_rate,
+            "hf_token": hf_token,
+            "hf_repo_id": hf_repo_id,
+        },
+        destination=f"{model.owner}/{model.name}"
+    ), idempotent=False, breaker="replicate", max_attempts=max_retries, base_delay=retry_delay, operation="Training creation")
+
+    print(f"Training initiation payload:\n"
+          f"{{\n"
+          f"  'input_images': '{path_to_images}',\n"
+          f"  'steps': {steps},\n"
+          f"  'lora_rank': {lora_rank},\n"
+          f"  'optimizer': '{optimizer}',\n"
+          f"  'batch_size': {batch_size},\n"
+          f"  'resolution': '{resolution}',\n"
+          f"  'autocaption': {autocaption},\n"
+          f"  'trigger_word': '{trigger_word}',\n"
+          f"  'learning_rate': {learning_rate},\n"
+          f"  'hf_token': '{hf_token}',\n"
+          f"  'hf_repo_id': '{hf_repo_id}'\n"
+          f" }}")
+
+    print("Training has started successfully.")
+    print(f"Training ID: {training.id}")
+    print(f"Training URL: https://replicate.com/p/{training.id}")
+    return training
 
 # Main function to encapsulate the sequence of operations
 def main():
     print("Starting main process...")
+    validate_config()
+    hf_token = require_env("HUGGING_FACE_TOKEN")
 
     client = initialize_client()
 
@@ -220,26 +332,44 @@ def main():
 
     model = create_model(client, REPLICATE_OWNER, model_name, VISIBILITY, HARDWARE, DESCRIPTION)
 
-    create_hf_repo(HUGGING_FACE_TOKEN, HF_REPO_ID)
+    create_hf_repo(hf_token, HF_REPO_ID)
 
     if USE_CAPTIONS:
         print("Captions are enabled. Configure Llava3 as USE_CAPTIONS is set to True.")
         exit(0)
 
     print("Preparing images and zipping them...")
-    prepare_images(INPUT_DIR, OUTPUT_DIR, TRIGGER_WORD)
-    zip_images(OUTPUT_DIR, ZIP_FILE_NAME)
+    sources = validated_sources(INPUT_DIR)
+    if STAGE_PREPARED_IMAGES:
+        prepare_images(INPUT_DIR, OUTPUT_DIR, TRIGGER_WORD, sources)
+        zip_images(OUTPUT_DIR, ZIP_FILE_NAME, ZIP_COMPRESSION)
+    else:
+        build_dataset_archive(INPUT_DIR, ZIP_FILE_NAME, TRIGGER_WORD, NORMALIZE_IMAGES, parse_max_resolution(RESOLUTION),
+                              NORMALIZE_JPEG_QUALITY, ZIP_COMPRESSION, NORMALIZE_MAX_WORKERS, sources)
 
     print(f"Starting training with model: {model.name} at {datetime.now()}")
 
-    # Generate the direct download link using gdrive_large_file_utils
-    direct_download_link = generate_direct_download_link(GOOGLE_DRIVE_PATH_TO_IMAGES_ZIP)
+    # Resolve the URL the trainer downloads the dataset from
+    direct_download_link = resolve_dataset_url(ZIP_FILE_NAME)
     print(f"Direct download link generated: {direct_download_link}")
 
-    start_training(client, model, direct_download_link, STEPS, LORA_RANK, OPTIMIZER, BATCH_SIZE, RESOLUTION,
-                   AUTOCAPTION, TRIGGER_WORD, LEARNING_RATE, HUGGING_FACE_TOKEN, HF_REPO_ID, VERSION, RETRY_DELAY, MAX_RETRIES)
+    training = start_training(client, model, direct_download_link, STEPS, LORA_RANK, OPTIMIZER, BATCH_SIZE, RESOLUTION,
+                              AUTOCAPTION, TRIGGER_WORD, LEARNING_RATE, hf_token, HF_REPO_ID, VERSION, RETRY_DELAY, MAX_RETRIES)
+
+    if MONITOR_TRAINING:
+        asyncio.run(monitor_trainings(client, [training.id]))
+    else:
+        print("Monitor the training progress using the URL provided above, or with: python cli.py monitor " + training.id)
 
     print(f"Training process completed at {datetime.now()}")
+    print_summary()
+    write_prometheus()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    try:
+        main()
+    except Exception as e:
+        if not isinstance(e, (ResilienceError, ConfigError)) and not is_replicate_error(e):
+            raise
+        print(f"Error: {e}")
+        exit(1)
\ No newline at end of file
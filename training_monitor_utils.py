@@ -0,0 +1,121 @@
+import sys
+import time
+import asyncio
+from datetime import datetime, timezone
+from resilience_utils import retry_call
+from rate_limit_utils import get_scheduler, PRIORITY_INTERACTIVE
+
+# GLOBAL VARIABLES for easy tweaks
+
+# Polling interval bounds (seconds). A job that shows no change backs off from the minimum towards the maximum.
+MONITOR_MIN_INTERVAL = 5
+MONITOR_MAX_INTERVAL = 120
+MONITOR_BACKOFF_FACTOR = 2
+
+# Rough training speed used to predict when a job finishes; polling tightens to the minimum interval near that time
+EXPECTED_SECONDS_PER_STEP = 1.5
+TIGHTEN_WINDOW = 120  # seconds before the expected finish time
+
+TERMINAL_STATUSES = ("succeeded", "failed", "canceled")
+
+def _parse_timestamp(value):
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.timestamp()
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).astimezone(timezone.utc).timestamp()
+    except ValueError:
+        return None
+
+# Predicted finish time (epoch seconds) from the step count and start time, or None if unknown
+def expected_finish_time(training, seconds_per_step=EXPECTED_SECONDS_PER_STEP):
+    started_at = _parse_timestamp(getattr(training, "started_at", None))
+    steps = (getattr(training, "input", None) or {}).get("steps")
+    if started_at is None or not steps:
+        return None
+    return started_at + steps * seconds_per_step
+
+# Next polling interval: reset on change, back off while idle, and never sleep past the expected finish window.
+# Within the window polling stays at the minimum; a job still running after its expected finish backs off again.
+def next_interval(interval, changed, finish_time, now, min_interval=MONITOR_MIN_INTERVAL,
+                  max_interval=MONITOR_MAX_INTERVAL, backoff_factor=MONITOR_BACKOFF_FACTOR):
+    interval = min_interval if changed else min(interval * backoff_factor, max_interval)
+    if finish_time is not None:
+        remaining = finish_time - now
+        if remaining > TIGHTEN_WINDOW:
+            interval = min(interval, max(min_interval, remaining - TIGHTEN_WINDOW))
+        elif remaining > 0:
+            interval = min_interval
+    return interval
+
+# Poll one training until it reaches a terminal state, printing only log lines that have not been shown yet.
+# The API always returns the full log, so the delta is computed locally against what was already printed.
+async def _monitor_training(client, training_id, on_update=None):
+    interval = MONITOR_MIN_INTERVAL
+    last_status = None
+    printed_logs = ""
+
+    while True:
+        get_training = get_scheduler().wrap(client.trainings.get, PRIORITY_INTERACTIVE, operation="trainings.get")
+        # The training is already running and billed, so status checks wait out an open circuit instead of giving up
+        training = await asyncio.to_thread(retry_call, get_training, training_id, breaker="replicate", wait_for_circuit=True,
+                                           operation=f"Status check of {training_id}")
+        logs = training.logs or ""
+        changed = training.status != last_status or logs != printed_logs
+
+        if training.status != last_status:
+            print(f"[{training_id}] Status: {training.status}")
+            last_status = training.status
+
+        if logs != printed_logs:
+            delta = logs[len(printed_logs):] if logs.startswith(printed_logs) else logs
+            for line in delta.splitlines():
+                print(f"[{training_id}] {line}")
+            printed_logs = logs
+
+        if on_update is not None:
+            on_update(training)
+
+        if training.status in TERMINAL_STATUSES:
+            return training
+
+        interval = next_interval(interval, changed, expected_finish_time(training), time.time())
+        await asyncio.sleep(interval)
+
+# Track many trainings at once on one event loop and return {training_id: final training} once all are terminal.
+# A training that cannot be followed (e.g. its status checks keep failing) maps to the exception instead,
+# without stopping the others.
+async def monitor_trainings(client, training_ids, on_update=None):
+    training_ids = list(dict.fromkeys(training_ids))
+    print(f"Monitoring {len(training_ids)} training(s)...")
+    trainings = await asyncio.gather(*(_monitor_training(client, training_id, on_update) for training_id in training_ids),
+                                     return_exceptions=True)
+
+    results = dict(zip(training_ids, trainings))
+    for training_id, training in results.items():
+        if isinstance(training, BaseException):
+            if not isinstance(training, Exception):
+                raise training
+            print(f"Training {training_id} could not be monitored: {training}")
+            continue
+        print(f"Training {training_id} finished with status '{training.status}'.")
+        if training.status == "succeeded" and training.output:
+            print(f"  Output: {training.output}")
+        elif training.error:
+            print(f"  Error: {training.error}")
+    return results
+
+if __name__ == '__main__':
+    from config_utils import ConfigError, create_replicate_client
+
+    if len(sys.argv) < 2:
+        print("Usage: python training_monitor_utils.py <training_id> [<training_id> ...]")
+        exit(1)
+    try:
+        client = create_replicate_client()
+    except ConfigError as e:
+        print(f"Error: {e}")
+        exit(1)
+    results = asyncio.run(monitor_trainings(client, sys.argv[1:]))
+    exit(0 if all(getattr(training, "status", None) == "succeeded" for training in results.values()) else 1)